@@ -0,0 +1,385 @@
+"""Benchmarks of encoders, grids, and the writer on synthetic fields.
+
+Usage:
+
+    python benchmarks/run.py                  # runs and compares with the baseline
+    python benchmarks/run.py --check          # exits with 1 on regressions
+    python benchmarks/run.py --save           # updates the baseline
+    python benchmarks/run.py -k masked        # runs benchmarks matching "masked"
+
+Each benchmark reports the best time of repeated runs, the throughput in MB/s of
+the input data and, if it writes messages, in messages/s, as well as the peak memory
+allocated during a separate run traced with `tracemalloc`. Baselines depend on the
+machine, so they should be saved again on the machine used for comparison.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+import gribcoder
+from gribcoder.encoders import create_bitmap
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_TOLERANCE = 0.2
+
+SHAPE_OF_THE_EARTH = np.array(
+    [(6, 0xFF, 0xFFFFFFFF, 0xFF, 0xFFFFFFFF, 0xFF, 0xFFFFFFFF)],
+    dtype=gribcoder.DTYPE_SHAPE_OF_THE_EARTH,
+)
+
+
+class Benchmark(NamedTuple):
+    name: str
+    setup: Callable[[], tuple]  # returns arguments of `run`
+    run: Callable[..., None]
+    nbytes: Callable[..., int]  # of input data
+    num_messages: int = 0
+    repeat: int = 5
+
+
+class Result(NamedTuple):
+    seconds: float
+    mb_per_s: float
+    messages_per_s: float
+    peak_mb: float
+
+
+def create_lat_lon(resolution: float, region=(90.0, -90.0, 0.0, 360.0)):
+    north, south, west, east = region
+    lat = np.linspace(north, south, round((north - south) / resolution) + 1)
+    lon = np.arange(west, east, resolution)
+    return np.meshgrid(lat, lon, indexing="ij")
+
+
+def create_smooth_field(lat: np.ndarray, lon: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Returns a temperature-like field with large-scale patterns and noise."""
+    rng = np.random.default_rng(seed)
+    lat_rad = np.deg2rad(lat)
+    lon_rad = np.deg2rad(lon)
+    field = 288.0 - 40.0 * np.sin(lat_rad) ** 2
+    field += 5.0 * np.sin(3 * lon_rad) * np.cos(2 * lat_rad)
+    field += rng.normal(0.0, 0.5, lat.shape)
+    return field
+
+
+def create_ocean_mask(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Returns a mask with about 70% of points masked as land, in blobs."""
+    lat_rad = np.deg2rad(lat)
+    lon_rad = np.deg2rad(lon)
+    pattern = np.sin(2 * lon_rad) * np.cos(3 * lat_rad) + np.sin(5 * lon_rad + lat_rad)
+    return pattern > -0.5
+
+
+def create_grid(lat: np.ndarray, lon: np.ndarray) -> gribcoder.LatitudeLongitudeGrid:
+    grid = gribcoder.LatitudeLongitudeGrid.from_ndarrays(lat, lon)
+    return grid.shape_of_the_earth(SHAPE_OF_THE_EARTH)
+
+
+def create_product(forecast_time: int) -> gribcoder.ProductDefinitionWithTemplate4_0:
+    return (
+        gribcoder.ProductDefinitionWithTemplate4_0(0)
+        .parameter(gribcoder.ProductParameter(0, 0))
+        .generating_process(
+            np.array(
+                [(0, 0xFF, 0xFF)], dtype=gribcoder.DTYPE_SECTION_4_GENERATING_PROCESS
+            )
+        )
+        .forecast_time(
+            np.array(
+                [(0, 0, 1, forecast_time)],
+                dtype=gribcoder.DTYPE_SECTION_4_FORECAST_TIME,
+            )
+        )
+        .horizontal((gribcoder.FixedSurface(103, 0, 2), None))
+    )
+
+
+def write_message(f, grid, product, encoder):
+    ind = gribcoder.Indicator(0)
+    ident = gribcoder.Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with gribcoder.Grib2MessageWriter(f, ind, ident) as grib2:
+        grib2._write_sect3(grid)
+        grib2._write_sect4(product)
+        grib2._write_sect5(encoder)
+        grib2._write_sect6(encoder)
+        grib2._write_sect7(encoder)
+
+
+def setup_global(resolution: float, masked: bool = False, nan: bool = False):
+    def setup():
+        lat, lon = create_lat_lon(resolution)
+        data = create_smooth_field(lat, lon)
+        if masked:
+            data = np.ma.MaskedArray(data, mask=create_ocean_mask(lat, lon))
+        if nan:
+            data[create_ocean_mask(lat, lon)] = np.nan
+        return (create_grid(lat, lon), data)
+
+    return setup
+
+
+def run_encoding(_grid, data):
+    gribcoder.SimplePackingEncoder.auto_parametrized_from(data, nbit=16).encode()
+
+
+def run_encoding_nan_as_missing(_grid, data):
+    gribcoder.SimplePackingEncoder.auto_parametrized_from(
+        data, nbit=16, missing=np.nan
+    ).encode()
+
+
+def run_encoder_selection(_grid, data):
+    gribcoder.select_encoder(data, nbit=16).encode()
+
+
+def run_writing(grid, data):
+    encoder = gribcoder.SimplePackingEncoder.auto_parametrized_from(data, nbit=16)
+    with BytesIO() as f:
+        write_message(f, grid, create_product(0), encoder)
+
+
+NUM_LEVELS = 50
+
+
+def setup_stack():
+    lat, lon = create_lat_lon(1.0)
+    stack = np.stack([create_smooth_field(lat, lon, i) for i in range(NUM_LEVELS)])
+    return (None, stack)
+
+
+def run_stack_encoding(_grid, stack):
+    gribcoder.encode_slices(stack, nbit=16)
+
+
+def setup_mask():
+    lat, lon = create_lat_lon(0.25)
+    return (create_ocean_mask(lat, lon).ravel(),)
+
+
+def run_bitmap_creation(mask):
+    create_bitmap(mask)
+
+
+def setup_lat_lon():
+    return create_lat_lon(0.1)
+
+
+def run_grid_creation(lat, lon):
+    gribcoder.LatitudeLongitudeGrid.from_ndarrays(lat, lon)
+
+
+NUM_REGIONAL_FIELDS = 1000
+
+
+def setup_regional():
+    lat, lon = create_lat_lon(0.05, region=(36.0, 33.0, 138.0, 141.0))
+    fields = [
+        create_smooth_field(lat, lon, seed) for seed in range(NUM_REGIONAL_FIELDS)
+    ]
+    products = [create_product(i) for i in range(NUM_REGIONAL_FIELDS)]
+    return (create_grid(lat, lon), fields, products)
+
+
+def run_regional_writing(grid, fields, products):
+    with BytesIO() as f:
+        for data, product in zip(fields, products):
+            encoder = gribcoder.SimplePackingEncoder.auto_parametrized_from(
+                data, nbit=12
+            )
+            write_message(f, grid, product, encoder)
+
+
+def run_regional_writing_with_template(grid, fields, products):
+    ind = gribcoder.Indicator(0)
+    ident = gribcoder.Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    template = gribcoder.MessageTemplate(ind, ident, grid, products[0])
+    with BytesIO() as f:
+        for i, data in enumerate(fields):
+            encoder = gribcoder.SimplePackingEncoder.auto_parametrized_from(
+                data, nbit=12
+            )
+            with template.writer(f) as grib2:
+                grib2._write_sect3(template.grid_section())
+                grib2._write_sect4(template.product_section(forecast_time=i))
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+
+
+def nbytes_of_data(_grid, data) -> int:
+    return data.nbytes
+
+
+def nbytes_of_fields(_grid, fields, _products) -> int:
+    return sum(data.nbytes for data in fields)
+
+
+BENCHMARKS = [
+    Benchmark("encode_global_0p25", setup_global(0.25), run_encoding, nbytes_of_data),
+    Benchmark(
+        "encode_global_0p1", setup_global(0.1), run_encoding, nbytes_of_data, repeat=3
+    ),
+    Benchmark("write_global_0p25", setup_global(0.25), run_writing, nbytes_of_data, 1),
+    Benchmark("write_global_0p1", setup_global(0.1), run_writing, nbytes_of_data, 1, 3),
+    Benchmark(
+        "encode_masked_ocean_0p25",
+        setup_global(0.25, masked=True),
+        run_encoding,
+        nbytes_of_data,
+    ),
+    Benchmark(
+        "encode_nan_ocean_0p25",
+        setup_global(0.25, nan=True),
+        run_encoding_nan_as_missing,
+        nbytes_of_data,
+    ),
+    Benchmark(
+        "write_masked_ocean_0p25",
+        setup_global(0.25, masked=True),
+        run_writing,
+        nbytes_of_data,
+        1,
+    ),
+    Benchmark(
+        "select_encoder_global_0p25",
+        setup_global(0.25),
+        run_encoder_selection,
+        nbytes_of_data,
+        repeat=3,
+    ),
+    Benchmark(
+        "encode_stack_1p0_50_levels", setup_stack, run_stack_encoding, nbytes_of_data
+    ),
+    Benchmark(
+        "create_bitmap_0p25",
+        setup_mask,
+        run_bitmap_creation,
+        lambda mask: mask.size,
+        repeat=50,  # runs in a fraction of a millisecond
+    ),
+    Benchmark(
+        "grid_from_ndarrays_0p1",
+        setup_lat_lon,
+        run_grid_creation,
+        lambda lat, lon: lat.nbytes + lon.nbytes,
+    ),
+    Benchmark(
+        "write_regional_fields",
+        setup_regional,
+        run_regional_writing,
+        nbytes_of_fields,
+        NUM_REGIONAL_FIELDS,
+        3,
+    ),
+    Benchmark(
+        "write_regional_fields_with_template",
+        setup_regional,
+        run_regional_writing_with_template,
+        nbytes_of_fields,
+        NUM_REGIONAL_FIELDS,
+        3,
+    ),
+]
+
+
+def measure(benchmark: Benchmark) -> Result:
+    args = benchmark.setup()
+    benchmark.run(*args)  # warming up
+
+    seconds = float("inf")
+    for _ in range(benchmark.repeat):
+        start = time.perf_counter()
+        benchmark.run(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        benchmark.run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        seconds=seconds,
+        mb_per_s=benchmark.nbytes(*args) / 1e6 / seconds,
+        messages_per_s=benchmark.num_messages / seconds,
+        peak_mb=peak / 1e6,
+    )
+
+
+def find_regressions(result: Result, baseline: dict, tolerance: float) -> list:
+    if not baseline:
+        return []
+    regressions = []
+    if result.mb_per_s < baseline["mb_per_s"] * (1 - tolerance):
+        regressions.append("throughput")
+    if result.peak_mb > baseline["peak_mb"] * (1 + tolerance):
+        regressions.append("peak memory")
+    return regressions
+
+
+def format_result(name: str, result: Result, baseline: dict, regressions: list):
+    def change(key: str) -> str:
+        if not baseline:
+            return ""
+        return f"({getattr(result, key) / baseline[key] - 1:+.0%})"
+
+    messages_per_s = ""
+    if result.messages_per_s > 0:
+        messages_per_s = f"{result.messages_per_s:.1f} msg/s"
+    line = (
+        f"{name:<36}"
+        f"{result.mb_per_s:10.1f} MB/s {change('mb_per_s'):>7}"
+        f"{messages_per_s:>16}"
+        f"{result.peak_mb:10.1f} MB peak {change('peak_mb'):>7}"
+    )
+    if regressions:
+        line += f"  REGRESSION: {', '.join(regressions)}"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", default="", help="runs benchmarks containing this")
+    parser.add_argument("--save", action="store_true", help="updates the baseline")
+    parser.add_argument("--check", action="store_true", help="fails on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.baseline.exists():
+        baselines = json.loads(args.baseline.read_text())
+
+    results = {}
+    regressed = []
+    for benchmark in BENCHMARKS:
+        if args.k not in benchmark.name:
+            continue
+        result = measure(benchmark)
+        results[benchmark.name] = result
+        baseline = baselines.get(benchmark.name, {})
+        regressions = find_regressions(result, baseline, args.tolerance)
+        if regressions:
+            regressed.append(benchmark.name)
+        print(format_result(benchmark.name, result, baseline, regressions), flush=True)
+
+    if args.save:
+        baselines.update({name: result._asdict() for name, result in results.items()})
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"saved to {args.baseline}")
+    if args.check and regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
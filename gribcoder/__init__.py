@@ -1,7 +1,27 @@
 from .context import Grib2MessageWriter
-from .encoders import BaseEncoder, SimplePackingEncoder
+from .encoders import (
+    BaseEncoder,
+    ComplexPackingEncoder,
+    IeeeFloatEncoder,
+    PngPackingEncoder,
+    RunLengthPackingEncoder,
+    SimplePackingEncoder,
+    encode_slices,
+)
 from .grid import DTYPE_SHAPE_OF_THE_EARTH, BaseGrid, LatitudeLongitudeGrid
+from .instrument import Instrumentation, MessageReport, SectionReport
+from .inventory import InventoryWriter
+from .layout import (
+    Message,
+    MessageLayout,
+    SectionLayout,
+    estimate_message_size,
+    plan_layout,
+    write_messages,
+)
+from .merge import copy_messages
 from .message import Identification, Indicator
+from .parallel import Field, write_fields
 from .product import (
     DTYPE_SECTION_4_FORECAST_TIME,
     DTYPE_SECTION_4_GENERATING_PROCESS,
@@ -11,6 +31,9 @@ from .product import (
     ProductDefinitionWithTemplate4_0,
     ProductParameter,
 )
+from .reader import Grib2Field, Grib2Reader
+from .selection import select_encoder
+from .template import MessageTemplate
 
 __version__ = "0.2.1"
 
@@ -18,6 +41,12 @@ __all__ = [
     "Grib2MessageWriter",
     "BaseEncoder",
     "SimplePackingEncoder",
+    "ComplexPackingEncoder",
+    "PngPackingEncoder",
+    "IeeeFloatEncoder",
+    "RunLengthPackingEncoder",
+    "encode_slices",
+    "select_encoder",
     "DTYPE_SHAPE_OF_THE_EARTH",
     "BaseGrid",
     "LatitudeLongitudeGrid",
@@ -30,4 +59,20 @@ __all__ = [
     "ProductDefinitionWithTemplate4_0",
     "Identification",
     "Indicator",
+    "MessageTemplate",
+    "Field",
+    "write_fields",
+    "Message",
+    "MessageLayout",
+    "SectionLayout",
+    "plan_layout",
+    "write_messages",
+    "estimate_message_size",
+    "InventoryWriter",
+    "Grib2Reader",
+    "Grib2Field",
+    "copy_messages",
+    "Instrumentation",
+    "SectionReport",
+    "MessageReport",
 ]
@@ -2,22 +2,59 @@ from __future__ import annotations
 
 import contextlib
 import dataclasses
-from typing import BinaryIO, Callable
+import io
+import time
+from typing import BinaryIO, Callable, Optional
 
-from .encoders import BaseEncoder
+from .encoders import BaseEncoder, write_previously_defined_bitmap_sect6
 from .grid import BaseGrid
+from .instrument import Instrumentation, _MessageRecorder
+from .inventory import InventoryField, InventoryWriter
 from .message import Identification, Indicator
 from .product import BaseProductDefinition
+from .utils import GatherWriter
 
 
 @dataclasses.dataclass
 class Grib2MessageWriter:
+    """A writer of a GRIB2 message to `f`.
+
+    If `f` is seekable, sections are written to it as they are given and the total
+    length in Section 0 is updated at the end. Otherwise, as with pipes, sockets, and
+    `sys.stdout.buffer`, the message is assembled in memory and written to `f` at once
+    when it is closed.
+
+    If `gather` is True, the message is assembled in memory also for seekable `f`, so
+    that it costs one `os.writev` call for files with file descriptors instead of a
+    write call for every part of the sections, which pays off for unbuffered or
+    network-backed files. Encoded data are not copied in assembling, but kept in
+    memory until the message is closed.
+
+    If `index` is given, the fields of the message are added to the inventory when it
+    is closed. Sections 1 and 4 needed for it are kept when they are written instead
+    of being read back from `f`.
+
+    If `instrumentation` is given, its callbacks receive the time, the number of
+    octets, and the time of phases such as encoding spent in writing each section
+    and the message."""
+
     f: BinaryIO
     ind: Indicator
     ident: Identification
+    gather: bool = False
+    index: Optional[InventoryWriter] = None
+    instrumentation: Optional[Instrumentation] = None
     _size: int = dataclasses.field(default=0, init=False)
     _last_sect_no: int = dataclasses.field(default=0, init=False)
     _start_pos: int = dataclasses.field(init=False)
+    _out: BinaryIO = dataclasses.field(init=False)
+    _gathering: bool = dataclasses.field(default=False, init=False)
+    _recorder: _MessageRecorder | None = dataclasses.field(default=None, init=False)
+    _last_bitmap_digest: bytes | None = dataclasses.field(default=None, init=False)
+    _sect1: bytes = dataclasses.field(default=b"", init=False)
+    _field_start: int = dataclasses.field(default=0, init=False)
+    _sect4: bytes = dataclasses.field(default=b"", init=False)
+    _fields: list[InventoryField] = dataclasses.field(default_factory=list, init=False)
 
     def __enter__(self):
         self._check_file()
@@ -32,21 +69,42 @@ class Grib2MessageWriter:
     def close(self):
         self._write_sect8()
         self._finalize_size()
+        offset = self._start_pos
+        io_seconds = 0.0
+        if self._gathering:
+            offset = self.f.tell() if self.f.seekable() else None
+            start = time.perf_counter()
+            self._out.write_to(self.f)
+            io_seconds = time.perf_counter() - start
+            self._out = self.f
+            self._gathering = False
+        if self.index is not None:
+            self.index.add_message(
+                offset, self._size, self.ind.discipline, self._sect1, self._fields
+            )
+        if self._recorder is not None:
+            self._recorder.end_message(self._size, io_seconds)
 
     def _check_file(self):
         if not self.f.writable():
             raise RuntimeError("file is not writable")
-        if not self.f.seekable():
-            raise RuntimeError("file is not seekable")
-        self._start_pos = self.f.tell()
+        self._gathering = self.gather or not self.f.seekable()
+        self._out = GatherWriter() if self._gathering else self.f
+        self._start_pos = self._out.tell()
+        if self.instrumentation is not None:
+            self._recorder = _MessageRecorder(self.instrumentation)
+            self._out = self._recorder.wrap(self._out)
 
     def _write_sect0(self):
         with self._section_context(0):
-            self._size += self.ind.write(self.f)
+            self._size += self.ind.write(self._out)
 
     def _write_sect1(self):
         with self._section_context(1):
-            self._size += self.ident.write(self.f)
+            if self.index is None:
+                self._size += self.ident.write(self._out)
+            else:
+                self._sect1 = self._write_kept(self.ident)
 
     def _write_sect2(self):
         with self._section_context(2, lambda x: x == 7):
@@ -54,32 +112,61 @@ class Grib2MessageWriter:
 
     def _write_sect3(self, grid: BaseGrid):
         with self._section_context(3, lambda x: x == 1 or x == 7):
-            self._size += grid.write(self.f)
+            self._field_start = self._size
+            self._size += grid.write(self._out)
 
     def _write_sect4(self, product: BaseProductDefinition):
         with self._section_context(4, lambda x: x == 7):
-            self._size += product.write(self.f)
+            if self._last_sect_no != 3:
+                self._field_start = self._size
+            if self.index is None:
+                self._size += product.write(self._out)
+            else:
+                self._sect4 = self._write_kept(product)
 
     def _write_sect5(self, encoder: BaseEncoder):
         with self._section_context(5):
-            self._size += encoder.write_sect5(self.f)
+            self._size += encoder.write_sect5(self._out)
 
     def _write_sect6(self, encoder: BaseEncoder):
         with self._section_context(6):
-            self._size += encoder.write_sect6(self.f)
+            # a bitmap identical to the last one in this message is not written again
+            digest = encoder.bitmap_digest()
+            if digest is not None and digest == self._last_bitmap_digest:
+                self._size += write_previously_defined_bitmap_sect6(self._out)
+            else:
+                self._size += encoder.write_sect6(self._out)
+                self._last_bitmap_digest = digest
 
     def _write_sect7(self, encoder: BaseEncoder):
         with self._section_context(7):
-            self._size += encoder.write_sect7(self.f)
+            self._size += encoder.write_sect7(self._out)
+            if self.index is not None:
+                length = self._size - self._field_start
+                field = InventoryField(self._field_start, length, self._sect4)
+                self._fields.append(field)
+
+    def _write_kept(self, section: Identification | BaseProductDefinition) -> bytes:
+        """Writes `section` and returns its octets."""
+        with io.BytesIO() as buf:
+            section.write(buf)
+            octets = buf.getvalue()
+        self._out.write(octets)
+        self._size += len(octets)
+        return octets
 
     def _write_sect8(self):
         with self._section_context(8):
-            self._size += self.f.write(b"\x37\x37\x37\x37")
+            self._size += self._out.write(b"\x37\x37\x37\x37")
 
     def _finalize_size(self):
+        if self.ind.total_length == self._size:
+            return  # Section 0 was written with the right length in advance
         self.ind.total_length = self._size
-        self.f.seek(self._start_pos)
-        self.ind.write(self.f)
+        end_pos = self._out.tell()
+        self._out.seek(self._start_pos)
+        self.ind.write(self._out)
+        self._out.seek(end_pos)
 
     @contextlib.contextmanager
     def _section_context(self, sect_no: int, cond: Callable[[int], bool] | None = None):
@@ -93,5 +180,15 @@ class Grib2MessageWriter:
             raise RuntimeError(
                 f"wrong section order: {self._last_sect_no} -> {sect_no}"
             )
-        yield
+        if self._recorder is None:
+            yield
+        else:
+            size = self._size
+            self._recorder.start_section()
+            try:
+                yield
+            except BaseException:
+                self._recorder.abort_section()
+                raise
+            self._recorder.end_section(sect_no, self._size - size)
         self._last_sect_no = sect_no
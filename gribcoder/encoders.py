@@ -1,14 +1,75 @@
 from __future__ import annotations
 
 import dataclasses
+import hashlib
+import struct
+import zlib
 from abc import ABC, abstractmethod
-from math import ceil, log2
-from typing import BinaryIO
+from math import ceil, floor, log2, log10
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple, Sequence
 
 import numpy as np
 from nptyping import Bool, NDArray, Shape, UInt8
 
-from .utils import SECT_HEADER_DTYPE, create_sect_header, grib_signed, write
+from .instrument import measuring
+from .utils import (
+    SECT_HEADER_DTYPE,
+    BitPacker,
+    BufferWriter,
+    create_sect_header,
+    grib_signed,
+    pack_bits,
+    write,
+)
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+# identity of the bitmap until it is created, which may then be None
+_NOT_CREATED = np.empty(0, dtype=np.uint8)
+
+_DTYPE_SECTION_5 = np.dtype(
+    [
+        ("num_of_values", ">u4"),
+        ("template_num", ">u2"),
+    ]
+)
+
+_DTYPE_TEMPLATE_5_0 = np.dtype(
+    [
+        ("reference_value", ">f4"),
+        ("binary_scale_factor", ">u2"),  # grib_signed
+        ("decimal_scale_factor", ">u2"),  # grib_signed
+        ("bits_per_value", "u1"),
+        ("type_of_original_field_values", "u1"),
+    ]
+)
+
+_DTYPE_TEMPLATE_5_2 = np.dtype(
+    [
+        ("reference_value", ">f4"),
+        ("binary_scale_factor", ">u2"),  # grib_signed
+        ("decimal_scale_factor", ">u2"),  # grib_signed
+        ("bits_per_group_reference_value", "u1"),
+        ("type_of_original_field_values", "u1"),
+        ("group_splitting_method_used", "u1"),
+        ("missing_value_management_used", "u1"),
+        ("primary_missing_value_substitute", ">u4"),
+        ("secondary_missing_value_substitute", ">u4"),
+        ("number_of_groups_of_data_values", ">u4"),
+        ("reference_for_group_widths", "u1"),
+        ("bits_for_group_widths", "u1"),
+        ("reference_for_group_lengths", ">u4"),
+        ("length_increment_for_the_group_lengths", "u1"),
+        ("true_length_of_last_group", ">u4"),
+        ("bits_for_scaled_group_lengths", "u1"),
+    ]
+)
+
+_DTYPE_TEMPLATE_5_4 = np.dtype(
+    [
+        ("precision", "u1"),
+    ]
+)
 
 
 class BaseEncoder(ABC):
@@ -24,6 +85,29 @@ class BaseEncoder(ABC):
     def write_sect7(self, f: BinaryIO) -> int:
         return 0
 
+    def bitmap_digest(self) -> bytes | None:
+        """Returns a digest of the bitmap written in Section 6, or None if no bitmap is
+        written or the digest is not available.
+
+        Writers use the digest to replace a bitmap identical to the previous one in a
+        message with a reference to it."""
+        return None
+
+    def sect_lens(self) -> tuple[int, int, int] | None:
+        """Returns lengths of Sections 5, 6, and 7 if they are known without encoding
+        the data, or None otherwise."""
+        return None
+
+    def sect_lens_for(
+        self, shape: tuple[int, ...], mask: np.ndarray | None = None
+    ) -> tuple[int, int, int] | None:
+        """Returns lengths of Sections 5, 6, and 7 for data of `shape` if they are
+        known without the data values, or None otherwise.
+
+        `mask` is a boolean array in which True means missing as in
+        `np.ma.MaskedArray`. If it is given, a bitmap is assumed to be written."""
+        return None
+
 
 @dataclasses.dataclass
 class SimplePackingEncoder(BaseEncoder):
@@ -32,9 +116,18 @@ class SimplePackingEncoder(BaseEncoder):
     d: int
     n: int
 
+    _block_size = None
+    _missing_value = None
+    _valid_values = None
+    _template_num = 0
+
     @classmethod
     def auto_parametrized_from(
-        cls, data: np.ndarray, scaling: str = "simple-linear", **kwargs
+        cls,
+        data: np.ndarray,
+        scaling: str = "simple-linear",
+        missing: float | None = None,
+        **kwargs,
     ):
         """Constructs an encoder with parameter sets.
 
@@ -42,184 +135,1213 @@ class SimplePackingEncoder(BaseEncoder):
           given "nbit"
         - "fixed-digit-linear" prepares an encoder with parameter sets for linear
           scaling for given "decimals" (number of decimal places; precision)
+        - "max-error" prepares an encoder with the smallest "n" for which decoded
+          values differ from the input by at most given "max_error", or by
+          "relative_error" times the largest absolute value of the input, choosing
+          the binary and decimal scale factors together
+
+        If `missing` is given, values equal to it are treated as missing as with
+        `with_missing_value`.
         """
-        if np.ma.isMaskedArray(data) and data.mask.all():
-            r, d, n = 0.0, 0, 0
-        elif np.ma.isMaskedArray(data) and _is_unique(values := data[~data.mask]):
-            r, d, n = values[0], 0, 0
-        elif _is_unique(data):
-            r, d, n = data[0], 0, 0
-        elif scaling == "simple-linear":
-            n = kwargs["nbit"]
-            r, d = _get_parameters_simple_linear(data, n)
-        elif scaling == "fixed-digit-linear":
-            d = kwargs["decimals"]
-            r, n = _get_parameters_fixed_digit_linear(data, d)
+        if missing is None:
+            stats = compute_statistics(data)
         else:
-            raise RuntimeError(f"unsupported scaling type: {scaling}")
-
-        return cls(r, 0, d, n).input(data)
+            values, bitmap, stats = _split_missing(data, missing)
+        r, e, d, n = _get_parameters(stats, scaling, kwargs)
+        encoder = cls(r, e, d, n).input(data)
+        if missing is not None:
+            encoder.with_missing_value(missing)
+            encoder._valid_values, encoder._bitmap = values, bitmap
+        encoder._stats = stats
+        return encoder
 
     def input(self, data: np.ndarray):  # `-> Self` for Python >=3.11 (PEP 673)
         """Sets input data to be encoded.
 
         The input must be an instance of `np.ndarray` or `np.ma.MaskedArray`. If it is
         an `np.ma.MaskedArray`, a bitmap is also created in the process of the
-        encoding; otherwise, no bitmap is created.
+        encoding; otherwise, no bitmap is created unless `with_missing_value` is used.
+
+        Statistics of the input computed in `auto_parametrized_from` are kept as long
+        as the same array object is given, so that the data is not scanned again.
         """
+        if data is not getattr(self, "_input", None):
+            self._stats: FieldStatistics | None = None
         self._input = data
-        self._encoded = None
+        self._encoded: np.ndarray | None = None
+        self._valid_values = None
+        self._bitmap: np.ndarray | None = _NOT_CREATED
+        self._bitmap_digest: bytes | None = None
         return self
 
-    def encode(self) -> tuple[np.ndarray, np.ndarray]:
-        """Packs and returns two `np.ndarray`s. The first one is an array containing
-        encoded values with `n` bits occupied for each element, and the second one is a
-        bitmap array."""
-        if self._encoded is not None:
-            return (self._encoded, self._bitmap)
+    def with_missing_value(
+        self, value: float = np.nan
+    ):  # `-> Self` for Python >=3.11 (PEP 673)
+        """Treats values of the input equal to `value`, or NaN values by default, as
+        missing, which are then excluded from encoding and marked in a bitmap.
+
+        The input must be a plain `np.ndarray` in this mode. Valid values are
+        extracted and the bitmap is packed in a single pass over the input without
+        creating `np.ma.MaskedArray` and its mask, which is much cheaper for fields
+        with many missing values such as ocean fields."""
+        self._missing_value = value
+        self._stats = None
+        self._valid_values = None
+        self._bitmap = _NOT_CREATED
+        self._bitmap_digest = None
+        return self
+
+    def chunked(
+        self, block_size: int = DEFAULT_BLOCK_SIZE
+    ):  # `-> Self` for Python >=3.11 (PEP 673)
+        """Enables encoding in blocks of `block_size` values.
+
+        In this mode, Section 6 and Section 7 are written out block by block without
+        materializing whole encoded arrays, so that the peak memory usage does not
+        depend on the size of the grid. `block_size` must be a multiple of 8."""
+        if block_size <= 0 or block_size % 8 != 0:
+            raise RuntimeError("block size must be a positive multiple of 8")
+        self._block_size = block_size
+        self._valid_values = None  # not used in this mode
+        return self
+
+    def statistics(self) -> FieldStatistics:
+        """Returns statistics of the input data, computing them if not yet done."""
+        stats = self._stats
+        if stats is None:
+            if self._missing_value is None or self._block_size is not None:
+                stats = compute_statistics(self._input, self._missing_value)
+                self._stats = stats
+            else:
+                _, stats = self._split_missing(self._missing_value)
+        return stats
+
+    def _split_missing(self, missing: float) -> tuple[np.ndarray, FieldStatistics]:
+        """Extracts valid values of the input, and creates the bitmap and statistics
+        in a single pass, returning the valid values and the statistics."""
+        with measuring("bitmap"):
+            values, self._bitmap, stats = _split_missing(self._input, missing)
+        self._valid_values, self._stats = values, stats
+        return values, stats
+
+    def _has_bitmap(self) -> bool:
+        return (
+            isinstance(self._input, np.ma.MaskedArray)
+            or self._missing_value is not None
+        )
+
+    def _mask_of_input(self) -> np.ndarray | None:
+        if self._missing_value is None:
+            return _mask_of(self._input)
+        return ~_is_present(_check_unmasked(self._input), self._missing_value)
+
+    def _checked_statistics(self) -> FieldStatistics:
         if self._input is None:
             raise RuntimeError("data is not specified")
-        if isinstance(self._input, np.ma.MaskedArray):
-            input_ = self._input[~self._input.mask]
-            bitmap = create_bitmap(self._input.mask.ravel())
-        else:
-            input_ = self._input.ravel()
-            bitmap = None
-        if np.isnan(input_).any():
+        stats = self.statistics()
+        if stats.has_nan:
             # if the data contains NaN, encoding itself succeeds, but proper values
             # cannot be written out, so we raise an exception
             raise RuntimeError("data contains NaN values")
-        self._len = len(input_)
-        dtype = self._determine_dtype()
-        if self.n == 0:
-            self._encoded = np.array([], dtype=dtype)
+        return stats
+
+    def _is_streamed(self) -> bool:
+        return self._block_size is not None and self._encoded is None
+
+    def encode(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """Packs and returns two `np.ndarray`s. The first one is an array containing
+        encoded values with `n` bits occupied for each element, and the second one is a
+        bitmap array.
+
+        If `n` is not one of 8, 16, 32 and 64, encoded values are stored in the
+        smallest unsigned integer type which can hold `n` bits, and are packed into a
+        bit sequence when written out as Section 7."""
+        return (self._encode_values(), self._get_bitmap())
+
+    def _encode_values(self) -> np.ndarray:
+        if self._encoded is None:
+            with measuring("encoding"):
+                self._encoded = self._quantize(self._extract_valid_values())
+        return self._encoded
+
+    def _extract_valid_values(self) -> np.ndarray:
+        """Returns flattened valid values of the input, setting `_len`."""
+        self._checked_statistics()
+        if self._missing_value is not None:
+            input_ = self._valid_values
+            if input_ is None:
+                input_, _ = self._split_missing(self._missing_value)
+            self._valid_values = None  # not kept after being encoded
+        elif isinstance(self._input, np.ma.MaskedArray):
+            input_ = self._input.compressed()
         else:
-            encoded = (input_ * 10**self.d - self.r) * 2 ** (-self.e)
-            self._encoded = np.round(encoded).astype(dtype)
-        self._bitmap = bitmap
-        return (self._encoded, self._bitmap)
+            input_ = self._input.ravel()
+        self._len = len(input_)
+        return input_
+
+    def _get_bitmap(self) -> np.ndarray | None:
+        if self._bitmap is _NOT_CREATED:
+            if self._missing_value is not None:
+                self._split_missing(self._missing_value)
+            else:
+                with measuring("bitmap"):
+                    self._bitmap = _create_bitmap_of(self._input)
+        return self._bitmap
+
+    def bitmap_digest(self) -> bytes | None:
+        if self._bitmap_digest is None:
+            if self._missing_value is None:
+                self._bitmap_digest = _mask_digest(self._input, self._get_bitmap)
+            elif not self._is_streamed():
+                bitmap = self._get_bitmap()
+                if bitmap is not None:
+                    self._bitmap_digest = _bitmap_digest(bitmap, np.size(self._input))
+        return self._bitmap_digest
+
+    def _quantize(self, values: np.ndarray, dtype=None) -> np.ndarray:
+        if dtype is None:
+            dtype = self._determine_dtype()
+            if self.n == 0:
+                return np.array([], dtype=dtype)
+        return self._scale(values).astype(dtype)
+
+    def _scale(self, values: np.ndarray) -> np.ndarray:
+        encoded = (values * 10**self.d - self.r) * 2 ** (-self.e)
+        return np.round(encoded)
 
     def _determine_dtype(self):
-        if self.n == 0 or self.n == 8:
+        if self.n <= 8:
             return ">u1"
-        elif self.n == 16:
+        elif self.n <= 16:
             return ">u2"
-        elif self.n == 32:
+        elif self.n <= 32:
             return ">u4"
         elif self.n == 64:
             return ">u8"
         else:
-            raise RuntimeError("n other than 0, 8, 16, 32, and 64 is not supported")
+            raise RuntimeError("n larger than 32 other than 64 is not supported")
+
+    def _bits_per_value(self) -> int:
+        return self.n
+
+    def _is_byte_aligned(self) -> bool:
+        return self.n in (8, 16, 32, 64)
 
     def write_sect5(self, f: BinaryIO) -> int:
         """Writes parameter data to the stream as Section 5 octet sequence."""
-        _, _ = self.encode()
-        num_of_values = self._len
-        main_dtype = np.dtype(
+        self._determine_dtype()  # raises if `n` is not supported
+        # counted without encoding values, which is left to Section 7
+        num_of_values = self._checked_statistics().num_of_values
+        main_dtype = _DTYPE_SECTION_5
+        main_buf = np.array([(num_of_values, self._template_num)], dtype=main_dtype)
+
+        template_dtype = _DTYPE_TEMPLATE_5_0
+        field_type = self._original_field_type()
+
+        template_buf = np.array(
             [
-                ("num_of_values", ">u4"),
-                ("template_num", ">u2"),
-            ]
+                (
+                    self.r,
+                    grib_signed(self.e, 2),
+                    grib_signed(self.d, 2),
+                    self._bits_per_value(),
+                    field_type,
+                )
+            ],
+            dtype=template_dtype,
         )
-        main_buf = np.array([(num_of_values, 0)], dtype=main_dtype)
 
-        template_dtype = np.dtype(
-            [
-                ("reference_value", ">f4"),
-                ("binary_scale_factor", ">u2"),  # grib_signed
-                ("decimal_scale_factor", ">u2"),  # grib_signed
-                ("bits_per_value", "u1"),
-                ("type_of_original_field_values", "u1"),
-            ]
+        sect_len = (
+            SECT_HEADER_DTYPE.itemsize + main_dtype.itemsize + template_dtype.itemsize
         )
+
+        header = create_sect_header(5, sect_len)
+        write(f, header)
+        write(f, main_buf)
+        write(f, template_buf)
+        return sect_len
+
+    def sect_lens(self) -> tuple[int, int, int] | None:
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        return self.sect_lens_for(np.shape(self._input), self._mask_of_input())
+
+    def sect_lens_for(
+        self, shape: tuple[int, ...], mask: np.ndarray | None = None
+    ) -> tuple[int, int, int] | None:
+        self._determine_dtype()  # raises if `n` is not supported
+        sect5_len = (
+            SECT_HEADER_DTYPE.itemsize
+            + _DTYPE_SECTION_5.itemsize
+            + _DTYPE_TEMPLATE_5_0.itemsize
+        )
+        num_of_values = _count_valid_points(shape, mask)
+        nbytes = ceil(num_of_values * self._bits_per_value() / 8)
+        sect7_len = SECT_HEADER_DTYPE.itemsize + nbytes
+        return (sect5_len, _bitmap_sect6_len(shape, mask), sect7_len)
+
+    def _original_field_type(self) -> int:
         original_data_dtype = self._input.dtype
         if np.issubdtype(original_data_dtype, np.floating):
-            field_type = 0
+            return 0
         elif np.issubdtype(original_data_dtype, np.integer):
-            field_type = 1
+            return 1
         else:
             raise RuntimeError("unexpected dtype for original data values")
 
+    def write_sect6(self, f: BinaryIO) -> int:
+        """Writes bitmap data to the stream as Section 6 octet sequence."""
+        if self._is_streamed():
+            return self._write_sect6_in_blocks(f)
+        return _write_bitmap_sect6(f, self._get_bitmap())
+
+    def write_sect7(self, f: BinaryIO) -> int:
+        """Writes encoded data to the stream as Section 7 octet sequence."""
+        if self._is_streamed():
+            return self._write_sect7_in_blocks(f)
+        if self._encoded is None and isinstance(f, BufferWriter):
+            return self._write_sect7_in_place(f)
+        encoded = self._encode_values()
+        if not self._is_byte_aligned():
+            with measuring("encoding"):
+                encoded = pack_bits(encoded, self.n)
+        return _write_data_sect7(f, encoded)
+
+    def _write_sect7_in_place(self, f: BufferWriter) -> int:
+        """Quantizes and packs values directly into the region reserved in `f`."""
+        values = self._extract_valid_values()
+        dtype = self._determine_dtype()
+        nbytes = ceil(len(values) * self.n / 8)
+        sect_len = SECT_HEADER_DTYPE.itemsize + nbytes
+        f.write(create_sect_header(7, sect_len))
+        region = f.reserve(nbytes)
+        if self.n == 0:
+            return sect_len
+
+        with measuring("encoding"):
+            self._pack_into(region, values, dtype)
+        return sect_len
+
+    def _pack_into(self, region: np.ndarray, values: np.ndarray, dtype):
+        pos = 0
+        packer = BitPacker()
+        for start in range(0, len(values), DEFAULT_BLOCK_SIZE):
+            block = values[start : start + DEFAULT_BLOCK_SIZE]
+            if self._is_byte_aligned():
+                out = region[pos : pos + len(block) * self.n // 8].view(dtype)
+                np.copyto(out, self._scale(block), casting="unsafe")
+                pos += out.nbytes
+                continue
+            for octets in packer.pack(self._quantize(block), self.n):
+                region[pos : pos + len(octets)] = octets
+                pos += len(octets)
+        region[pos:] = packer.flush()
+
+    def _write_sect6_in_blocks(self, f: BinaryIO) -> int:
+        self._checked_statistics()
+        if not self._has_bitmap():
+            sect_len = SECT_HEADER_DTYPE.itemsize + 1
+            write(f, create_sect_header(6, sect_len))
+            write(f, np.array([0xFF], dtype="u1"))
+            return sect_len
+
+        sect_len = SECT_HEADER_DTYPE.itemsize + 1 + ceil(np.size(self._input) / 8)
+        write(f, create_sect_header(6, sect_len))
+        write(f, np.array([0x00], dtype="u1"))
+        block_size = self._block_size or DEFAULT_BLOCK_SIZE  # set in this mode
+        blocks = _iter_present_blocks(self._input, block_size, self._missing_value)
+        for present in blocks:
+            with measuring("bitmap"):
+                bitmap = np.packbits(present)
+            write(f, bitmap)
+        return sect_len
+
+    def _write_sect7_in_blocks(self, f: BinaryIO) -> int:
+        stats = self._checked_statistics()
+        sect_len = SECT_HEADER_DTYPE.itemsize + ceil(stats.num_of_values * self.n / 8)
+        write(f, create_sect_header(7, sect_len))
+        if self.n == 0:
+            return sect_len
+
+        packer = BitPacker()
+        block_size = self._block_size or DEFAULT_BLOCK_SIZE  # set in this mode
+        blocks = _iter_valid_blocks(self._input, block_size, self._missing_value)
+        for values in blocks:
+            with measuring("encoding"):
+                encoded = self._quantize(values)
+            for octets in packer.pack(encoded, self.n):
+                write(f, octets)
+        write(f, packer.flush())
+        return sect_len
+
+
+@dataclasses.dataclass
+class IeeeFloatEncoder(BaseEncoder):
+    """An encoder for IEEE floating point data (template 5.4).
+
+    Values are written out as they are in 32-bit (`precision` of 1) or 64-bit
+    (`precision` of 2) big-endian format, so that no scaling or scanning of the data
+    is done. If the input is an `np.ma.MaskedArray`, a bitmap is also created."""
+
+    precision: int = 1
+
+    _input = None
+
+    def __post_init__(self):
+        if self.precision not in _IEEE_DTYPES:
+            raise RuntimeError("precision must be 1 (32-bit) or 2 (64-bit)")
+
+    def input(self, data: np.ndarray):  # `-> Self` for Python >=3.11 (PEP 673)
+        """Sets input data to be encoded."""
+        self._input = data
+        self._encoded: np.ndarray | None = None
+        self._bitmap: np.ndarray | None = _NOT_CREATED
+        self._bitmap_digest: bytes | None = None
+        return self
+
+    def encode(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """Returns two `np.ndarray`s. The first one is an array of big-endian floating
+        point values, and the second one is a bitmap array."""
+        return (self._encode_values(), self._get_bitmap())
+
+    def _encode_values(self) -> np.ndarray:
+        if self._encoded is not None:
+            return self._encoded
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        if isinstance(self._input, np.ma.MaskedArray):
+            input_ = self._input.compressed()
+        else:
+            input_ = self._input.ravel()
+        # only a byteswap; no copy is made if the input is already in this format
+        with measuring("encoding"):
+            self._encoded = input_.astype(_IEEE_DTYPES[self.precision], copy=False)
+        return self._encoded
+
+    def _get_bitmap(self) -> np.ndarray | None:
+        if self._bitmap is _NOT_CREATED:
+            if self._input is None:
+                raise RuntimeError("data is not specified")
+            with measuring("bitmap"):
+                self._bitmap = _create_bitmap_of(self._input)
+        return self._bitmap
+
+    def bitmap_digest(self) -> bytes | None:
+        if self._bitmap_digest is None:
+            self._bitmap_digest = _mask_digest(self._input, self._get_bitmap)
+        return self._bitmap_digest
+
+    def write_sect5(self, f: BinaryIO) -> int:
+        """Writes parameter data to the stream as Section 5 octet sequence."""
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        mask = _mask_of(self._input)
+        num_of_values = _count_valid_points(np.shape(self._input), mask)
+        main_buf = np.array([(num_of_values, 4)], dtype=_DTYPE_SECTION_5)
+        template_buf = np.array([(self.precision,)], dtype=_DTYPE_TEMPLATE_5_4)
+
+        sect_len = (
+            SECT_HEADER_DTYPE.itemsize
+            + _DTYPE_SECTION_5.itemsize
+            + _DTYPE_TEMPLATE_5_4.itemsize
+        )
+        header = create_sect_header(5, sect_len)
+        write(f, header)
+        write(f, main_buf)
+        write(f, template_buf)
+        return sect_len
+
+    def sect_lens(self) -> tuple[int, int, int] | None:
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        return self.sect_lens_for(np.shape(self._input), _mask_of(self._input))
+
+    def sect_lens_for(
+        self, shape: tuple[int, ...], mask: np.ndarray | None = None
+    ) -> tuple[int, int, int] | None:
+        sect5_len = (
+            SECT_HEADER_DTYPE.itemsize
+            + _DTYPE_SECTION_5.itemsize
+            + _DTYPE_TEMPLATE_5_4.itemsize
+        )
+        num_of_values = _count_valid_points(shape, mask)
+        nbytes = num_of_values * np.dtype(_IEEE_DTYPES[self.precision]).itemsize
+        sect7_len = SECT_HEADER_DTYPE.itemsize + nbytes
+        return (sect5_len, _bitmap_sect6_len(shape, mask), sect7_len)
+
+    def write_sect6(self, f: BinaryIO) -> int:
+        """Writes bitmap data to the stream as Section 6 octet sequence."""
+        return _write_bitmap_sect6(f, self._get_bitmap())
+
+    def write_sect7(self, f: BinaryIO) -> int:
+        """Writes encoded data to the stream as Section 7 octet sequence."""
+        if self._encoded is None and isinstance(f, BufferWriter):
+            return self._write_sect7_in_place(f)
+        return _write_data_sect7(f, self._encode_values())
+
+    def _write_sect7_in_place(self, f: BufferWriter) -> int:
+        """Converts values directly into the region reserved in `f`."""
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        if isinstance(self._input, np.ma.MaskedArray):
+            values = self._input.compressed()
+        else:
+            values = self._input.ravel()
+        dtype = np.dtype(_IEEE_DTYPES[self.precision])
+        sect_len = SECT_HEADER_DTYPE.itemsize + len(values) * dtype.itemsize
+        f.write(create_sect_header(7, sect_len))
+        out = f.reserve(len(values) * dtype.itemsize).view(dtype)
+        with measuring("encoding"):
+            np.copyto(out, values, casting="unsafe")
+        return sect_len
+
+
+_IEEE_DTYPES = {1: ">f4", 2: ">f8"}
+
+
+@dataclasses.dataclass
+class RunLengthPackingEncoder(BaseEncoder):
+    """An encoder for run length packing with level values (template 5.200).
+
+    The input must be an integer array of level numbers from 1 to the length of
+    `level_values`, where 0 means missing. Masked values of an `np.ma.MaskedArray`
+    are also treated as missing, and no bitmap is created. `level_values` are
+    representative values of levels scaled by 10 to the power of `d`.
+
+    Each run of the same level is packed as its level followed by digits of the run
+    length in base `2**n - 1 - MV`, where MV is the maximum level used. If `n` is
+    None, the number of bits which minimizes the size of Section 7 is chosen."""
+
+    level_values: Sequence[int]
+    d: int = 0
+    n: int | None = None
+
+    _input = None
+
+    def input(self, data: np.ndarray):  # `-> Self` for Python >=3.11 (PEP 673)
+        """Sets input data to be encoded."""
+        self._input = data
+        self._encoded: np.ndarray | None = None
+        return self
+
+    def encode(self) -> tuple[np.ndarray, None]:
+        """Returns a tuple of an array of run length codes, and None as no bitmap is
+        used."""
+        if self._encoded is not None:
+            return (self._encoded, None)
+        if self._input is None:
+            raise RuntimeError("data is not specified")
+        levels = np.ma.filled(self._input, 0).ravel()
+        if not np.issubdtype(levels.dtype, np.integer):
+            raise RuntimeError("levels must be integers")
+        self._len = len(levels)
+        if self._len > 0 and (
+            levels.min() < 0 or levels.max() > len(self.level_values)
+        ):
+            raise RuntimeError("levels out of range of level values")
+
+        # runs of the same level
+        starts = np.flatnonzero(levels[1:] != levels[:-1]) + 1
+        starts = np.concatenate([[0], starts]) if self._len > 0 else starts
+        run_levels = levels[starts].astype(np.int64)
+        extra_lengths = np.diff(starts, append=self._len) - 1
+
+        self._max_level = max(int(run_levels.max(initial=0)), 1)
+        if self.n is None:
+            min_n = (self._max_level + 2).bit_length()
+            candidates = range(min_n, max(min_n, 16) + 1)
+            sizes = [
+                n * _count_run_length_codes(extra_lengths, self._run_length_base(n))
+                for n in candidates
+            ]
+            self._nbit = candidates[int(np.argmin(sizes))]
+        else:
+            self._nbit = self.n
+        base = self._run_length_base(self._nbit)
+        if base < 2:
+            raise RuntimeError("n is too small for the levels used")
+
+        num_digits = _count_digits(extra_lengths, base)
+        positions = np.cumsum(num_digits + 1) - (num_digits + 1)
+        codes = np.empty(len(run_levels) + int(num_digits.sum()), dtype=np.int64)
+        codes[positions] = run_levels
+        for k in range(int(num_digits.max(initial=0))):
+            has_digit = num_digits > k
+            digits = extra_lengths[has_digit] // base**k % base
+            codes[positions[has_digit] + 1 + k] = self._max_level + 1 + digits
+        self._encoded = codes
+        return (codes, None)
+
+    def _run_length_base(self, nbit: int) -> int:
+        return 2**nbit - 1 - self._max_level
+
+    def write_sect5(self, f: BinaryIO) -> int:
+        """Writes parameter data to the stream as Section 5 octet sequence."""
+        _, _ = self.encode()
+        main_dtype = _DTYPE_SECTION_5
+        main_buf = np.array([(self._len, 200)], dtype=main_dtype)
+
+        template_dtype = np.dtype(
+            [
+                ("bits_per_value", "u1"),
+                ("max_level_value", ">u2"),
+                ("number_of_level_values", ">u2"),
+                ("decimal_scale_factor", "u1"),  # grib_signed
+            ]
+        )
         template_buf = np.array(
             [
                 (
-                    self.r,
-                    grib_signed(self.e, 2),
-                    grib_signed(self.d, 2),
-                    self.n,
-                    field_type,
+                    self._nbit,
+                    self._max_level,
+                    len(self.level_values),
+                    grib_signed(self.d, 1),
                 )
             ],
             dtype=template_dtype,
         )
+        level_values_buf = np.array(self.level_values, dtype=">u2")
 
         sect_len = (
-            SECT_HEADER_DTYPE.itemsize + main_dtype.itemsize + template_dtype.itemsize
+            SECT_HEADER_DTYPE.itemsize
+            + main_dtype.itemsize
+            + template_dtype.itemsize
+            + level_values_buf.nbytes
         )
 
         header = create_sect_header(5, sect_len)
         write(f, header)
         write(f, main_buf)
         write(f, template_buf)
+        write(f, level_values_buf)
         return sect_len
 
     def write_sect6(self, f: BinaryIO) -> int:
         """Writes bitmap data to the stream as Section 6 octet sequence."""
-        _, bitmap = self.encode()
+        return _write_bitmap_sect6(f, None)
+
+    def write_sect7(self, f: BinaryIO) -> int:
+        """Writes encoded data to the stream as Section 7 octet sequence."""
+        codes, _ = self.encode()
+        # decoders take all `n`-bit slots in the section as codes, so the padding is
+        # filled with digits of zero, which do not change the last run length
+        num_padding_codes = -len(codes) * self._nbit % 8 // self._nbit
+        if len(codes) > 0 and num_padding_codes > 0:
+            padding = np.full(num_padding_codes, self._max_level + 1)
+            codes = np.concatenate([codes, padding])
+        return _write_data_sect7(f, pack_bits(codes, self._nbit))
+
+
+def _count_digits(values: np.ndarray, base: int) -> np.ndarray:
+    """Returns numbers of digits of non-negative integers `values` in base `base`,
+    where 0 has no digits."""
+    num_digits = np.zeros(len(values), dtype=np.int64)
+    remainders = values
+    while remainders.any():
+        num_digits += remainders > 0
+        remainders = remainders // base
+    return num_digits
+
+
+def _count_run_length_codes(extra_lengths: np.ndarray, base: int) -> int:
+    if base < 2:
+        return np.iinfo(np.int64).max
+    return len(extra_lengths) + int(_count_digits(extra_lengths, base).sum())
 
-        main_dtype = np.dtype(
+
+class _ComplexPackingParameters(NamedTuple):
+    group_ref_nbit: int
+    num_of_groups: int
+    group_width_ref: int
+    group_width_nbit: int
+    group_length_ref: int
+    true_length_of_last_group: int
+    extra_descriptor_octets: int
+
+
+_GROUP_LENGTH_CANDIDATES = (4, 8, 16, 32, 64, 128, 256, 512)
+
+
+@dataclasses.dataclass
+class ComplexPackingEncoder(SimplePackingEncoder):
+    """An encoder for complex packing (template 5.2) or complex packing and spatial
+    differencing (template 5.3).
+
+    `r`, `e`, and `d` are used for the scaling in the same way as in simple packing,
+    while `n` is used only to determine them in `auto_parametrized_from`. With
+    `spatial_differencing` of 1 or 2, values are replaced with their differences of
+    that order before packing (template 5.3); with 0, they are packed as they are
+    (template 5.2).
+
+    Values are split into groups of the same length, which is chosen from a few
+    candidates so that the size of Section 7 is minimized."""
+
+    spatial_differencing: int = 2
+
+    def __post_init__(self):
+        if self.spatial_differencing not in (0, 1, 2):
+            raise RuntimeError("order of spatial differencing must be 0, 1, or 2")
+
+    def chunked(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        raise RuntimeError("chunked encoding is not supported for complex packing")
+
+    def sect_lens_for(
+        self, shape: tuple[int, ...], mask: np.ndarray | None = None
+    ) -> tuple[int, int, int] | None:
+        return None  # depending on values
+
+    def encode(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """Packs and returns two `np.ndarray`s. The first one is an octet array of the
+        data in Section 7, and the second one is a bitmap array."""
+        return super().encode()
+
+    def _encode_values(self) -> np.ndarray:
+        if self._encoded is None:
+            with measuring("encoding"):
+                values = self._quantize(self._extract_valid_values(), np.int64)
+                self._params, self._encoded = _pack_complex(
+                    values, self.spatial_differencing
+                )
+        return self._encoded
+
+    def write_sect5(self, f: BinaryIO) -> int:
+        """Writes parameter data to the stream as Section 5 octet sequence."""
+        _ = self._encode_values()
+        params = self._params
+        template_num = 2 if self.spatial_differencing == 0 else 3
+        main_dtype = _DTYPE_SECTION_5
+        main_buf = np.array([(self._len, template_num)], dtype=main_dtype)
+
+        template_dtype = _DTYPE_TEMPLATE_5_2
+        template_buf = np.array(
             [
-                ("bitmap_indicator", "u1"),
-            ]
+                (
+                    self.r,
+                    grib_signed(self.e, 2),
+                    grib_signed(self.d, 2),
+                    params.group_ref_nbit,
+                    self._original_field_type(),
+                    1,  # general group splitting
+                    0,  # no explicit missing values included within the data values
+                    0xFFFFFFFF,
+                    0xFFFFFFFF,
+                    params.num_of_groups,
+                    params.group_width_ref,
+                    params.group_width_nbit,
+                    params.group_length_ref,
+                    1,
+                    params.true_length_of_last_group,
+                    0,  # all groups except for the last one have the same length
+                )
+            ],
+            dtype=template_dtype,
         )
-        if bitmap is None:
-            main_buf = np.array([(0xFF)], dtype=main_dtype)
-            bitmap = np.array([], dtype=">u8")
+        if self.spatial_differencing == 0:
+            spatial_differencing_buf = np.array([], dtype="u1")
         else:
-            main_buf = np.array([(0x00)], dtype=main_dtype)
+            spatial_differencing_buf = np.array(
+                [self.spatial_differencing, params.extra_descriptor_octets], dtype="u1"
+            )
 
-        sect_len = SECT_HEADER_DTYPE.itemsize + main_dtype.itemsize + len(bitmap)
-        header = create_sect_header(6, sect_len)
+        sect_len = (
+            SECT_HEADER_DTYPE.itemsize
+            + main_dtype.itemsize
+            + template_dtype.itemsize
+            + spatial_differencing_buf.nbytes
+        )
+
+        header = create_sect_header(5, sect_len)
         write(f, header)
         write(f, main_buf)
-        write(f, bitmap)
+        write(f, template_buf)
+        write(f, spatial_differencing_buf)
         return sect_len
 
     def write_sect7(self, f: BinaryIO) -> int:
         """Writes encoded data to the stream as Section 7 octet sequence."""
-        encoded, _ = self.encode()
-        sect_len = SECT_HEADER_DTYPE.itemsize + encoded.nbytes
-        header = create_sect_header(7, sect_len)
-        write(f, header)
-        write(f, encoded)
-        return sect_len
+        return _write_data_sect7(f, self._encode_values())
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_FILTER_TYPES = {"none": 0, "sub": 1, "up": 2}
+
+
+@dataclasses.dataclass
+class PngPackingEncoder(SimplePackingEncoder):
+    """An encoder for PNG packing (template 5.41).
+
+    Values are scaled in the same way as in simple packing and stored as an image in
+    a PNG stream with 8, 16, 24 (RGB), or 32 (RGBA) bits for each value. The image has
+    the same shape as the input if it is a 2D array without a mask, and has only one
+    row otherwise.
+
+    `level` is the zlib compression level from 0 (fastest) to 9 (smallest), and
+    `filter_type` is the PNG filter applied to each row: "none", "sub" (difference
+    from the left value), or "up" (difference from the value above). Filters make
+    smooth fields more compressible at a small cost of encoding speed, while sparse
+    fields such as precipitation are usually smallest without them."""
+
+    level: int = 6
+    filter_type: str = "none"
+
+    _template_num = 41
+
+    def __post_init__(self):
+        if self.filter_type not in _PNG_FILTER_TYPES:
+            raise RuntimeError(f"unsupported PNG filter type: {self.filter_type}")
+
+    def chunked(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        raise RuntimeError("chunked encoding is not supported for PNG packing")
+
+    def sect_lens_for(
+        self, shape: tuple[int, ...], mask: np.ndarray | None = None
+    ) -> tuple[int, int, int] | None:
+        return None  # depending on values
+
+    def encode(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """Packs and returns two `np.ndarray`s. The first one is an octet array of the
+        PNG stream in Section 7, and the second one is a bitmap array."""
+        return super().encode()
+
+    def _encode_values(self) -> np.ndarray:
+        if self._encoded is not None:
+            return self._encoded
+        with measuring("encoding"):
+            values = self._quantize(self._extract_valid_values())
+            if len(values) == 0:
+                self._encoded = np.array([], dtype=np.uint8)
+                return self._encoded
+
+            if not self._has_bitmap() and self._input.ndim == 2:
+                shape = self._input.shape
+            else:
+                shape = (1, len(values))
+            self._encoded = self._create_png(values, *shape)
+        return self._encoded
+
+    def _bits_per_value(self) -> int:
+        if self.n == 0:
+            return 0
+        elif self.n <= 32:
+            return ceil(self.n / 8) * 8
+        else:
+            raise RuntimeError("n larger than 32 is not supported in PNG packing")
+
+    def _create_png(self, values: np.ndarray, height: int, width: int) -> np.ndarray:
+        depth = self._bits_per_value()
+        size = values.dtype.itemsize
+        bytes_per_value = depth // 8
+        octets = values.view(np.uint8).reshape(height, width, size)
+        rows = octets[:, :, size - bytes_per_value :].reshape(height, -1)
+
+        filter_type = _PNG_FILTER_TYPES[self.filter_type]
+        scanlines = np.empty((height, rows.shape[1] + 1), dtype=np.uint8)
+        scanlines[:, 0] = filter_type
+        filtered = scanlines[:, 1:]
+        filtered[...] = rows
+        if filter_type == 1:
+            # arithmetic on uint8 is done modulo 256 as required
+            filtered[:, bytes_per_value:] -= rows[:, :-bytes_per_value]
+        elif filter_type == 2:
+            filtered[1:] -= rows[:-1]
+
+        if depth <= 16:
+            bit_depth, color_type = depth, 0  # grayscale
+        else:
+            bit_depth, color_type = 8, 2 if depth == 24 else 6  # RGB or RGBA
+        header = struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0)
+        stream = b"".join(
+            [
+                _PNG_SIGNATURE,
+                _png_chunk(b"IHDR", header),
+                _png_chunk(b"IDAT", zlib.compress(scanlines.data, self.level)),
+                _png_chunk(b"IEND", b""),
+            ]
+        )
+        return np.frombuffer(stream, dtype=np.uint8)
+
+    def write_sect7(self, f: BinaryIO) -> int:
+        """Writes encoded data to the stream as Section 7 octet sequence."""
+        return _write_data_sect7(f, self._encode_values())
+
 
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
 
-def _get_parameters_simple_linear(data: np.ndarray, nbit: int):
-    min = data.min()
-    d = -ceil(np.log10((data.max() - min) / (2**nbit - 1)))
+
+def _pack_complex(
+    values: np.ndarray, order: int
+) -> tuple[_ComplexPackingParameters, np.ndarray]:
+    """Packs non-negative integers `values` with complex packing and spatial
+    differencing of `order`."""
+    num_of_values = len(values)
+    extra_descriptors = []
+    if order > 0:
+        diffs = np.diff(values, n=order, prepend=np.zeros(order, dtype=values.dtype))
+        diffs[:order] = 0
+        if num_of_values > order:
+            min_diff = int(diffs[order:].min())
+            diffs[order:] -= min_diff
+        else:
+            min_diff = 0
+        extra_descriptors = [int(v) for v in values[:order]]
+        extra_descriptors += [0] * (order - len(extra_descriptors)) + [min_diff]
+        values = diffs
+
+    group_length, refs, widths = _find_groups(values)
+    num_of_groups = len(refs)
+    lengths = np.full(num_of_groups, group_length)
+    if num_of_groups > 0:
+        lengths[-1] = num_of_values - (num_of_groups - 1) * group_length
+    width_ref = int(widths.min(initial=0))
+    params = _ComplexPackingParameters(
+        group_ref_nbit=int(refs.max(initial=0)).bit_length(),
+        num_of_groups=num_of_groups,
+        group_width_ref=width_ref,
+        group_width_nbit=int(widths.max(initial=0) - width_ref).bit_length(),
+        group_length_ref=group_length,
+        true_length_of_last_group=int(lengths[-1]) if num_of_groups > 0 else 0,
+        extra_descriptor_octets=_octets_for_signed(extra_descriptors),
+    )
+
+    octets = [
+        _pack_signed(extra_descriptors, params.extra_descriptor_octets),
+        pack_bits(refs, params.group_ref_nbit),
+        pack_bits(widths - width_ref, params.group_width_nbit),
+        pack_bits(values - np.repeat(refs, lengths), np.repeat(widths, lengths)),
+    ]
+    return (params, np.concatenate(octets))
+
+
+def _find_groups(values: np.ndarray) -> tuple[int, np.ndarray, np.ndarray]:
+    """Splits `values` into groups of the same length, and returns the length, and
+    reference values (minimums) and bit widths of groups.
+
+    The length is chosen from candidates so that the total size of group descriptors
+    and packed values is minimized. Minimums and maximums of groups for each candidate
+    are computed from those for the previous (half) length."""
+    num_of_values = len(values)
+    if num_of_values == 0:
+        return (1, np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+
+    max_length = _GROUP_LENGTH_CANDIDATES[-1]
+    n_pad = -num_of_values % max_length
+    # padding with the last value does not change minimums and maximums of groups
+    group_min = group_max = np.pad(values, (0, n_pad), mode="edge")
+
+    best_size = None
+    length = 1
+    for candidate in _GROUP_LENGTH_CANDIDATES:
+        # element-wise operations on strided views are much faster than reductions
+        # along a short axis
+        while length < candidate:
+            group_min = np.minimum(group_min[0::2], group_min[1::2])
+            group_max = np.maximum(group_max[0::2], group_max[1::2])
+            length *= 2
+        num_of_groups = -(-num_of_values // length)
+        refs = group_min[:num_of_groups]
+        widths = _bit_length(group_max[:num_of_groups] - refs)
+        last_length = num_of_values - (num_of_groups - 1) * length
+        num_of_bits = int(widths[:-1].sum()) * length + int(widths[-1]) * last_length
+        width_nbit = int(widths.max() - widths.min()).bit_length()
+        size = (
+            ceil(num_of_groups * int(refs.max()).bit_length() / 8)
+            + ceil(num_of_groups * width_nbit / 8)
+            + ceil(num_of_bits / 8)
+        )
+        if best_size is None or size < best_size:
+            best_size, best = size, (length, refs, widths)
+        if length >= num_of_values:
+            break
+    return best
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Returns numbers of bits required for non-negative integers `values`."""
+    # the exponent returned by `np.frexp` is exact for integers up to 2**53
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64)
+
+
+def _octets_for_signed(values: list[int]) -> int:
+    nbit = max((abs(v) for v in values), default=0).bit_length() + 1
+    return max(ceil(nbit / 8), 1)
+
+
+def _pack_signed(values: list[int], num_octets: int) -> np.ndarray:
+    octets = b"".join(
+        grib_signed(v, num_octets).to_bytes(num_octets, "big") for v in values
+    )
+    return np.frombuffer(octets, dtype=np.uint8)
+
+
+def _write_bitmap_sect6(f: BinaryIO, bitmap: np.ndarray | None) -> int:
+    main_dtype = np.dtype(
+        [
+            ("bitmap_indicator", "u1"),
+        ]
+    )
+    if bitmap is None:
+        main_buf = np.array([(0xFF)], dtype=main_dtype)
+        bitmap = np.array([], dtype=">u8")
+    else:
+        main_buf = np.array([(0x00)], dtype=main_dtype)
+
+    sect_len = SECT_HEADER_DTYPE.itemsize + main_dtype.itemsize + len(bitmap)
+    header = create_sect_header(6, sect_len)
+    write(f, header)
+    write(f, main_buf)
+    write(f, bitmap)
+    return sect_len
+
+
+def write_previously_defined_bitmap_sect6(f: BinaryIO) -> int:
+    """Writes Section 6 octet sequence which refers to the bitmap defined previously in
+    the same message (bitmap indicator 254)."""
+    sect_len = SECT_HEADER_DTYPE.itemsize + 1
+    header = create_sect_header(6, sect_len)
+    write(f, header)
+    write(f, np.array([254], dtype="u1"))
+    return sect_len
+
+
+def _mask_of(data: np.ndarray) -> np.ndarray | None:
+    if not isinstance(data, np.ma.MaskedArray):
+        return None
+    return np.ma.getmaskarray(data)
+
+
+def _count_valid_points(shape: tuple[int, ...], mask: np.ndarray | None) -> int:
+    size = int(np.prod(shape, dtype=np.int64))
+    if mask is None:
+        return size
+    if np.size(mask) != size:
+        raise RuntimeError("mask size does not match the shape")
+    return size - int(np.count_nonzero(mask))
+
+
+def _bitmap_sect6_len(shape: tuple[int, ...], mask: np.ndarray | None) -> int:
+    size = int(np.prod(shape, dtype=np.int64))
+    bitmap_len = 0 if mask is None else ceil(size / 8)
+    return SECT_HEADER_DTYPE.itemsize + 1 + bitmap_len
+
+
+def _write_data_sect7(f: BinaryIO, encoded: np.ndarray) -> int:
+    sect_len = SECT_HEADER_DTYPE.itemsize + encoded.nbytes
+    header = create_sect_header(7, sect_len)
+    write(f, header)
+    write(f, encoded)
+    return sect_len
+
+
+def encode_slices(
+    data: np.ndarray,
+    scaling: str = "simple-linear",
+    missing: float | None = None,
+    **kwargs,
+) -> list[SimplePackingEncoder]:
+    """Returns simple packing encoders of 2D slices of `data` such as a stack of
+    levels in (level, y, x) or (member, level, y, x), with values already encoded.
+
+    Parameters are chosen for each slice as in
+    `SimplePackingEncoder.auto_parametrized_from`, and the encoders are listed in
+    the order of `data.reshape(-1, y, x)`. Statistics of all slices are computed
+    with a single reduction along the axis of points, and the whole stack is
+    quantized at once, so that the cost of each slice is almost the same as a part
+    of a larger field. Slices containing NaN values are left unencoded, and raise an
+    exception when written as with `auto_parametrized_from`. `missing` is also the
+    same as in `auto_parametrized_from`."""
+    if np.ndim(data) < 3:
+        raise RuntimeError("data must have 3 or more dimensions")
+    slices = data.reshape(-1, *data.shape[-2:])
+    values = np.ma.getdata(slices).reshape(len(slices), -1)
+    mask = None
+    if missing is not None:
+        _check_unmasked(data)
+        mask = ~_is_present(values, missing)
+    elif isinstance(data, np.ma.MaskedArray) and data.mask is not np.ma.nomask:
+        mask = np.ma.getmaskarray(slices).reshape(len(slices), -1)
+
+    encoders = []
+    for i, stats in enumerate(_compute_slice_statistics(values, mask)):
+        r, e, d, n = _get_parameters(stats, scaling, kwargs)
+        encoder = SimplePackingEncoder(r, e, d, n).input(slices[i])
+        if missing is not None:
+            encoder.with_missing_value(missing)
+        encoder._stats = stats
+        encoders.append(encoder)
+
+    # quantizes values of slices which are actually encoded in one pass
+    targets = [
+        i
+        for i, encoder in enumerate(encoders)
+        if encoder.n > 0 and not encoder._stats.has_nan
+    ]
+    if not targets:
+        return encoders
+    dtypes = {encoders[i]._determine_dtype() for i in targets}
+    factors = np.zeros((len(encoders), 1))
+    refs = np.zeros((len(encoders), 1))
+    binary_factors = np.ones((len(encoders), 1))
+    for i in targets:
+        factors[i] = 10.0 ** encoders[i].d
+        refs[i] = encoders[i].r
+        binary_factors[i] = 2.0 ** -encoders[i].e
+    dtype = dtypes.pop() if len(dtypes) == 1 else np.float64
+    quantized = np.empty(values.shape, dtype=dtype)
+    # slices are scaled in groups small enough to stay in the CPU cache
+    step = max(_STATISTICS_BLOCK_SIZE // max(values.shape[1], 1), 1)
+    with measuring("encoding"), np.errstate(invalid="ignore", over="ignore"):
+        # values of other slices and masked points may be invalid but are unused
+        for start in range(0, len(values), step):
+            end = start + step
+            scaled = values[start:end] * factors[start:end]
+            scaled -= refs[start:end]
+            scaled *= binary_factors[start:end]
+            np.round(scaled, out=scaled)
+            np.copyto(quantized[start:end], scaled, casting="unsafe")
+        for i in targets:
+            encoded = quantized[i] if mask is None else quantized[i][~mask[i]]
+            encoder = encoders[i]
+            encoder._encoded = encoded.astype(encoder._determine_dtype(), copy=False)
+            encoder._len = len(encoded)
+    if mask is not None:
+        with measuring("bitmap"):
+            bitmaps = np.packbits(~mask, axis=1)
+        for encoder, bitmap in zip(encoders, bitmaps):
+            encoder._bitmap = bitmap
+    return encoders
+
+
+def _compute_slice_statistics(
+    values: np.ndarray, mask: np.ndarray | None
+) -> list[FieldStatistics]:
+    """Computes statistics of valid values of each row of `values`."""
+    num, size = values.shape
+    if size == 0 or values.dtype.kind not in "iuf":
+        return [compute_statistics(row) for row in values]
+
+    counts = np.full(num, size)
+    mins = np.empty(num, dtype=values.dtype)
+    maxs = np.empty(num, dtype=values.dtype)
+    info = np.finfo if values.dtype.kind == "f" else np.iinfo
+    lowest, highest = info(values.dtype).min, info(values.dtype).max
+    # rows are reduced in groups so that both reductions are done in the CPU cache
+    step = max(_STATISTICS_BLOCK_SIZE // size, 1)
+    for start in range(0, num, step):
+        rows = slice(start, start + step)
+        if mask is None:
+            mins[rows] = values[rows].min(axis=1)
+            maxs[rows] = values[rows].max(axis=1)
+            continue
+        valid = ~mask[rows]
+        counts[rows] = np.count_nonzero(valid, axis=1)
+        row_values = values[rows]
+        mins[rows] = np.minimum.reduce(row_values, 1, initial=highest, where=valid)
+        maxs[rows] = np.maximum.reduce(row_values, 1, initial=lowest, where=valid)
+
+    stats = []
+    for i in range(num):
+        if counts[i] == 0:
+            stats.append(FieldStatistics(np.nan, np.nan, False, 0))
+        elif values.dtype.kind == "f" and np.isnan(mins[i]):
+            row = values[i] if mask is None else values[i][~mask[i]]
+            stats.append(compute_statistics(row))
+        else:
+            stats.append(FieldStatistics(mins[i], maxs[i], False, int(counts[i])))
+    return stats
+
+
+def _get_parameters(
+    stats: FieldStatistics, scaling: str, kwargs: dict
+) -> tuple[float, int, int, int]:
+    if stats.num_of_values == 0:
+        return (0.0, 0, 0, 0)
+    elif stats.is_unique:
+        return (stats.min, 0, 0, 0)
+    elif scaling == "simple-linear":
+        n = kwargs["nbit"]
+        r, d = _get_parameters_simple_linear(stats, n)
+        return (r, 0, d, n)
+    elif scaling == "fixed-digit-linear":
+        d = kwargs["decimals"]
+        r, n = _get_parameters_fixed_digit_linear(stats, d)
+        return (r, 0, d, n)
+    elif scaling == "max-error":
+        max_error = kwargs.get("max_error")
+        if max_error is None:
+            max_error = kwargs["relative_error"] * max(abs(stats.min), abs(stats.max))
+        return _get_parameters_max_error(stats, max_error)
+    else:
+        raise RuntimeError(f"unsupported scaling type: {scaling}")
+
+
+def _get_parameters_simple_linear(stats: FieldStatistics, nbit: int):
+    min = stats.min
+    d = -ceil(np.log10((stats.max - min) / (2**nbit - 1)))
     r = min * 10**d
     return (r, d)
 
 
-def _get_parameters_fixed_digit_linear(data: np.ndarray, decimals: int):
+def _get_parameters_fixed_digit_linear(stats: FieldStatistics, decimals: int):
     inverse_precision = 10**decimals
-    min = round(data.min() * inverse_precision)
-    max = round(data.max() * inverse_precision)
-    n_required = ceil(log2(max - min))
+    min = int(round(stats.min * inverse_precision))
+    max = int(round(stats.max * inverse_precision))
+    n_required = (max - min).bit_length()
     n = _get_supported_nbit(n_required)
     return (min, n)
 
 
+_MAX_ERROR_DECIMAL_CANDIDATES = range(-2, 3)
+
+
+def _get_parameters_max_error(stats: FieldStatistics, max_error: float):
+    """Returns parameters with the fewest bits for which the error of decoded values
+    is at most `max_error`.
+
+    The error of simple packing is at most half of the step between decoded values
+    `2**e / 10**d`, so `e` is chosen as the largest one with the step not exceeding
+    `2 * max_error` for each candidate of `d`. As `r` is stored as a 32-bit float, it
+    is rounded down to one, so that values are quantized with the stored one. The
+    number of bits only depends on the range of values, and no other pass over the
+    data is needed."""
+    if not max_error > 0:
+        raise RuntimeError("max error must be positive")
+    base_d = -floor(log10(2 * max_error))
+    best = None
+    for d in (base_d + offset for offset in _MAX_ERROR_DECIMAL_CANDIDATES):
+        decimal_factor = 10.0**d
+        e = floor(log2(2 * max_error * decimal_factor))
+        if 2.0**e / decimal_factor > 2 * max_error:  # rounding errors of log2
+            e -= 1
+        r = _floor_float32(stats.min * decimal_factor)
+        max_code = (stats.max * decimal_factor - r) * 2.0**-e
+        if not np.isfinite(max_code):
+            continue  # `r` overflows
+        n = max(round(max_code).bit_length(), 1)
+        # fewer bits, and then coarser steps compressing better and smaller scales
+        key = (n, -(2.0**e / decimal_factor), abs(e))
+        if best is None or key < best[0]:
+            best = (key, (r, e, d, n))
+    if best is None or best[1][3] > 32:
+        raise RuntimeError("max error is too small for the values")
+    return best[1]
+
+
+def _floor_float32(value: float) -> float:
+    """Returns the largest 32-bit float not greater than `value`."""
+    with np.errstate(over="ignore"):
+        rounded = np.float32(value)
+    if rounded > value:
+        rounded = np.nextafter(rounded, np.float32(-np.inf))
+    return float(rounded)
+
+
 def _get_supported_nbit(n: int):
     if n > 32:
         return 64
-    elif n > 16:
-        return 32
-    elif n > 8:
-        return 16
     else:
-        return 8
+        return max(n, 1)
 
 
 def create_bitmap(mask: NDArray[Shape["*"], Bool]) -> NDArray[Shape["*"], UInt8]:
@@ -227,12 +1349,168 @@ def create_bitmap(mask: NDArray[Shape["*"], Bool]) -> NDArray[Shape["*"], UInt8]
 
     In the input `mask`, True (1) must means that data is masked (missing).
     In the output bitmap, 0 means data is missing and 1 means data is present."""
-    extra_len = len(mask) % 8
-    n_pad = 0 if extra_len == 0 else 8 - extra_len
-    array = np.pad(mask, (0, n_pad), constant_values=True).reshape(-1, 8)
-    bits = np.packbits(~array, axis=-1).ravel()
-    return bits
+    # trailing bits are padded with 0, which means missing
+    return np.packbits(~np.asarray(mask))
+
+
+def _create_bitmap_of(data: np.ndarray) -> np.ndarray | None:
+    if not isinstance(data, np.ma.MaskedArray):
+        return None
+    return create_bitmap(np.ma.getmaskarray(data).ravel())
+
+
+def _bitmap_digest(bitmap: np.ndarray, size: int) -> bytes:
+    h = hashlib.blake2b(digest_size=16, person=b"bitmap")
+    h.update(size.to_bytes(8, "big"))
+    h.update(bitmap.view(np.uint8).data)
+    return h.digest()
+
+
+def _mask_digest(
+    data: np.ndarray | None, get_bitmap: Callable[[], np.ndarray | None]
+) -> bytes | None:
+    """Returns a digest of the bitmap of masked `data`, which `get_bitmap` returns and
+    is written in Section 6 anyway, so that only the packed bitmap, 8 times smaller
+    than the mask, is hashed."""
+    if not isinstance(data, np.ma.MaskedArray):
+        return None
+    bitmap = get_bitmap()
+    return None if bitmap is None else _bitmap_digest(bitmap, data.size)
+
+
+class FieldStatistics(NamedTuple):
+    """Statistics of valid (unmasked) values of a field.
+
+    `min` and `max` ignore NaN values and are NaN if there are no such values."""
+
+    min: float
+    max: float
+    has_nan: bool
+    num_of_values: int
+
+    @property
+    def is_unique(self) -> bool:
+        return self.num_of_values > 0 and not self.has_nan and self.min == self.max
+
+
+_STATISTICS_BLOCK_SIZE = 1 << 15
+
+
+def compute_statistics(
+    data: np.ndarray, missing: float | None = None
+) -> FieldStatistics:
+    """Computes statistics of valid values of `data` in a single pass.
+
+    The data is reduced block by block, so that the min, max, and NaN checks of each
+    block are done while the block stays in the CPU cache. If `missing` is given,
+    values equal to it (or NaN values if it is NaN) are not valid."""
+    blocks = _iter_valid_blocks(data, _STATISTICS_BLOCK_SIZE, missing)
+    return _reduce_blocks(blocks, np.issubdtype(data.dtype, np.floating))
+
+
+def _reduce_blocks(blocks: Iterable[np.ndarray], is_float: bool) -> FieldStatistics:
+    min_, max_, has_nan, count = None, None, False, 0
+    for block in blocks:
+        if len(block) == 0:
+            continue
+        count += len(block)
+        block_min = block.min()
+        block_max = block.max()
+        if is_float and np.isnan(block_min):
+            has_nan = True
+            block_min = np.fmin.reduce(block)
+            block_max = np.fmax.reduce(block)
+            if np.isnan(block_min):
+                continue
+        min_ = block_min if min_ is None else min(min_, block_min)
+        max_ = block_max if max_ is None else max(max_, block_max)
+    if min_ is None or max_ is None:
+        return FieldStatistics(np.nan, np.nan, has_nan, count)
+    return FieldStatistics(min_, max_, has_nan, count)
+
+
+def _iter_valid_blocks(
+    data: np.ndarray, block_size: int, missing: float | None = None
+) -> Iterator[np.ndarray]:
+    """Yields flattened valid (unmasked and not `missing`) values of `data` in blocks
+    of `block_size` input elements."""
+    if missing is not None:
+        values = _check_unmasked(data).ravel()
+        for start in range(0, len(values), block_size):
+            block = values[start : start + block_size]
+            yield block[_is_present(block, missing)]
+        return
+
+    if np.ma.isMaskedArray(data):
+        values = np.ma.getdata(data).ravel()
+        mask = np.ma.getmask(data)
+        mask = None if mask is np.ma.nomask else mask.ravel()
+    else:
+        values = np.asarray(data).ravel()
+        mask = None
+
+    for start in range(0, len(values), block_size):
+        end = start + block_size
+        if mask is None:
+            yield values[start:end]
+        else:
+            yield values[start:end][~mask[start:end]]
+
+
+def _iter_present_blocks(
+    data: np.ndarray, block_size: int, missing: float | None = None
+) -> Iterator[np.ndarray]:
+    """Yields flattened boolean arrays in which True means a valid value of `data` in
+    blocks of `block_size` elements."""
+    if missing is not None:
+        values = _check_unmasked(data).ravel()
+        for start in range(0, len(values), block_size):
+            yield _is_present(values[start : start + block_size], missing)
+        return
+
+    mask = np.ma.getmaskarray(data).ravel()
+    for start in range(0, len(mask), block_size):
+        yield ~mask[start : start + block_size]
+
+
+def _split_missing(
+    data: np.ndarray, missing: float
+) -> tuple[np.ndarray, np.ndarray, FieldStatistics]:
+    """Returns valid values of `data` which are not `missing`, the bitmap of them, and
+    their statistics.
+
+    All of them are computed in a single pass over blocks of `data`, while the
+    boolean array of valid values of each block stays in the CPU cache."""
+    flat = _check_unmasked(data).ravel()
+    values = np.empty_like(flat)
+    bitmap = np.empty(ceil(len(flat) / 8), dtype=np.uint8)
+    count = 0
+
+    def iter_blocks():
+        nonlocal count
+        for start in range(0, len(flat), _STATISTICS_BLOCK_SIZE):
+            block = flat[start : start + _STATISTICS_BLOCK_SIZE]
+            present = _is_present(block, missing)
+            bits = np.packbits(present)
+            bitmap[start // 8 : start // 8 + len(bits)] = bits
+            valid = block[present]
+            out = values[count : count + len(valid)]
+            out[...] = valid
+            count += len(valid)
+            yield out
+
+    stats = _reduce_blocks(iter_blocks(), np.issubdtype(flat.dtype, np.floating))
+    return values[:count], bitmap, stats
+
+
+def _is_present(values: np.ndarray, missing: float) -> np.ndarray:
+    """Returns a boolean array in which True means that the value is not missing."""
+    if np.isnan(missing):
+        return values == values  # False only for NaN
+    return values != missing
 
 
-def _is_unique(data: np.ndarray):
-    return (data == data[0]).all()
+def _check_unmasked(data: np.ndarray) -> np.ndarray:
+    if isinstance(data, np.ma.MaskedArray):
+        raise RuntimeError("missing values cannot be used with masked arrays")
+    return np.asarray(data)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import dataclasses
+import io
 from abc import ABC, abstractmethod
 from typing import BinaryIO
 
@@ -14,6 +15,12 @@ class BaseGrid(ABC):
     def write(self, f: BinaryIO) -> int:
         return 0
 
+    def sect_len(self) -> int:
+        """Returns the length of Section 3, which is computed by writing it out unless
+        overridden."""
+        with io.BytesIO() as f:
+            return self.write(f)
+
 
 DTYPE_SHAPE_OF_THE_EARTH = np.dtype(
     [
@@ -178,12 +185,7 @@ class LatitudeLongitudeGrid(BaseGrid):
             dtype=DTYPE_TEMPLATE_3_0_MAIN,
         )
 
-        sect_len = (
-            SECT_HEADER_DTYPE.itemsize
-            + DTYPE_SECTION_3.itemsize
-            + DTYPE_SHAPE_OF_THE_EARTH.itemsize
-            + DTYPE_TEMPLATE_3_0_MAIN.itemsize
-        )
+        sect_len = self.sect_len()
 
         header = create_sect_header(3, sect_len)
         write(f, header)
@@ -192,6 +194,14 @@ class LatitudeLongitudeGrid(BaseGrid):
         write(f, template_main_buf)
         return sect_len
 
+    def sect_len(self) -> int:
+        return (
+            SECT_HEADER_DTYPE.itemsize
+            + DTYPE_SECTION_3.itemsize
+            + DTYPE_SHAPE_OF_THE_EARTH.itemsize
+            + DTYPE_TEMPLATE_3_0_MAIN.itemsize
+        )
+
     def _get_resolution_and_component_flag(self) -> int:
         flag = 0b00000000
         if self.inc_lat is not None:
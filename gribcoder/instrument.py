@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import dataclasses
+import time
+import tracemalloc
+from typing import Any, BinaryIO, Callable, NamedTuple, Optional
+
+_CAN_RESET_PEAK = hasattr(tracemalloc, "reset_peak")  # Python >=3.9
+
+
+class SectionReport(NamedTuple):
+    """Measurements of writing a section.
+
+    `phases` holds wall times of "io" (write calls on the output), "bitmap", and
+    "encoding" spent in the section, and the rest of `seconds` is spent mostly in
+    constructing headers. `peak_alloc` is the peak size of memory allocated during
+    the section in addition to that at its start, or None if not traced."""
+
+    sect_no: int
+    seconds: float
+    nbytes: int
+    phases: dict[str, float]
+    peak_alloc: Optional[int]
+
+
+class MessageReport(NamedTuple):
+    """Measurements of writing a message including those of its sections.
+
+    `io_seconds` is the time spent in writing the message out to the file when it is
+    closed, which happens when it is assembled in memory."""
+
+    seconds: float
+    nbytes: int
+    io_seconds: float
+    peak_alloc: Optional[int]
+    sections: tuple[SectionReport, ...]
+
+
+@dataclasses.dataclass
+class Instrumentation:
+    """Callbacks receiving measurements from `Grib2MessageWriter`.
+
+    `on_section` is called after each section is written, and `on_message` after
+    the message is closed. If `trace_memory` is True, peak allocations are measured
+    with `tracemalloc`, which is started if it is not yet, at a considerable cost.
+    Measuring them for each section requires Python 3.9 or later, and resets the
+    peak recorded by `tracemalloc`.
+
+    Phases of encoders are measured only when they run in the thread writing the
+    message, so that those of fields encoded with `write_fields` in advance are not
+    included."""
+
+    on_section: Optional[Callable[[SectionReport], Any]] = None
+    on_message: Optional[Callable[[MessageReport], Any]] = None
+    trace_memory: bool = False
+
+
+# phases of the section being written in the current context
+_phases: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar(
+    "gribcoder_phases", default=None
+)
+
+
+@contextlib.contextmanager
+def measuring(phase: str):
+    """Adds the time spent in the context to `phase` of the section being written if
+    it is instrumented."""
+    phases = _phases.get()
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_phase(phases, phase, time.perf_counter() - start)
+
+
+def _add_phase(phases: dict[str, float], phase: str, seconds: float):
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class _MessageRecorder:
+    def __init__(self, instrumentation: Instrumentation):
+        self._instrumentation = instrumentation
+        self._sections: list[SectionReport] = []
+        self._phases: dict[str, float] = {}
+        self._token: contextvars.Token | None = None
+
+        self._tracing = instrumentation.trace_memory
+        self._started_tracing = self._tracing and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._alloc_start = 0
+        self._section_alloc_start = 0
+        self._peak = 0
+        if self._tracing:
+            self._alloc_start = tracemalloc.get_traced_memory()[0]
+            if _CAN_RESET_PEAK:
+                tracemalloc.reset_peak()
+
+        self._start = time.perf_counter()
+        self._section_start = self._start
+
+    def wrap(self, f: BinaryIO) -> _TimedWriter:
+        return _TimedWriter(f, self)
+
+    def start_section(self):
+        self._phases = {}
+        self._token = _phases.set(self._phases)
+        if self._tracing and _CAN_RESET_PEAK:
+            self._update_peak()
+            tracemalloc.reset_peak()
+            self._section_alloc_start = tracemalloc.get_traced_memory()[0]
+        self._section_start = time.perf_counter()
+
+    def end_section(self, sect_no: int, nbytes: int):
+        seconds = time.perf_counter() - self._section_start
+        self._reset_phases()
+        peak_alloc = None
+        if self._tracing and _CAN_RESET_PEAK:
+            peak = tracemalloc.get_traced_memory()[1]
+            peak_alloc = max(peak - self._section_alloc_start, 0)
+        report = SectionReport(sect_no, seconds, nbytes, self._phases, peak_alloc)
+        self._sections.append(report)
+        if self._instrumentation.on_section is not None:
+            self._instrumentation.on_section(report)
+
+    def abort_section(self):
+        self._reset_phases()
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def add_io(self, seconds: float):
+        if self._token is not None:  # not counted outside sections
+            _add_phase(self._phases, "io", seconds)
+
+    def end_message(self, nbytes: int, io_seconds: float):
+        seconds = time.perf_counter() - self._start
+        peak_alloc = None
+        if self._tracing and (_CAN_RESET_PEAK or self._started_tracing):
+            self._update_peak()
+            peak_alloc = self._peak
+        if self._started_tracing:
+            tracemalloc.stop()
+        report = MessageReport(
+            seconds, nbytes, io_seconds, peak_alloc, tuple(self._sections)
+        )
+        if self._instrumentation.on_message is not None:
+            self._instrumentation.on_message(report)
+
+    def _update_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        self._peak = max(self._peak, peak - self._alloc_start)
+
+    def _reset_phases(self):
+        if self._token is not None:
+            _phases.reset(self._token)
+            self._token = None
+
+
+class _TimedWriter:
+    """A file-like object measuring time spent in writing to `f`."""
+
+    def __init__(self, f: BinaryIO, recorder: _MessageRecorder):
+        self._f = f
+        self._recorder = recorder
+
+    def write(self, b) -> int:
+        start = time.perf_counter()
+        try:
+            return self._f.write(b)
+        finally:
+            self._recorder.add_io(time.perf_counter() - start)
+
+    def __getattr__(self, name: str):
+        return getattr(self._f, name)
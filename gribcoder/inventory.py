@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Any, NamedTuple, TextIO
+
+import numpy as np
+
+from .message import DTYPE_SECTION_1
+from .product import _DTYPE_SECTION_4_TEMPLATE_4_0
+from .utils import SECT_HEADER_DTYPE, from_grib_signed
+
+# product definition templates whose first part is the same as template 4.0
+_TEMPLATES_EXTENDING_4_0 = (0, 1, 2, 8, 11, 12)
+
+
+class InventoryField(NamedTuple):
+    """Octets of the sections of a field kept for the inventory."""
+
+    offset: int  # of the first section of the field from the start of the message
+    length: int
+    sect4: bytes
+
+
+class InventoryWriter:
+    """A writer of an inventory of messages to `f` in JSON Lines.
+
+    Each line describes a field with the following keys, where offsets are octets
+    from the start of the GRIB2 file, so that the field can be fetched with range
+    requests:
+
+    - `offset` and `length`: the message containing the field
+    - `field`: the number of the field in the message starting from 0
+    - `field_offset` and `field_length`: Sections 3 (if any) to 7 of the field
+    - `discipline` and `reftime`: from Sections 0 and 1
+    - `parameter`: [category, number]
+    - `forecast_time`: [unit of time range, forecast time]
+    - `surfaces`: two [type, scale factor, scale value] or null for missing ones
+
+    Keys from Section 4 are null for product definition templates other than 4.0 and
+    those extending it. Offsets of messages written to non-seekable streams are
+    counted from `offset`, assuming that the stream has no other content."""
+
+    def __init__(self, f: TextIO, offset: int = 0):
+        self.f = f
+        self._next_offset = offset
+
+    def add_message(
+        self,
+        offset: int | None,
+        length: int,
+        discipline: int,
+        sect1: bytes,
+        fields: list[InventoryField],
+    ):
+        """Writes lines for the fields of a message. If `offset` is None, the message
+        is regarded as following the last one."""
+        if offset is None:
+            offset = self._next_offset
+        self._next_offset = offset + length
+        reftime = _parse_reftime(sect1).isoformat()
+        for i, field in enumerate(fields):
+            entry = {
+                "offset": offset,
+                "length": length,
+                "field": i,
+                "field_offset": offset + field.offset,
+                "field_length": field.length,
+                "discipline": discipline,
+                "reftime": reftime,
+                **_parse_sect4(field.sect4),
+            }
+            self.f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def _parse_reftime(sect1: bytes | np.ndarray) -> datetime:
+    values = np.frombuffer(
+        sect1, DTYPE_SECTION_1, count=1, offset=SECT_HEADER_DTYPE.itemsize
+    )[0]
+    return datetime(
+        int(values["year"]),
+        int(values["month"]),
+        int(values["day"]),
+        int(values["hour"]),
+        int(values["minute"]),
+        int(values["second"]),
+    )
+
+
+def _parse_sect4(sect4: bytes | np.ndarray) -> dict[str, Any]:
+    if len(sect4) < _DTYPE_SECTION_4_TEMPLATE_4_0.itemsize:
+        return _NULL_SECT4_ENTRY
+    values = np.frombuffer(sect4, _DTYPE_SECTION_4_TEMPLATE_4_0, count=1)[0]
+    template_num = values["main"]["product_definition_template_number"]
+    if template_num not in _TEMPLATES_EXTENDING_4_0:
+        return _NULL_SECT4_ENTRY
+
+    parameter = values["parameter"]
+    forecast_time = values["forecast_time"]
+    return {
+        "parameter": [
+            int(parameter["parameter_category"]),
+            int(parameter["parameter_number"]),
+        ],
+        "forecast_time": [
+            int(forecast_time["indicator_of_unit_of_time_range"]),
+            from_grib_signed(int(forecast_time["forecast_time"]), 4),
+        ],
+        "surfaces": [_parse_fixed_surface(surface) for surface in values["horizontal"]],
+    }
+
+
+_NULL_SECT4_ENTRY: dict[str, Any] = {
+    "parameter": None,
+    "forecast_time": None,
+    "surfaces": None,
+}
+
+
+def _parse_fixed_surface(surface: np.void) -> list[int] | None:
+    type_ = int(surface["type_of_fixed_surface"])
+    if type_ == 0xFF:
+        return None
+    scale_factor = int(surface["scale_factor_of_fixed_surface"])
+    if scale_factor != 0xFF:
+        scale_factor = from_grib_signed(scale_factor, 1)
+    return [type_, scale_factor, int(surface["scale_value_of_fixed_surface"])]
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, NamedTuple, Sequence, cast
+
+import numpy as np
+
+from .context import Grib2MessageWriter
+from .encoders import BaseEncoder
+from .grid import BaseGrid
+from .message import DTYPE_SECTION_0, DTYPE_SECTION_1, Identification, Indicator
+from .parallel import Field, PreEncodedSections
+from .product import BaseProductDefinition
+from .utils import SECT_HEADER_DTYPE, BufferWriter
+
+_SECT0_LEN = DTYPE_SECTION_0.itemsize
+_SECT1_LEN = SECT_HEADER_DTYPE.itemsize + DTYPE_SECTION_1.itemsize
+_SECT8_LEN = 4
+_PREVIOUSLY_DEFINED_BITMAP_SECT6_LEN = 6
+
+
+class Message(NamedTuple):
+    """A message with `fields` to be written with `write_messages`."""
+
+    ind: Indicator
+    ident: Identification
+    fields: Sequence[Field]
+
+
+class SectionLayout(NamedTuple):
+    num: int
+    offset: int
+    length: int
+
+
+class MessageLayout(NamedTuple):
+    offset: int
+    length: int
+    sections: tuple[SectionLayout, ...]
+
+
+def plan_layout(messages: Sequence[Message], offset: int = 0) -> list[MessageLayout]:
+    """Returns offsets and lengths of messages and their sections in a file where
+    `messages` are written from `offset` one after another.
+
+    Lengths are computed without encoding for fields with encoders whose
+    `sect_lens()` are known. Other fields are encoded to get them."""
+    prepared = [_prepare_message(message) for message in messages]
+    return _plan_layout([sect_lens for sect_lens, _ in prepared], offset)
+
+
+def write_messages(
+    f: BinaryIO,
+    messages: Sequence[Message],
+    max_workers: int | None = None,
+    use_mmap: bool = False,
+) -> list[MessageLayout]:
+    """Writes `messages` to the file `f` in parallel on a thread pool and returns the
+    layout of them.
+
+    The layout of the whole output is planned first so that each message is written
+    at its own offset with `os.pwrite` without seeking back to patch Section 0. `f`
+    must be a file with a file descriptor, and it is positioned at the end of the
+    messages on return.
+
+    If `use_mmap` is True, the file is extended to the planned size in advance and
+    messages are written into its memory-mapped region instead. Simple packing and
+    IEEE encoders then convert values directly into the file pages. `f` must be
+    opened for both reading and writing, e.g. with mode "w+b"."""
+    f.flush()
+    start_pos = f.tell()
+    fd = f.fileno()
+    with ThreadPoolExecutor(max_workers) as executor:
+        prepared = list(executor.map(_prepare_message, messages))
+        layouts = _plan_layout([sect_lens for sect_lens, _ in prepared], start_pos)
+        end_pos = start_pos + sum(layout.length for layout in layouts)
+
+        mapped = None
+        if use_mmap and end_pos > start_pos:
+            if os.fstat(fd).st_size < end_pos:
+                os.ftruncate(fd, end_pos)
+            shape = (end_pos - start_pos,)
+            mapped = np.memmap(f, np.uint8, mode="r+", offset=start_pos, shape=shape)
+
+        futures = []
+        for message, (_, encoders), layout in zip(messages, prepared, layouts):
+            # both provide `write` as used by the message writer
+            if mapped is None:
+                out = cast(BinaryIO, _PositionalWriter(fd, layout.offset))
+            else:
+                out = cast(BinaryIO, BufferWriter(mapped, layout.offset - start_pos))
+            futures.append(
+                executor.submit(_write_message, out, message, encoders, layout)
+            )
+        for future in futures:
+            future.result()
+        if mapped is not None:
+            mapped.flush()
+    f.seek(end_pos)
+    return layouts
+
+
+def estimate_message_size(
+    grid: BaseGrid,
+    product: BaseProductDefinition,
+    encoder: BaseEncoder,
+    shape: tuple[int, ...],
+    mask: np.ndarray | None = None,
+) -> int:
+    """Returns the exact length of a message with one field of `shape` without
+    encoding or even reading the data.
+
+    `encoder` is used only for its parameters, so that no input needs to be given to
+    it. `mask` is a boolean array in which True means missing as in
+    `np.ma.MaskedArray`, and a bitmap is assumed to be written if it is given. Sizes
+    of complex packing, PNG packing, and run length packing depend on the data values
+    and cannot be estimated."""
+    sect_lens = encoder.sect_lens_for(shape, mask)
+    if sect_lens is None:
+        raise RuntimeError("message size cannot be known without encoding the data")
+    return (
+        _SECT0_LEN
+        + _SECT1_LEN
+        + grid.sect_len()
+        + product.sect_len()
+        + sum(sect_lens)
+        + _SECT8_LEN
+    )
+
+
+def _prepare_message(
+    message: Message,
+) -> tuple[list[tuple[int, int]], list[BaseEncoder]]:
+    """Creates encoders of fields in `message` and returns them with numbers and
+    lengths of the sections of the message."""
+    sect_lens = [(0, message.ind.sect_len()), (1, message.ident.sect_len())]
+    encoders = []
+    last_bitmap_digest = None
+    for field in message.fields:
+        encoder = field.encoder(field.data)
+        lens = encoder.sect_lens()
+        if lens is None:
+            encoder = PreEncodedSections.from_encoder(encoder)
+            lens = encoder.sect_lens()
+        encoders.append(encoder)
+
+        sect5_len, sect6_len, sect7_len = lens
+        # same as in `Grib2MessageWriter`
+        digest = encoder.bitmap_digest()
+        if digest is not None and digest == last_bitmap_digest:
+            sect6_len = _PREVIOUSLY_DEFINED_BITMAP_SECT6_LEN
+        else:
+            last_bitmap_digest = digest
+
+        if field.grid is not None:
+            sect_lens.append((3, field.grid.sect_len()))
+        sect_lens.append((4, field.product.sect_len()))
+        sect_lens.extend([(5, sect5_len), (6, sect6_len), (7, sect7_len)])
+    sect_lens.append((8, _SECT8_LEN))
+    return sect_lens, encoders
+
+
+def _plan_layout(
+    sect_lens_list: list[list[tuple[int, int]]], offset: int
+) -> list[MessageLayout]:
+    layouts = []
+    for sect_lens in sect_lens_list:
+        sections = []
+        pos = offset
+        for num, length in sect_lens:
+            sections.append(SectionLayout(num, pos, length))
+            pos += length
+        layouts.append(MessageLayout(offset, pos - offset, tuple(sections)))
+        offset = pos
+    return layouts
+
+
+def _write_message(
+    f: BinaryIO, message: Message, encoders: list[BaseEncoder], layout: MessageLayout
+):
+    # Section 0 is written with the planned length so that it is not patched later
+    ind = copy.copy(message.ind)
+    ind.total_length = layout.length
+    with Grib2MessageWriter(f, ind, message.ident) as grib2:
+        for field, encoder in zip(message.fields, encoders):
+            if field.grid is not None:
+                grib2._write_sect3(field.grid)
+            grib2._write_sect4(field.product)
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+    if grib2._size != layout.length:
+        raise RuntimeError("message length differs from the planned one")
+
+
+class _PositionalWriter:
+    """A file-like object writing to a file descriptor at its own position with
+    `os.pwrite`, which does not change the file offset shared with others."""
+
+    def __init__(self, fd: int, pos: int):
+        self._fd = fd
+        self._pos = pos
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = os.SEEK_SET) -> int:
+        if whence != os.SEEK_SET:
+            raise RuntimeError("only absolute positions are supported")
+        self._pos = pos
+        return pos
+
+    def write(self, b) -> int:
+        written = 0
+        with memoryview(b) as view, view.cast("B") as octets:
+            while written < len(octets):
+                written += os.pwrite(self._fd, octets[written:], self._pos + written)
+        self._pos += written
+        return written
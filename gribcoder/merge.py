@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import errno
+import os
+from typing import BinaryIO, Callable, Iterable, Optional, Union
+
+from .reader import Grib2Field, Grib2Reader
+
+# errors meaning that the copy method is not supported for the files
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTSOCK,
+    errno.EBADF,
+}
+_READ_WRITE_BLOCK_SIZE = 1 << 20
+
+
+def copy_messages(
+    dst: BinaryIO,
+    srcs: Iterable[Union[str, os.PathLike]],
+    predicate: Optional[Callable[[Grib2Field], bool]] = None,
+) -> int:
+    """Copies messages in the files `srcs` to `dst` in order without decoding them,
+    and returns the number of copied messages.
+
+    If `predicate` is given, only messages with any field for which it returns True
+    are copied, e.g. `lambda field: field.metadata()["parameter"] == [0, 0]`. Only
+    section headers and Sections 1 and 4 are read to find and filter messages, and
+    consecutive messages are copied at once from file to file in the kernel with
+    `os.copy_file_range` or `os.sendfile`. Plain reads and writes are used only where
+    neither is supported."""
+    dst.flush()
+    if dst.seekable():
+        dst.seek(dst.tell())  # syncs the file offset used by the system calls
+    dst_fd = dst.fileno()
+    num_messages = 0
+    for src in srcs:
+        with Grib2Reader(src) as reader:
+            ranges = _select_ranges(reader.fields, predicate)
+        with open(src, "rb") as f:
+            for offset, length, num in ranges:
+                _copy_range(f.fileno(), dst_fd, offset, length)
+                num_messages += num
+    if dst.seekable():
+        dst.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+    return num_messages
+
+
+def _select_ranges(
+    fields: list[Grib2Field], predicate: Optional[Callable[[Grib2Field], bool]]
+) -> list[tuple[int, int, int]]:
+    """Returns offsets, lengths, and numbers of messages of runs of consecutive
+    messages to be copied."""
+    ranges: list[tuple[int, int, int]] = []
+    last_offset = None
+    for field in fields:
+        if field.offset == last_offset:
+            continue  # the message is already selected
+        if predicate is not None and not predicate(field):
+            continue
+        last_offset = field.offset
+        if ranges and sum(ranges[-1][:2]) == field.offset:
+            offset, length, num = ranges[-1]
+            ranges[-1] = (offset, length + field.length, num + 1)
+        else:
+            ranges.append((field.offset, field.length, 1))
+    return ranges
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int):
+    methods = [
+        method
+        for method, name in [
+            (_copy_file_range, "copy_file_range"),
+            (_sendfile, "sendfile"),
+        ]
+        if hasattr(os, name)
+    ]
+    methods.append(_read_write)
+    end = offset + count
+    while offset < end:
+        try:
+            copied = methods[0](src_fd, dst_fd, offset, end - offset)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS or len(methods) == 1:
+                raise
+            methods.pop(0)
+            continue
+        if copied == 0:
+            raise RuntimeError("file is shorter than expected")
+        offset += copied
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _read_write(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    data = os.pread(src_fd, min(count, _READ_WRITE_BLOCK_SIZE), offset)
+    with memoryview(data) as view:
+        written = 0
+        while written < len(view):
+            written += os.write(dst_fd, view[written:])
+    return len(data)
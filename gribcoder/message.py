@@ -47,6 +47,9 @@ class Indicator:
         )
 
         write(f, section_buf)
+        return self.sect_len()
+
+    def sect_len(self) -> int:
         return DTYPE_SECTION_0.itemsize
 
 
@@ -83,9 +86,12 @@ class Identification:
             dtype=DTYPE_SECTION_1,
         )
 
-        sect_len = SECT_HEADER_DTYPE.itemsize + DTYPE_SECTION_1.itemsize
+        sect_len = self.sect_len()
 
         header = create_sect_header(1, sect_len)
         write(f, header)
         write(f, section_buf)
         return sect_len
+
+    def sect_len(self) -> int:
+        return SECT_HEADER_DTYPE.itemsize + DTYPE_SECTION_1.itemsize
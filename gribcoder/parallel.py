@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import collections
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import BinaryIO, Callable, Deque, Iterable, NamedTuple, Optional, cast
+
+import numpy as np
+
+from .context import Grib2MessageWriter
+from .encoders import BaseEncoder
+from .grid import BaseGrid
+from .product import BaseProductDefinition
+
+DEFAULT_MAX_IN_FLIGHT_BYTES = 1 << 28
+
+
+class Field(NamedTuple):
+    """A field to be written with `write_fields`.
+
+    `encoder` is called with `data` and returns an encoder with the data as its input,
+    e.g. `lambda data: SimplePackingEncoder.auto_parametrized_from(data, nbit=12)`.
+    If `grid` is not None, Section 3 is written before Section 4 of the field."""
+
+    product: BaseProductDefinition
+    data: np.ndarray
+    encoder: Callable[[np.ndarray], BaseEncoder]
+    grid: Optional[BaseGrid] = None
+
+
+class _PendingField(NamedTuple):
+    field: Field
+    future: Future
+    cost: int
+    shm: Optional[shared_memory.SharedMemory]
+
+
+def write_fields(
+    grib2: Grib2MessageWriter,
+    fields: Iterable[Field],
+    max_workers: int | None = None,
+    max_in_flight_bytes: int = DEFAULT_MAX_IN_FLIGHT_BYTES,
+    use_processes: bool = False,
+):
+    """Encodes `fields` in parallel on a thread pool and writes them to the message in
+    the given order.
+
+    At most `max_workers` fields are encoded at the same time. Fields are not
+    submitted while the total size of the input data of fields submitted but not yet
+    written exceeds `max_in_flight_bytes`, although one field is always allowed.
+
+    If `use_processes` is True, fields are encoded on a process pool instead. Input
+    data and encoded sections are passed through shared memory rather than pickled,
+    while `encoder` of each field must be picklable, e.g.
+    `functools.partial(SimplePackingEncoder.auto_parametrized_from, nbit=12)`."""
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    pending: Deque[_PendingField] = collections.deque()
+    try:
+        with executor_cls(max_workers) as executor:
+            try:
+                in_flight = 0
+                for field in fields:
+                    cost = field.data.nbytes
+                    while pending and in_flight + cost > max_in_flight_bytes:
+                        in_flight -= _write_next(grib2, pending)
+                    if use_processes:
+                        pending.append(_submit_to_process(executor, field, cost))
+                    else:
+                        future = executor.submit(_encode_field, field)
+                        pending.append(_PendingField(field, future, cost, None))
+                    in_flight += cost
+                while pending:
+                    _write_next(grib2, pending)
+            except BaseException:
+                for entry in pending:
+                    entry.future.cancel()
+                raise
+    finally:
+        # resources of fields not written due to errors
+        for entry in pending:
+            _release_pending_field(entry)
+
+
+def _write_next(grib2: Grib2MessageWriter, pending: Deque[_PendingField]) -> int:
+    entry = pending[0]
+    result = entry.future.result()
+    if entry.field.grid is not None:
+        grib2._write_sect3(entry.field.grid)
+    grib2._write_sect4(entry.field.product)
+    if isinstance(result, _SharedSections):
+        _write_shared_sections(grib2, result)
+    else:
+        _write_encoded_sections(grib2, result)
+    pending.popleft()
+    _release_pending_field(entry)
+    return entry.cost
+
+
+def _write_encoded_sections(grib2: Grib2MessageWriter, encoder: BaseEncoder):
+    grib2._write_sect5(encoder)
+    grib2._write_sect6(encoder)
+    grib2._write_sect7(encoder)
+
+
+def _encode_field(field: Field) -> PreEncodedSections:
+    return PreEncodedSections.from_encoder(field.encoder(field.data))
+
+
+class PreEncodedSections(BaseEncoder):
+    """An encoder which writes Sections 5, 6, and 7 recorded from another encoder.
+
+    Recording makes it possible to do the encoding away from the thread or process
+    writing the message."""
+
+    def __init__(
+        self,
+        sects: tuple[list, list, list],
+        bitmap_digest: bytes | None = None,
+    ):
+        self._sects = sects
+        self._bitmap_digest = bitmap_digest
+
+    @classmethod
+    def from_encoder(cls, encoder: BaseEncoder) -> PreEncodedSections:
+        sect5, sect6, sect7 = _Recorder(), _Recorder(), _Recorder()
+        # encoders call only `write` of the stream
+        encoder.write_sect5(cast(BinaryIO, sect5))
+        encoder.write_sect6(cast(BinaryIO, sect6))
+        encoder.write_sect7(cast(BinaryIO, sect7))
+        sects = (sect5.chunks, sect6.chunks, sect7.chunks)
+        return cls(sects, encoder.bitmap_digest())
+
+    def sect_lens(self) -> tuple[int, int, int]:
+        sect5, sect6, sect7 = (
+            sum(_nbytes(chunk) for chunk in chunks) for chunks in self._sects
+        )
+        return (sect5, sect6, sect7)
+
+    def bitmap_digest(self) -> bytes | None:
+        return self._bitmap_digest
+
+    def write_sect5(self, f: BinaryIO) -> int:
+        return _write_chunks(f, self._sects[0])
+
+    def write_sect6(self, f: BinaryIO) -> int:
+        return _write_chunks(f, self._sects[1])
+
+    def write_sect7(self, f: BinaryIO) -> int:
+        return _write_chunks(f, self._sects[2])
+
+
+class _Recorder:
+    """A file-like object keeping references to the buffers written to it instead of
+    copying them."""
+
+    def __init__(self):
+        self.chunks: list = []
+
+    def write(self, b) -> int:
+        self.chunks.append(b)
+        return _nbytes(b)
+
+
+def _write_chunks(f: BinaryIO, chunks: list) -> int:
+    size = 0
+    for chunk in chunks:
+        f.write(chunk)
+        size += _nbytes(chunk)
+    return size
+
+
+def _nbytes(b) -> int:
+    with memoryview(b) as view:
+        return view.nbytes
+
+
+class _SharedInput(NamedTuple):
+    name: str
+    shape: tuple[int, ...]
+    dtype: np.dtype
+    masked: bool
+
+
+class _SharedSections(NamedTuple):
+    name: str
+    sect_lens: tuple[int, int, int]
+    bitmap_digest: Optional[bytes]
+
+
+def _submit_to_process(executor: Executor, field: Field, cost: int) -> _PendingField:
+    data = field.data
+    masked = isinstance(data, np.ma.MaskedArray)
+    data_nbytes = data.size * data.dtype.itemsize
+    mask_nbytes = data.size if masked else 0
+    size = max(data_nbytes + mask_nbytes, 1)  # shared memory cannot be empty
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        values: np.ndarray = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+        np.copyto(values, np.ma.getdata(data))
+        if masked:
+            mask: np.ndarray = np.ndarray(
+                data.shape, np.bool_, buffer=shm.buf, offset=data_nbytes
+            )
+            np.copyto(mask, np.ma.getmaskarray(data))
+            del mask
+        del values
+        input_ = _SharedInput(shm.name, data.shape, data.dtype, masked)
+        future = executor.submit(_encode_shared_field, field.encoder, input_)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    return _PendingField(field, future, cost, shm)
+
+
+def _encode_shared_field(
+    encoder_factory: Callable[[np.ndarray], BaseEncoder], input_: _SharedInput
+) -> _SharedSections:
+    """Encodes input data in shared memory and returns encoded sections also in
+    shared memory, which must be unlinked by the caller."""
+    in_shm = shared_memory.SharedMemory(input_.name)
+    try:
+        # recorded buffers may be views of the input and must be dropped before closing
+        sects = _encode_shared_input(encoder_factory, in_shm, input_)
+        sect_lens = sects.sect_lens()
+        out_shm = shared_memory.SharedMemory(create=True, size=max(sum(sect_lens), 1))
+        try:
+            _copy_sections(sects, out_shm)
+        except BaseException:
+            out_shm.close()
+            out_shm.unlink()
+            raise
+        result = _SharedSections(out_shm.name, sect_lens, sects.bitmap_digest())
+        del sects
+        out_shm.close()
+    finally:
+        in_shm.close()
+    return result
+
+
+def _encode_shared_input(
+    encoder_factory: Callable[[np.ndarray], BaseEncoder],
+    shm: shared_memory.SharedMemory,
+    input_: _SharedInput,
+) -> PreEncodedSections:
+    data: np.ndarray = np.ndarray(input_.shape, dtype=input_.dtype, buffer=shm.buf)
+    if input_.masked:
+        offset = data.nbytes
+        mask: np.ndarray = np.ndarray(
+            input_.shape, np.bool_, buffer=shm.buf, offset=offset
+        )
+        data = np.ma.MaskedArray(data, mask=mask)
+    return PreEncodedSections.from_encoder(encoder_factory(data))
+
+
+def _copy_sections(sects: PreEncodedSections, shm: shared_memory.SharedMemory):
+    buf: np.ndarray = np.ndarray(shm.size, dtype=np.uint8, buffer=shm.buf)
+    pos = 0
+    for chunks in sects._sects:
+        for chunk in chunks:
+            octets = np.frombuffer(chunk, dtype=np.uint8)
+            buf[pos : pos + len(octets)] = octets
+            pos += len(octets)
+
+
+def _write_shared_sections(grib2: Grib2MessageWriter, result: _SharedSections):
+    shm = shared_memory.SharedMemory(result.name)
+    try:
+        # a gathering writer keeps the written buffers until the message is closed,
+        # after the shared memory is released
+        sects = _split_shared_sections(shm, result, copy=grib2._gathering)
+        _write_encoded_sections(grib2, sects)
+        del sects
+    finally:
+        shm.close()
+
+
+def _split_shared_sections(
+    shm: shared_memory.SharedMemory, result: _SharedSections, copy: bool = False
+) -> PreEncodedSections:
+    buf: np.ndarray = np.ndarray(shm.size, dtype=np.uint8, buffer=shm.buf)
+    if copy:
+        buf = buf[: sum(result.sect_lens)].copy()
+    ends = np.cumsum(result.sect_lens)
+    starts = ends - result.sect_lens
+    sect5, sect6, sect7 = ([buf[start:end]] for start, end in zip(starts, ends))
+    return PreEncodedSections((sect5, sect6, sect7), result.bitmap_digest)
+
+
+def _release_pending_field(entry: _PendingField):
+    if entry.shm is None:
+        return
+    entry.shm.close()
+    entry.shm.unlink()
+    future = entry.future
+    if future.done() and not future.cancelled() and future.exception() is None:
+        result = future.result()
+        _unlink_shared_memory(result.name)
+
+
+def _unlink_shared_memory(name: str):
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import dataclasses
+import io
 from abc import ABC, abstractmethod
 from typing import BinaryIO, NamedTuple, Optional
 
@@ -48,6 +49,19 @@ _DTYPE_SECTION_4_FIXED_SURFACE = np.dtype(
 )
 
 
+# the whole Section 4 with product definition template 4.0
+_DTYPE_SECTION_4_TEMPLATE_4_0 = np.dtype(
+    [
+        ("header", SECT_HEADER_DTYPE),
+        ("main", DTYPE_SECTION_4),
+        ("parameter", _DTYPE_SECTION_4_PARAMETER),
+        ("generating_process", DTYPE_SECTION_4_GENERATING_PROCESS),
+        ("forecast_time", DTYPE_SECTION_4_FORECAST_TIME),
+        ("horizontal", _DTYPE_SECTION_4_FIXED_SURFACE, (2,)),
+    ]
+)
+
+
 class ProductParameter(NamedTuple):
     category: int
     number: int
@@ -67,6 +81,12 @@ class BaseProductDefinition(ABC):
     def write(self, f: BinaryIO) -> int:
         return 0
 
+    def sect_len(self) -> int:
+        """Returns the length of Section 4, which is computed by writing it out unless
+        overridden."""
+        with io.BytesIO() as f:
+            return self.write(f)
+
 
 @dataclasses.dataclass
 class ProductDefinitionWithTemplate4_0:
@@ -104,20 +124,7 @@ class ProductDefinitionWithTemplate4_0:
             Optional[FixedSurface], Optional[FixedSurface]
         ],  # PEP 604 (`A | B` syntax) is not supported in Python <3.10
     ):  # `-> Self` for Python >=3.11 (PEP 673)
-        surfaces_ = [
-            [NULL_FIXED_SURFACE]
-            if fs is None
-            else [
-                FixedSurface(
-                    fs.type,
-                    grib_signed(fs.scale_factor, 1),
-                    fs.scale_value,
-                )
-            ]
-            for fs in surfaces
-        ]
-
-        values = np.array(surfaces_, dtype=_DTYPE_SECTION_4_FIXED_SURFACE)
+        values = _create_fixed_surfaces(surfaces)
 
         if len(values) != 2:
             raise RuntimeError("wrong length")
@@ -130,14 +137,7 @@ class ProductDefinitionWithTemplate4_0:
             dtype=DTYPE_SECTION_4,
         )
 
-        sect_len = (
-            SECT_HEADER_DTYPE.itemsize
-            + DTYPE_SECTION_4.itemsize
-            + _DTYPE_SECTION_4_PARAMETER.itemsize
-            + DTYPE_SECTION_4_GENERATING_PROCESS.itemsize
-            + DTYPE_SECTION_4_FORECAST_TIME.itemsize
-            + _DTYPE_SECTION_4_FIXED_SURFACE.itemsize * 2
-        )
+        sect_len = self.sect_len()
 
         header = create_sect_header(4, sect_len)
         write(f, header)
@@ -147,3 +147,27 @@ class ProductDefinitionWithTemplate4_0:
         write(f, self._forecast_time)
         write(f, self._horizontal)
         return sect_len
+
+    def sect_len(self) -> int:
+        return (
+            SECT_HEADER_DTYPE.itemsize
+            + DTYPE_SECTION_4.itemsize
+            + _DTYPE_SECTION_4_PARAMETER.itemsize
+            + DTYPE_SECTION_4_GENERATING_PROCESS.itemsize
+            + DTYPE_SECTION_4_FORECAST_TIME.itemsize
+            + _DTYPE_SECTION_4_FIXED_SURFACE.itemsize * 2
+        )
+
+
+def _create_fixed_surfaces(
+    surfaces: tuple[Optional[FixedSurface], Optional[FixedSurface]],
+) -> np.ndarray:
+    surfaces_ = [
+        (
+            NULL_FIXED_SURFACE
+            if fs is None
+            else FixedSurface(fs.type, grib_signed(fs.scale_factor, 1), fs.scale_value)
+        )
+        for fs in surfaces
+    ]
+    return np.array(surfaces_, dtype=_DTYPE_SECTION_4_FIXED_SURFACE)
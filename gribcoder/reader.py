@@ -0,0 +1,446 @@
+from __future__ import annotations
+
+import dataclasses
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Iterator, Optional, Union
+
+import numpy as np
+
+from .encoders import (
+    _DTYPE_SECTION_5,
+    _DTYPE_TEMPLATE_5_0,
+    _DTYPE_TEMPLATE_5_2,
+    _DTYPE_TEMPLATE_5_4,
+    _IEEE_DTYPES,
+    _PNG_SIGNATURE,
+)
+from .grid import DTYPE_SECTION_3, DTYPE_SHAPE_OF_THE_EARTH, DTYPE_TEMPLATE_3_0_MAIN
+from .inventory import _parse_reftime, _parse_sect4
+from .message import DTYPE_SECTION_0
+from .utils import SECT_HEADER_DTYPE, _container_size, from_grib_signed, unpack_bits
+
+_GRIB = 0x47524942
+_END_SECTION = b"7777"
+_BYTE_ALIGNED_DTYPES = {8: ">u1", 16: ">u2", 32: ">u4", 64: ">u8"}
+_PNG_CHANNELS = {0: 1, 2: 3, 6: 4}  # grayscale, RGB, and RGBA
+
+
+@dataclasses.dataclass(frozen=True)
+class Grib2Field:
+    """A field in a GRIB2 file read with `Grib2Reader`.
+
+    Offsets are octets from the start of the file. Only section headers are read
+    when the file is opened, and the data are not decoded until `values` is called.
+    """
+
+    buf: np.ndarray = dataclasses.field(repr=False, compare=False)  # the whole file
+    offset: int  # of the message
+    length: int  # of the message
+    discipline: int
+    sect1: int
+    sect3: int
+    sect4: int
+    sect5: int
+    sect6: Optional[int]  # the bitmap section in effect, or None without a bitmap
+    sect7: int
+
+    @property
+    def reftime(self) -> datetime:
+        return _parse_reftime(self._section(self.sect1))
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """The shape of the data, which is 2-dimensional for grid definition
+        template 3.0 and 1-dimensional otherwise."""
+        pos = self.sect3 + SECT_HEADER_DTYPE.itemsize
+        main = np.frombuffer(self.buf, DTYPE_SECTION_3, count=1, offset=pos)[0]
+        if main["grid_definition_template_number"] != 0:
+            return (int(main["number_of_data_points"]),)
+        pos += DTYPE_SECTION_3.itemsize + DTYPE_SHAPE_OF_THE_EARTH.itemsize
+        grid = np.frombuffer(self.buf, DTYPE_TEMPLATE_3_0_MAIN, count=1, offset=pos)[0]
+        n_i, n_j = int(grid["n_i"]), int(grid["n_j"])
+        consecutive_in_j = grid["scanning_mode"] & 0b00100000
+        return (n_i, n_j) if consecutive_in_j else (n_j, n_i)
+
+    def metadata(self) -> dict[str, Any]:
+        """Returns the parameter, the forecast time, and the fixed surfaces in the
+        same form as in the inventory written by `InventoryWriter`."""
+        return _parse_sect4(self._section(self.sect4))
+
+    def message(self) -> np.ndarray:
+        """Returns octets of the message containing the field without copying."""
+        return self.buf[self.offset : self.offset + self.length]
+
+    def values(self) -> Union[np.ndarray, np.ma.MaskedArray]:
+        """Decodes the data, which are returned as a masked array if a bitmap is
+        given.
+
+        Byte-aligned simple packing is unscaled directly from the mapped octets.
+        Without a bitmap, IEEE floating point data are returned as a read-only view
+        of the mapped octets. Data representation templates 5.0 (simple packing), 5.2
+        and 5.3 (complex packing), 5.4 (IEEE floating point), and 5.41 (PNG packing)
+        are supported, while 5.200 (run length packing) is not."""
+        pos = self.sect5 + SECT_HEADER_DTYPE.itemsize
+        main = np.frombuffer(self.buf, _DTYPE_SECTION_5, count=1, offset=pos)[0]
+        count = int(main["num_of_values"])
+        template_num = int(main["template_num"])
+        pos += _DTYPE_SECTION_5.itemsize
+        data_pos = self.sect7 + SECT_HEADER_DTYPE.itemsize
+
+        if template_num == 0:
+            template = np.frombuffer(self.buf, _DTYPE_TEMPLATE_5_0, count=1, offset=pos)
+            values = _unpack_simple(self.buf, data_pos, count, template[0])
+        elif template_num in (2, 3):
+            template = np.frombuffer(self.buf, _DTYPE_TEMPLATE_5_2, count=1, offset=pos)
+            order = num_octets = 0
+            if template_num == 3:
+                pos += _DTYPE_TEMPLATE_5_2.itemsize
+                order, num_octets = (int(v) for v in self.buf[pos : pos + 2])
+            encoded = _unpack_complex(
+                self.buf, data_pos, count, template[0], order, num_octets
+            )
+            values = _unscale(encoded, template[0])
+        elif template_num == 4:
+            template = np.frombuffer(self.buf, _DTYPE_TEMPLATE_5_4, count=1, offset=pos)
+            precision = int(template[0]["precision"])
+            if precision not in _IEEE_DTYPES:
+                raise RuntimeError(f"unsupported precision: {precision}")
+            dtype = _IEEE_DTYPES[precision]
+            values = np.frombuffer(self.buf, dtype, count=count, offset=data_pos)
+        elif template_num == 41:
+            template = np.frombuffer(self.buf, _DTYPE_TEMPLATE_5_0, count=1, offset=pos)
+            if template[0]["bits_per_value"] == 0:
+                encoded = np.zeros(count, dtype=np.uint8)  # no PNG stream
+            else:
+                encoded = _decode_png(
+                    self._section(self.sect7)[SECT_HEADER_DTYPE.itemsize :]
+                )
+            if len(encoded) < count:
+                raise RuntimeError("PNG image smaller than the number of values")
+            values = _unscale(encoded[:count], template[0])
+        else:
+            raise RuntimeError(
+                f"unsupported data representation template: 5.{template_num}"
+            )
+
+        shape = self.shape
+        if self.sect6 is None:
+            return values.reshape(shape)
+        mask = ~self._bitmap(self.sect6, int(np.prod(shape)))
+        data = np.zeros(len(mask), dtype=values.dtype)
+        data[~mask] = values
+        return np.ma.MaskedArray(data.reshape(shape), mask=mask.reshape(shape))
+
+    def _bitmap(self, sect6: int, num_points: int) -> np.ndarray:
+        pos = sect6 + SECT_HEADER_DTYPE.itemsize + 1
+        octets = self.buf[pos : pos + (num_points + 7) // 8]
+        return np.unpackbits(octets, count=num_points).astype(np.bool_)
+
+    def _section(self, pos: int) -> np.ndarray:
+        header = np.frombuffer(self.buf, SECT_HEADER_DTYPE, count=1, offset=pos)[0]
+        return self.buf[pos : pos + int(header["sect_len"])]
+
+
+def _unpack_simple(
+    buf: np.ndarray, pos: int, count: int, template: np.void
+) -> np.ndarray:
+    nbit = int(template["bits_per_value"])
+    if nbit in _BYTE_ALIGNED_DTYPES:
+        encoded = np.frombuffer(
+            buf, _BYTE_ALIGNED_DTYPES[nbit], count=count, offset=pos
+        )
+    else:
+        encoded = unpack_bits(buf[pos : pos + (count * nbit + 7) // 8], nbit, count)
+    return _unscale(encoded, template)
+
+
+def _unscale(encoded: np.ndarray, template: np.void) -> np.ndarray:
+    """Returns values from integers `encoded` with the scaling of simple packing, which
+    is shared by templates 5.0, 5.2, 5.3, and 5.41."""
+    r = float(template["reference_value"])
+    e = from_grib_signed(int(template["binary_scale_factor"]), 2)
+    d = from_grib_signed(int(template["decimal_scale_factor"]), 2)
+    return (encoded * 2.0**e + r) / 10.0**d
+
+
+def _unpack_complex(
+    buf: np.ndarray,
+    pos: int,
+    count: int,
+    template: np.void,
+    order: int,
+    num_octets: int,
+) -> np.ndarray:
+    """Unpacks integers packed with complex packing, and spatial differencing of
+    `order` with extra descriptors of `num_octets` octets if `order` is not 0."""
+    if int(template["missing_value_management_used"]) != 0:
+        raise RuntimeError("missing values in complex packing are not supported")
+    descriptors = []
+    for _ in range(order + 1 if order > 0 else 0):
+        num = int.from_bytes(buf[pos : pos + num_octets].tobytes(), "big")
+        descriptors.append(from_grib_signed(num, num_octets))
+        pos += num_octets
+
+    num_of_groups = int(template["number_of_groups_of_data_values"])
+    refs, pos = _unpack_group_descriptors(
+        buf, pos, int(template["bits_per_group_reference_value"]), num_of_groups
+    )
+    widths, pos = _unpack_group_descriptors(
+        buf, pos, int(template["bits_for_group_widths"]), num_of_groups
+    )
+    widths += int(template["reference_for_group_widths"])
+    lengths, pos = _unpack_group_descriptors(
+        buf, pos, int(template["bits_for_scaled_group_lengths"]), num_of_groups
+    )
+    lengths *= int(template["length_increment_for_the_group_lengths"])
+    lengths += int(template["reference_for_group_lengths"])
+    if num_of_groups > 0:
+        lengths[-1] = int(template["true_length_of_last_group"])
+    if int(lengths.sum()) != count:
+        raise RuntimeError("lengths of groups do not match the number of values")
+
+    values = unpack_bits(buf[pos:], np.repeat(widths, lengths), count)
+    values = values.astype(np.int64) + np.repeat(refs, lengths)
+    if order > 0:
+        values = _undo_spatial_differencing(values, descriptors)
+    return values
+
+
+def _unpack_group_descriptors(
+    buf: np.ndarray, pos: int, nbit: int, count: int
+) -> tuple[np.ndarray, int]:
+    """Unpacks group descriptors, which are padded to the octet boundary, and
+    returns them with the position after them."""
+    end = pos + (count * nbit + 7) // 8
+    return unpack_bits(buf[pos:end], nbit, count).astype(np.int64), end
+
+
+def _undo_spatial_differencing(diffs: np.ndarray, descriptors: list[int]) -> np.ndarray:
+    """Returns integers from their spatial differences `diffs` of the order of the
+    number of first values in `descriptors`, which are followed by the minimum of the
+    differences."""
+    *first_values, min_diff = descriptors
+    order = len(first_values)
+    if len(diffs) <= order:
+        return np.array(first_values[: len(diffs)], dtype=np.int64)
+    values = diffs[order:] + min_diff
+    firsts = np.array(first_values, dtype=np.int64)
+    # summed up once for each order, starting from the differences of the first values
+    for k in range(order - 1, -1, -1):
+        start = np.diff(firsts, n=k)[:1]
+        values = np.concatenate([start, values]).cumsum()
+    return values
+
+
+def _decode_png(octets: np.ndarray) -> np.ndarray:
+    """Returns integers of the pixels of the PNG stream `octets` in row-major order."""
+    stream = octets.tobytes()
+    if not stream.startswith(_PNG_SIGNATURE):
+        raise RuntimeError("PNG stream not found")
+    header = None
+    compressed = []
+    pos = len(_PNG_SIGNATURE)
+    while pos + 8 <= len(stream):
+        length, chunk_type = struct.unpack_from(">I4s", stream, pos)
+        data = stream[pos + 8 : pos + 8 + length]
+        pos += 12 + length  # with the CRC
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", data)
+        elif chunk_type == b"IDAT":
+            compressed.append(data)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        raise RuntimeError("PNG header not found")
+    width, height, bit_depth, color_type, _, _, interlace = header
+    if color_type not in _PNG_CHANNELS or interlace != 0:
+        raise RuntimeError(f"unsupported PNG color type {color_type} or interlace")
+
+    depth = bit_depth * _PNG_CHANNELS[color_type]
+    row_len = (width * depth + 7) // 8
+    scanlines = np.frombuffer(zlib.decompress(b"".join(compressed)), dtype=np.uint8)
+    rows = _unfilter_png(scanlines.reshape(height, row_len + 1), max(depth // 8, 1))
+    if depth < 8:
+        return np.concatenate(
+            [np.empty(0, dtype=np.uint8)]
+            + [unpack_bits(row, depth, width) for row in rows]
+        )
+    size = _container_size(depth)
+    padded = np.zeros((height * width, size), dtype=np.uint8)
+    padded[:, size - depth // 8 :] = rows.reshape(height * width, -1)
+    return padded.view(f">u{size}")[:, 0]
+
+
+def _unfilter_png(scanlines: np.ndarray, bytes_per_pixel: int) -> np.ndarray:
+    """Reverses filters of PNG scanlines, each of which starts with the filter type."""
+    filter_types = scanlines[:, 0]
+    filtered = scanlines[:, 1:]
+    if not filter_types.any():
+        return filtered
+    if filter_types.max() > 4:
+        raise RuntimeError(f"unsupported PNG filter type: {filter_types.max()}")
+    if filter_types.max() > 2:
+        return _unfilter_png_diagonally(filtered, filter_types, bytes_per_pixel)
+
+    rows = np.empty_like(filtered)
+    prev = np.zeros(filtered.shape[1], dtype=np.uint8)
+    for row, filter_type, line in zip(rows, filter_types, filtered):
+        # arithmetic on uint8 is done modulo 256 as required
+        if filter_type == 0:
+            row[...] = line
+        elif filter_type == 1:
+            pixels = line.reshape(-1, bytes_per_pixel)
+            row[...] = pixels.cumsum(axis=0, dtype=np.uint8).ravel()
+        else:
+            np.add(line, prev, out=row)
+        prev = row
+    return rows
+
+
+def _unfilter_png_diagonally(
+    filtered: np.ndarray, filter_types: np.ndarray, bytes_per_pixel: int
+) -> np.ndarray:
+    """Reverses any filters including "average" and "paeth", which predict a pixel
+    from the ones on the left, above, and upper left of it.
+
+    Pixels on each anti-diagonal depend only on those on the previous two, so that
+    they are reversed at once, diagonal by diagonal."""
+    height = len(filtered)
+    lines = filtered.reshape(height, -1, bytes_per_pixel).astype(np.int16)
+    width = lines.shape[1]
+    # with zeros on the left of and above the image
+    pixels = np.zeros((height + 1, width + 1, bytes_per_pixel), dtype=np.int16)
+    for diagonal in range(height + width - 1):
+        i = np.arange(max(diagonal - width + 1, 0), min(diagonal, height - 1) + 1)
+        j = diagonal - i
+        left, up, upper_left = pixels[i + 1, j], pixels[i, j + 1], pixels[i, j]
+        estimate = left + up - upper_left
+        dist_left = np.abs(estimate - left)
+        dist_up = np.abs(estimate - up)
+        dist_upper_left = np.abs(estimate - upper_left)
+        paeth = np.where(
+            (dist_left <= dist_up) & (dist_left <= dist_upper_left),
+            left,
+            np.where(dist_up <= dist_upper_left, up, upper_left),
+        )
+        types = filter_types[i, np.newaxis]
+        predictors = np.choose(
+            types, [np.zeros_like(left), left, up, (left + up) // 2, paeth]
+        )
+        pixels[i + 1, j + 1] = (lines[i, j] + predictors) & 0xFF
+    return pixels[1:, 1:].astype(np.uint8).reshape(height, -1)
+
+
+class Grib2Reader:
+    """A reader of GRIB2 messages in the file at `path`, which is memory-mapped.
+
+    Fields are listed by scanning section headers when the reader is created, and
+    their data are decoded only when requested. Arrays returned by fields may refer
+    to the mapped file, which stays mapped as long as any of them is alive even after
+    the reader is closed."""
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                self._buf = np.empty(0, dtype=np.uint8)
+            else:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._buf = np.frombuffer(mapped, dtype=np.uint8)
+        self.fields = _scan(self._buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_val, _exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __getitem__(self, i: int) -> Grib2Field:
+        return self.fields[i]
+
+    def __iter__(self) -> Iterator[Grib2Field]:
+        return iter(self.fields)
+
+    def close(self):
+        self._buf = np.empty(0, dtype=np.uint8)
+        self.fields = []
+
+
+def _scan(buf: np.ndarray) -> list[Grib2Field]:
+    fields = []
+    pos = 0
+    while pos < len(buf):
+        if len(buf) - pos < DTYPE_SECTION_0.itemsize:
+            raise RuntimeError(f"truncated message at {pos}")
+        sect0 = np.frombuffer(buf, DTYPE_SECTION_0, count=1, offset=pos)[0]
+        if sect0["identifier"] != _GRIB or sect0["edition_number"] != 2:
+            raise RuntimeError(f"GRIB2 message not found at {pos}")
+        length = int(sect0["total_length"])
+        if pos + length > len(buf):
+            raise RuntimeError(f"truncated message at {pos}")
+        fields.extend(_scan_message(buf, pos, length, int(sect0["discipline"])))
+        pos += length
+    return fields
+
+
+def _scan_message(
+    buf: np.ndarray, offset: int, length: int, discipline: int
+) -> list[Grib2Field]:
+    fields = []
+    end = offset + length - len(_END_SECTION)
+    if buf[end : end + len(_END_SECTION)].tobytes() != _END_SECTION:
+        raise RuntimeError(f"end of message not found at {end}")
+
+    sects: dict[int, int] = {}
+    bitmap: Optional[int] = None  # the bitmap section in effect
+    last_bitmap = None
+    pos = offset + DTYPE_SECTION_0.itemsize
+    while pos < end:
+        header = np.frombuffer(buf, SECT_HEADER_DTYPE, count=1, offset=pos)[0]
+        sect_len = int(header["sect_len"])
+        num = int(header["sect_num"])
+        if sect_len < SECT_HEADER_DTYPE.itemsize or pos + sect_len > end:
+            raise RuntimeError(f"wrong length of Section {num} at {pos}")
+        sects[num] = pos
+        if num == 6:
+            bitmap = _bitmap_in_effect(buf, pos, last_bitmap)
+            if buf[pos + SECT_HEADER_DTYPE.itemsize] == 0:
+                last_bitmap = pos
+        elif num == 7:
+            if any(i not in sects for i in (1, 3, 4, 5, 6)):
+                raise RuntimeError(f"missing sections before Section 7 at {pos}")
+            sect1, sect3, sect4, sect5 = (sects[i] for i in (1, 3, 4, 5))
+            fields.append(
+                Grib2Field(
+                    buf,
+                    offset,
+                    length,
+                    discipline,
+                    sect1,
+                    sect3,
+                    sect4,
+                    sect5,
+                    bitmap,
+                    pos,
+                )
+            )
+        pos += sect_len
+    return fields
+
+
+def _bitmap_in_effect(buf: np.ndarray, pos: int, last_bitmap: Optional[int]):
+    indicator = buf[pos + SECT_HEADER_DTYPE.itemsize]
+    if indicator == 0:
+        return pos
+    elif indicator == 0xFF:
+        return None
+    elif indicator == 254 and last_bitmap is not None:
+        return last_bitmap
+    raise RuntimeError(f"unsupported bitmap indicator {indicator} at {pos}")
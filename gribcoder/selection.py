@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from .encoders import (
+    BaseEncoder,
+    ComplexPackingEncoder,
+    PngPackingEncoder,
+    SimplePackingEncoder,
+)
+
+DEFAULT_SAMPLE_SIZE = 1 << 16
+
+_NUM_SAMPLE_BANDS = 8
+
+
+class _Candidate(NamedTuple):
+    cls: type
+    kwargs: dict
+
+
+# in the order of trials; simple packing is always a candidate without a trial
+_CANDIDATES = (
+    _Candidate(ComplexPackingEncoder, {"spatial_differencing": 2}),
+    _Candidate(ComplexPackingEncoder, {"spatial_differencing": 1}),
+    _Candidate(PngPackingEncoder, {"filter_type": "sub"}),
+    _Candidate(PngPackingEncoder, {"filter_type": "none"}),
+)
+
+
+def select_encoder(
+    data: np.ndarray,
+    scaling: str = "simple-linear",
+    missing: Optional[float] = None,
+    time_budget: Optional[float] = None,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    **kwargs,
+) -> BaseEncoder:
+    """Returns the encoder of `data` with the smallest projected Section 7 among
+    simple packing, complex packing with spatial differencing, and PNG packing.
+
+    Parameters of the scaling are determined as in
+    `SimplePackingEncoder.auto_parametrized_from` with `scaling`, `missing`, and
+    `kwargs`, and shared by all methods, so that decoded values are the same for any
+    of them. Constant fields are encoded with no bits without trials. Otherwise, the
+    other methods are tried on a subsample of about `sample_size` values made of
+    bands of consecutive rows, which keeps the spatial patterns the methods rely on,
+    and their sizes and CPU times are projected to the whole field. If `time_budget`
+    is given, methods projected to take more CPU seconds than it to encode the field
+    are not chosen. CPU times are those of the calling thread, so that encoders of
+    other fields running in parallel as in `write_fields` are not counted.
+    Run-length packing is not a candidate, as it needs level values rather than
+    physical ones."""
+    base = SimplePackingEncoder.auto_parametrized_from(
+        data, scaling, missing=missing, **kwargs
+    )
+    count = base.statistics().num_of_values
+    if base.n == 0 or count == 0:
+        return base
+    best_size = count * base.n / 8  # of simple packing
+    best: Optional[_Candidate] = None
+    best_encoder: Optional[SimplePackingEncoder] = None
+
+    sample = _sample_bands(data, sample_size)
+    for candidate in _CANDIDATES:
+        encoder = _create(candidate, base, missing).input(sample)
+        start = time.thread_time()
+        try:
+            encoded, _ = encoder.encode()
+        except RuntimeError:
+            continue  # not supported for the parameters, e.g. n > 32 in PNG packing
+        seconds = time.thread_time() - start
+        ratio = count / max(encoder.statistics().num_of_values, 1)
+        if time_budget is not None and seconds * ratio > time_budget:
+            continue
+        if encoded.nbytes * ratio < best_size:
+            best_size = encoded.nbytes * ratio
+            best, best_encoder = candidate, encoder
+
+    if best is None or best_encoder is None:
+        return base
+    if sample is data:
+        return best_encoder  # the trial is the encoding of the whole field
+    encoder = _create(best, base, missing).input(data)
+    encoder._stats = base._stats
+    encoder._valid_values = base._valid_values
+    encoder._bitmap = base._bitmap
+    return encoder
+
+
+def _create(
+    candidate: _Candidate, base: SimplePackingEncoder, missing: Optional[float]
+) -> SimplePackingEncoder:
+    encoder = candidate.cls(base.r, base.e, base.d, base.n, **candidate.kwargs)
+    if missing is not None:
+        encoder.with_missing_value(missing)
+    return encoder
+
+
+def _sample_bands(data: np.ndarray, sample_size: int) -> np.ndarray:
+    """Returns bands of consecutive elements along the first axis spread evenly over
+    `data` with about `sample_size` values in total, or `data` itself if it is not
+    larger than that."""
+    if data.size <= sample_size or len(data) < 2:
+        return data
+    unit_size = data.size // len(data)
+    num_units = max(sample_size // unit_size, 1)
+    num_bands = min(_NUM_SAMPLE_BANDS, num_units)
+    band_len = num_units // num_bands
+    starts = np.linspace(0, len(data) - band_len, num_bands).astype(int)
+    indices = (starts[:, None] + np.arange(band_len)).ravel()
+    return data[indices]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import dataclasses
+import io
+from typing import BinaryIO, Optional
+
+import numpy as np
+
+from .context import Grib2MessageWriter
+from .encoders import BaseEncoder
+from .grid import BaseGrid
+from .instrument import Instrumentation
+from .inventory import InventoryWriter
+from .message import DTYPE_SECTION_0, Identification, Indicator
+from .product import (
+    _DTYPE_SECTION_4_TEMPLATE_4_0,
+    BaseProductDefinition,
+    FixedSurface,
+    ProductDefinitionWithTemplate4_0,
+    _create_fixed_surfaces,
+)
+from .utils import grib_signed, write
+
+
+@dataclasses.dataclass
+class MessageTemplate:
+    """A template of messages sharing Sections 0, 1, 3, and 4.
+
+    The sections are serialized once when the template is created, so that later
+    changes to `ind`, `ident`, `grid`, and `product` are not reflected. For each
+    message, only the total length and, if specified, the forecast time and fixed
+    surfaces in Section 4 are patched. Patching Section 4 is supported only for
+    `ProductDefinitionWithTemplate4_0`."""
+
+    ind: Indicator
+    ident: Identification
+    grid: BaseGrid
+    product: BaseProductDefinition
+
+    def __post_init__(self):
+        self._sect0 = _serialize(self.ind).view(DTYPE_SECTION_0).copy()
+        self._sect1 = _PreSerializedSection(_serialize(self.ident))
+        self._sect3 = _PreSerializedSection(_serialize(self.grid))
+        self._sect4 = _serialize(self.product)
+        self._sect4_patchable = (
+            isinstance(self.product, ProductDefinitionWithTemplate4_0)
+            and self._sect4.nbytes == _DTYPE_SECTION_4_TEMPLATE_4_0.itemsize
+        )
+
+    def writer(
+        self,
+        f: BinaryIO,
+        gather: bool = False,
+        index: Optional[InventoryWriter] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ) -> Grib2MessageWriter:
+        """Returns a writer of a message to `f` which starts with Sections 0 and 1 of
+        the template. `gather`, `index`, and `instrumentation` are passed to
+        `Grib2MessageWriter`."""
+        ind = _PreSerializedIndicator(self._sect0.copy())
+        return Grib2MessageWriter(f, ind, self._sect1, gather, index, instrumentation)
+
+    def grid_section(self) -> BaseGrid:
+        """Returns Section 3 of the template."""
+        return self._sect3
+
+    def product_section(
+        self,
+        forecast_time: Optional[int] = None,
+        surfaces: Optional[
+            tuple[Optional[FixedSurface], Optional[FixedSurface]]
+        ] = None,
+    ) -> BaseProductDefinition:
+        """Returns Section 4 of the template with the forecast time and fixed surfaces
+        replaced if specified."""
+        if forecast_time is None and surfaces is None:
+            return _PreSerializedSection(self._sect4)
+        if not self._sect4_patchable:
+            raise RuntimeError("only Section 4 with template 4.0 can be patched")
+
+        buf = self._sect4.copy()
+        sect = buf.view(_DTYPE_SECTION_4_TEMPLATE_4_0)
+        if forecast_time is not None:
+            sect["forecast_time"]["forecast_time"] = grib_signed(forecast_time, 4)
+        if surfaces is not None:
+            values = _create_fixed_surfaces(surfaces)
+            if len(values) != 2:
+                raise RuntimeError("wrong length")
+            sect["horizontal"] = values
+        return _PreSerializedSection(buf)
+
+    def write(
+        self,
+        f: BinaryIO,
+        encoder: BaseEncoder,
+        forecast_time: Optional[int] = None,
+        surfaces: Optional[
+            tuple[Optional[FixedSurface], Optional[FixedSurface]]
+        ] = None,
+    ) -> int:
+        """Writes a message with one field encoded by `encoder` to `f` and returns the
+        length of the message."""
+        with self.writer(f) as grib2:
+            grib2._write_sect3(self._sect3)
+            grib2._write_sect4(self.product_section(forecast_time, surfaces))
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+        return grib2.ind.total_length
+
+
+class _PreSerializedSection(BaseGrid, BaseProductDefinition):
+    def __init__(self, buf: np.ndarray):
+        self._buf = buf
+
+    def write(self, f: BinaryIO) -> int:
+        return write(f, self._buf)
+
+    def sect_len(self) -> int:
+        return self._buf.nbytes
+
+
+class _PreSerializedIndicator(Indicator):
+    def __init__(self, buf: np.ndarray):
+        super().__init__(int(buf[0]["discipline"]))
+        self._buf = buf
+
+    def write(self, f: BinaryIO) -> int:
+        self._buf[0]["total_length"] = self.total_length
+        return write(f, self._buf)
+
+
+def _serialize(section) -> np.ndarray:
+    with io.BytesIO() as f:
+        section.write(f)
+        return np.frombuffer(f.getvalue(), dtype=np.uint8)
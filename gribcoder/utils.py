@@ -1,4 +1,8 @@
-from typing import BinaryIO
+from __future__ import annotations
+
+import os
+from math import ceil
+from typing import BinaryIO, Iterator
 
 import numpy as np
 
@@ -20,6 +24,12 @@ def grib_signed(num: int, byte_length: int) -> int:
     return num
 
 
+def from_grib_signed(num: int, byte_length: int) -> int:
+    """Inverse of `grib_signed`."""
+    sign_bit = 1 << (byte_length * 8 - 1)
+    return -(num & ~sign_bit) if num & sign_bit else num
+
+
 def set_bit_one(value: int, n: int) -> int:
     """Sets `n`th bit of `value` to 1."""
     return value | (1 << n)
@@ -28,3 +38,288 @@ def set_bit_one(value: int, n: int) -> int:
 def write(f: BinaryIO, array: np.ndarray) -> int:
     f.write(array)
     return array.nbytes
+
+
+_PACKING_BLOCK_SIZE = 1 << 16  # must be a multiple of 8
+
+
+class BitPacker:
+    """Packs unsigned integers into a big-endian bit sequence.
+
+    Values are packed block by block so that the size of temporary arrays does not
+    depend on the length of the input. Bits which do not fill a whole octet are
+    carried over to the next call of `pack` and written out by `flush`."""
+
+    def __init__(self):
+        self._carry = np.empty(0, dtype=np.uint8)
+
+    def pack(self, values: np.ndarray, nbit: int | np.ndarray) -> Iterator[np.ndarray]:
+        """Yields octet arrays of `values` packed with `nbit` bits for each element.
+
+        `nbit` is either a number of bits common to all elements or an array of
+        numbers of bits for each element."""
+        values = np.asarray(values).ravel()
+        for start in range(0, len(values), _PACKING_BLOCK_SIZE):
+            end = start + _PACKING_BLOCK_SIZE
+            widths = nbit[start:end] if isinstance(nbit, np.ndarray) else nbit
+            octets = self._pack_block(values[start:end], widths)
+            if len(octets) > 0:
+                yield octets
+
+    def flush(self) -> np.ndarray:
+        """Returns the remaining bits padded with zeros to the octet boundary."""
+        octets = np.packbits(self._carry)
+        self._carry = np.empty(0, dtype=np.uint8)
+        return octets
+
+    def _pack_block(self, values: np.ndarray, nbit: int | np.ndarray) -> np.ndarray:
+        max_nbit = int(np.max(nbit, initial=0))
+        if max_nbit == 0:
+            return np.empty(0, dtype=np.uint8)
+        size = _container_size(max_nbit)
+        octets = values.astype(f">u{size}").view(np.uint8).reshape(-1, size)
+        if isinstance(nbit, np.ndarray):
+            bits = np.unpackbits(octets, axis=1)
+            msb = size * 8 - nbit
+            bits = bits[np.arange(size * 8) >= msb[:, np.newaxis]]
+        elif nbit % 8 == 0 and len(self._carry) == 0:
+            return octets[:, size - nbit // 8 :].ravel()
+        else:
+            bits = np.unpackbits(octets, axis=1)[:, size * 8 - nbit :].ravel()
+        if len(self._carry) > 0:
+            bits = np.concatenate([self._carry, bits])
+        num_complete = len(bits) // 8 * 8
+        self._carry = bits[num_complete:].copy()
+        return np.packbits(bits[:num_complete])
+
+
+def pack_bits(values: np.ndarray, nbit: int | np.ndarray) -> np.ndarray:
+    """Packs unsigned integers in `values` into octets with `nbit` bits occupied for
+    each element.
+
+    The output is padded with zeros to the octet boundary, so that its length is
+    `ceil(sum of bits / 8)`."""
+    packer = BitPacker()
+    return np.concatenate(
+        [np.empty(0, dtype=np.uint8), *packer.pack(values, nbit), packer.flush()]
+    )
+
+
+def unpack_bits(octets: np.ndarray, nbit: int | np.ndarray, count: int) -> np.ndarray:
+    """Unpacks `count` unsigned integers of `nbit` bits from `octets`, the inverse of
+    `pack_bits`.
+
+    `nbit` is either a number of bits common to all elements or an array of numbers
+    of bits for each element. Values are unpacked block by block so that temporary
+    arrays of bits do not depend on the length of the input."""
+    if isinstance(nbit, np.ndarray):
+        return _unpack_bits_of_widths(octets, nbit, count)
+    if nbit == 0:
+        return np.zeros(count, dtype=np.uint8)
+    size = _container_size(nbit)
+    values = np.empty(count, dtype=f">u{size}")
+    padded = np.zeros((min(count, _PACKING_BLOCK_SIZE), size * 8), dtype=np.uint8)
+    for start in range(0, count, _PACKING_BLOCK_SIZE):
+        num = min(_PACKING_BLOCK_SIZE, count - start)
+        # blocks start at octet boundaries since the block size is a multiple of 8
+        first = start * nbit // 8
+        bits = np.unpackbits(octets[first : first + ceil(num * nbit / 8)])
+        padded[:num, size * 8 - nbit :] = bits[: num * nbit].reshape(num, nbit)
+        values[start : start + num] = np.packbits(padded[:num], axis=1).view(
+            values.dtype
+        )[:, 0]
+    return values
+
+
+def _unpack_bits_of_widths(octets: np.ndarray, nbit: np.ndarray, count: int):
+    size = _container_size(int(np.max(nbit, initial=0)))
+    values = np.empty(count, dtype=f">u{size}")
+    ends = np.cumsum(nbit[:count], dtype=np.int64)
+    for start in range(0, count, _PACKING_BLOCK_SIZE):
+        widths = nbit[start : start + _PACKING_BLOCK_SIZE]
+        num = len(widths)
+        # blocks may start in the middle of an octet
+        first = int(ends[start - 1]) if start > 0 else 0
+        last = int(ends[start + num - 1])
+        bits = np.unpackbits(octets[first // 8 : ceil(last / 8)])
+        bits = bits[first % 8 : first % 8 + last - first]
+        padded = np.zeros((num, size * 8), dtype=np.uint8)
+        padded[np.arange(size * 8) >= size * 8 - widths[:, np.newaxis]] = bits
+        packed = np.packbits(padded, axis=1).view(values.dtype)
+        values[start : start + num] = packed[:, 0]
+    return values
+
+
+def _container_size(nbit: int) -> int:
+    if nbit > 32:
+        return 8
+    elif nbit > 16:
+        return 4
+    elif nbit > 8:
+        return 2
+    else:
+        return 1
+
+
+class BufferWriter:
+    """A file-like object writing into a writable buffer such as a memory-mapped
+    file.
+
+    Besides `write`, `reserve` gives direct access to the region to be written next,
+    so that encoders can produce values in place instead of writing them out from
+    separately materialized arrays."""
+
+    def __init__(self, buf, pos: int = 0):
+        self._buf = np.frombuffer(buf, dtype=np.uint8)
+        self._pos = pos
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence != 0:
+            raise RuntimeError("only absolute positions are supported")
+        self._pos = pos
+        return pos
+
+    def write(self, b) -> int:
+        octets = np.frombuffer(b, dtype=np.uint8)
+        self.reserve(len(octets))[:] = octets
+        return len(octets)
+
+    def reserve(self, nbytes: int) -> np.ndarray:
+        """Returns a writable octet array of the next `nbytes` octets, which are
+        regarded as written."""
+        end = self._pos + nbytes
+        if end > len(self._buf):
+            raise RuntimeError("buffer is too small")
+        region = self._buf[self._pos : end]
+        self._pos = end
+        return region
+
+
+_COALESCE_LIMIT = 1 << 16
+
+
+class GatherWriter:
+    """A file-like object collecting buffers written to it without copying them, so
+    that they are written out to another file at once with `write_to`.
+
+    Seeking back is supported only to overwrite buffers with ones of the same sizes,
+    as done when the total length in Section 0 is updated. Buffers must not be
+    modified after they are written."""
+
+    def __init__(self):
+        self._chunks: list = []
+        self._size = 0
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence != 0:
+            raise RuntimeError("only absolute positions are supported")
+        self._pos = pos
+        return pos
+
+    def write(self, b) -> int:
+        nbytes = _nbytes(b)
+        if self._pos == self._size:
+            self._chunks.append(b)
+            self._size += nbytes
+        else:
+            self._overwrite(b, nbytes)
+        self._pos += nbytes
+        return nbytes
+
+    def _overwrite(self, b, nbytes: int):
+        offset = 0
+        for i, chunk in enumerate(self._chunks):
+            if offset == self._pos and _nbytes(chunk) == nbytes:
+                self._chunks[i] = b
+                return
+            offset += _nbytes(chunk)
+            if offset > self._pos:
+                break
+        raise RuntimeError("only whole buffers can be overwritten")
+
+    def write_to(self, f: BinaryIO) -> int:
+        """Writes the collected buffers to `f` and returns the number of octets.
+
+        If `f` has a file descriptor, they are written with `os.writev`. Otherwise,
+        small buffers are joined so that `f.write` is called only for each large
+        buffer and each run of small buffers between them."""
+        fd = _fileno_of(f)
+        if fd is not None and hasattr(os, "writev"):
+            f.flush()
+            if f.seekable():
+                f.seek(f.tell())  # drops read-ahead data and syncs the file offset
+            _writev_all(fd, self._chunks)
+        else:
+            for chunk in _coalesce(self._chunks):
+                f.write(chunk)
+        return self._size
+
+
+def _fileno_of(f: BinaryIO) -> int | None:
+    try:
+        return f.fileno()
+    except (AttributeError, OSError):  # including io.UnsupportedOperation
+        return None
+
+
+def _nbytes(b) -> int:
+    if isinstance(b, np.ndarray):
+        return b.nbytes
+    with memoryview(b) as view:
+        return view.nbytes
+
+
+def _writev_all(fd: int, chunks: list):
+    pending = [chunk for chunk in chunks if _nbytes(chunk) > 0]
+    i = 0
+    while i < len(pending):
+        written = os.writev(fd, pending[i : i + _IOV_MAX])
+        while i < len(pending) and written >= _nbytes(pending[i]):
+            written -= _nbytes(pending[i])
+            i += 1
+        if written > 0:
+            pending[i] = memoryview(pending[i]).cast("B")[written:]
+
+
+def _get_iov_max() -> int:
+    try:
+        iov_max = os.sysconf("SC_IOV_MAX")
+    except (AttributeError, ValueError, OSError):
+        iov_max = -1
+    return iov_max if iov_max > 0 else 16
+
+
+_IOV_MAX = _get_iov_max()
+
+
+def _coalesce(chunks: list) -> Iterator:
+    small: list = []
+    for chunk in chunks:
+        if _nbytes(chunk) < _COALESCE_LIMIT:
+            small.append(chunk)
+            continue
+        if small:
+            yield b"".join(small)
+            small = []
+        yield chunk
+    if small:
+        yield b"".join(small)
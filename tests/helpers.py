@@ -1,6 +1,85 @@
+import io
 from contextlib import contextmanager
 
+import numpy as np
+
+from gribcoder import (
+    DTYPE_SECTION_4_FORECAST_TIME,
+    DTYPE_SECTION_4_GENERATING_PROCESS,
+    DTYPE_SHAPE_OF_THE_EARTH,
+    NULL_FIXED_SURFACE,
+    Grib2MessageWriter,
+    IeeeFloatEncoder,
+    LatitudeLongitudeGrid,
+    ProductDefinitionWithTemplate4_0,
+    ProductParameter,
+)
+
 
 @contextmanager
 def does_not_raise():
     yield
+
+
+def create_grid():
+    lat = np.tile(np.linspace(40, 30, 3), (4, 1)).T
+    lon = np.tile(np.linspace(130, 140, 4), (3, 1))
+    return LatitudeLongitudeGrid.from_ndarrays(lat, lon).shape_of_the_earth(
+        np.array(
+            [(6, 0xFF, 0xFFFFFFFF, 0xFF, 0xFFFFFFFF, 0xFF, 0xFFFFFFFF)],
+            dtype=DTYPE_SHAPE_OF_THE_EARTH,
+        )
+    )
+
+
+def create_product(forecast_time, surface):
+    return (
+        ProductDefinitionWithTemplate4_0(0)
+        .parameter(ProductParameter(0, 0))
+        .generating_process(
+            np.array([(0, 0xFF, 0xFF)], dtype=DTYPE_SECTION_4_GENERATING_PROCESS)
+        )
+        .forecast_time(
+            np.array([(0, 0, 1, forecast_time)], dtype=DTYPE_SECTION_4_FORECAST_TIME)
+        )
+        .horizontal((surface, NULL_FIXED_SURFACE))
+    )
+
+
+def create_ieee_float_encoder(data):
+    return IeeeFloatEncoder().input(data)
+
+
+def write_sections(encoder, sect_nums=(5, 6, 7)):
+    """Returns octets of the sections of `sect_nums` written by `encoder`."""
+    writers = {5: encoder.write_sect5, 6: encoder.write_sect6, 7: encoder.write_sect7}
+    with io.BytesIO() as f:
+        for num in sect_nums:
+            writers[num](f)
+        return f.getvalue()
+
+
+def write_sequentially(f, messages):
+    """Writes `messages` of `gribcoder.Message` encoding fields one by one."""
+    for message in messages:
+        with Grib2MessageWriter(f, message.ind, message.ident) as grib2:
+            for field in message.fields:
+                encoder = field.encoder(field.data)
+                if field.grid is not None:
+                    grib2._write_sect3(field.grid)
+                grib2._write_sect4(field.product)
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+
+
+class NonSeekableStream(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
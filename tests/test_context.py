@@ -1,4 +1,7 @@
+from __future__ import annotations
+
 import io
+import os
 from datetime import datetime
 from typing import BinaryIO
 
@@ -10,12 +13,16 @@ from gribcoder import (
     BaseEncoder,
     BaseGrid,
     BaseProductDefinition,
+    FixedSurface,
     Grib2MessageWriter,
+    Grib2Reader,
     Identification,
+    IeeeFloatEncoder,
     Indicator,
     SimplePackingEncoder,
 )
 from gribcoder.message import DTYPE_SECTION_0
+from gribcoder.utils import SECT_HEADER_DTYPE
 
 
 def fake_write_sect(grib2, sect_num, grid, product, encoder):
@@ -189,3 +196,140 @@ def test_error_handling_in_writer_context(encoder_func, expectation):
                 grib2._write_sect5(encoder)
                 grib2._write_sect6(encoder)
                 grib2._write_sect7(encoder)
+
+
+def _read_sect6s(output: bytes) -> list[bytes]:
+    sects = []
+    pos = DTYPE_SECTION_0.itemsize
+    while output[pos : pos + 4] != b"7777":
+        header = np.frombuffer(output, dtype=SECT_HEADER_DTYPE, count=1, offset=pos)
+        sect_len, sect_no = header[0]
+        if sect_no == 6:
+            sects.append(output[pos : pos + sect_len])
+        pos += sect_len
+    return sects
+
+
+@pytest.mark.parametrize(
+    "masks,expected_indicators",
+    [
+        ([[1, 0, 0, 1], [1, 0, 0, 1], [1, 0, 0, 1]], [0, 254, 254]),
+        ([[1, 0, 0, 1], [0, 0, 0, 1], [0, 0, 0, 1]], [0, 0, 254]),
+        ([[1, 0, 0, 1], None, [1, 0, 0, 1]], [0, 0xFF, 0]),
+    ],
+)
+def test_previously_defined_bitmap_reuse(masks, expected_indicators):
+    with io.BytesIO() as fw:
+        ind = Indicator(0)
+        ident = Identification(0, 0, 0, 0, 0, datetime.now(), 0, 0)
+        with Grib2MessageWriter(fw, ind, ident) as grib2:
+            grib2._write_sect3(EmptyGrid())
+            for mask in masks:
+                data = np.arange(4.0)
+                if mask is not None:
+                    data = np.ma.MaskedArray(data, mask=mask)
+                encoder = SimplePackingEncoder(0.0, 0, 0, 4).input(data)
+                grib2._write_sect4(EmptyProductDefinition())
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+
+        output = fw.getvalue()
+
+    sects = _read_sect6s(output)
+    assert [sect[5] for sect in sects] == expected_indicators
+    for sect, indicator in zip(sects, expected_indicators):
+        assert len(sect) == (7 if indicator == 0 else 6)
+
+
+@pytest.mark.parametrize(
+    "encoder",
+    [SimplePackingEncoder(0.0, 0, 0, 8), IeeeFloatEncoder(1)],
+)
+def test_bitmap_of_mask_modified_in_place(tmp_path, encoder):
+    mask = np.zeros((3, 4), dtype=bool)
+    expected = []
+    path = tmp_path / "output.grib2"
+    with open(path, "wb") as f:
+        ind = Indicator(0)
+        ident = Identification(0, 0, 0, 0, 0, datetime(2022, 10, 1), 0, 0)
+        with Grib2MessageWriter(f, ind, ident) as grib2:
+            grib2._write_sect3(helpers.create_grid())
+            for level in range(1, 4):
+                # the mask shared by the fields is updated for each of them
+                mask.ravel()[: level * 3] = True
+                data = np.ma.MaskedArray(np.arange(12.0).reshape(3, 4), mask=mask)
+                expected.append(data.copy())
+                encoder.input(data)
+                product = helpers.create_product(0, FixedSurface(100, 0, level))
+                grib2._write_sect4(product)
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+    output = path.read_bytes()
+
+    assert [sect[5] for sect in _read_sect6s(output)] == [0, 0, 0]
+    with Grib2Reader(path) as reader:
+        for field, data in zip(reader, expected):
+            actual = field.values()
+            np.testing.assert_array_equal(actual.mask, data.mask)
+            np.testing.assert_array_equal(actual.compressed(), data.compressed())
+
+
+def _write_parity_bit_sized_message(f: BinaryIO):
+    ind = Indicator(0)
+    ident = Identification(0, 0, 0, 0, 0, datetime(2022, 10, 1), 0, 0)
+    with Grib2MessageWriter(f, ind, ident) as grib2:
+        encoder = ParityBitSizedEncoder()
+        grib2._write_sect3(ParityBitSizedGrid())
+        grib2._write_sect4(ParityBitSizedProductDefinition())
+        grib2._write_sect5(encoder)
+        grib2._write_sect6(encoder)
+        grib2._write_sect7(encoder)
+
+
+def test_writing_to_non_seekable_stream():
+    with io.BytesIO() as fw:
+        _write_parity_bit_sized_message(fw)
+        _write_parity_bit_sized_message(fw)
+        expected = fw.getvalue()
+
+    stream = helpers.NonSeekableStream()
+    assert not stream.seekable()
+    _write_parity_bit_sized_message(stream)
+    assert len(stream.chunks) == 1
+    _write_parity_bit_sized_message(stream)
+    assert b"".join(stream.chunks) == expected
+
+
+def test_gathering_message_into_one_system_call(tmp_path, monkeypatch):
+    with io.BytesIO() as fw:
+        fw.write(b"header")
+        _write_parity_bit_sized_message(fw)
+        expected = fw.getvalue() + b"footer"
+
+    calls = []
+    writev = os.writev
+
+    def counting_writev(fd, buffers):
+        calls.append(len(buffers))
+        return writev(fd, buffers)
+
+    monkeypatch.setattr(os, "writev", counting_writev)
+    path = tmp_path / "output.grib2"
+    with open(path, "wb") as f:
+        f.write(b"header")
+        ind = Indicator(0)
+        ident = Identification(0, 0, 0, 0, 0, datetime(2022, 10, 1), 0, 0)
+        with Grib2MessageWriter(f, ind, ident, gather=True) as grib2:
+            encoder = ParityBitSizedEncoder()
+            grib2._write_sect3(ParityBitSizedGrid())
+            grib2._write_sect4(ParityBitSizedProductDefinition())
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+        assert f.tell() == len(expected) - len(b"footer")
+        f.write(b"footer")
+
+    assert path.read_bytes() == expected
+    assert len(calls) == 1
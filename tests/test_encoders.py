@@ -1,11 +1,21 @@
+import struct
+import zlib
 from io import BytesIO
 
 import helpers
 import numpy as np
 import pytest
 
-from gribcoder import SimplePackingEncoder
-from gribcoder.encoders import create_bitmap
+from gribcoder import (
+    ComplexPackingEncoder,
+    IeeeFloatEncoder,
+    PngPackingEncoder,
+    RunLengthPackingEncoder,
+    SimplePackingEncoder,
+    encode_slices,
+)
+from gribcoder.encoders import FieldStatistics, compute_statistics, create_bitmap
+from gribcoder.utils import BufferWriter
 
 
 @pytest.mark.parametrize(
@@ -158,7 +168,7 @@ def test_auto_parametrization_simple_linear(
             0.0,
             0,
             1,
-            16,
+            12,
             np.arange(256) * 10,
             np.arange(256),
         ),
@@ -168,7 +178,7 @@ def test_auto_parametrization_simple_linear(
             0.0,
             0,
             3,
-            32,
+            18,
             np.arange(256) * 1000,
             np.arange(256),
         ),
@@ -188,7 +198,7 @@ def test_auto_parametrization_simple_linear(
             0.0,
             0,
             -1,
-            8,
+            5,
             np.round(np.arange(256) * 0.1),
             np.round(np.arange(256), decimals=-1),
             # np.arange(256),
@@ -419,6 +429,75 @@ def test_sect7_writing(input, r, e, d, expected):
     assert actual == expected
 
 
+@pytest.mark.parametrize(
+    "input,n,expected",
+    [
+        (
+            np.arange(0, 4),
+            2,
+            b"\x00\x00\x00\x06\x07\x1b",
+        ),
+        (
+            np.array([0xABC, 0xDEF, 0x123]),
+            12,
+            b"\x00\x00\x00\x0a\x07\xab\xcd\xef\x12\x30",
+        ),
+        (
+            np.ma.array([0xABC, 0xFFF, 0xDEF], mask=[0, 1, 0]),
+            12,
+            b"\x00\x00\x00\x08\x07\xab\xcd\xef",
+        ),
+        (
+            np.array([0x123456, 0x789ABC]),
+            24,
+            b"\x00\x00\x00\x0b\x07\x12\x34\x56\x78\x9a\xbc",
+        ),
+    ],
+)
+def test_sect7_writing_with_arbitrary_nbit(input, n, expected):
+    encoder = SimplePackingEncoder(0.0, 0, 0, n).input(input)
+    with BytesIO() as f:
+        sect_len = encoder.write_sect7(f)
+        actual = f.getvalue()
+    assert actual == expected
+    assert sect_len == len(expected)
+
+
+@pytest.mark.parametrize(
+    "input,n",
+    [
+        (np.arange(1001) / 10, 16),
+        (np.arange(1001).reshape(7, 143) / 10, 12),
+        (np.ma.MaskedArray(np.arange(1001) / 10, mask=np.arange(1001) % 7 == 0), 11),
+        (np.ma.MaskedArray(np.arange(1001) / 10, mask=np.arange(1001) < 300), 8),
+        (np.ma.MaskedArray(np.arange(1001) / 10, mask=np.ma.nomask), 24),
+        (np.full(1001, 2.0), 0),
+    ],
+)
+def test_chunked_encoding(input, n):
+    def write_sections(encoder):
+        with BytesIO() as f:
+            lengths = [
+                encoder.write_sect5(f),
+                encoder.write_sect6(f),
+                encoder.write_sect7(f),
+            ]
+            return (f.getvalue(), lengths)
+
+    expected = write_sections(SimplePackingEncoder(0.0, 0, 1, n).input(input))
+    encoder = SimplePackingEncoder(0.0, 0, 1, n).input(input).chunked(64)
+    actual = write_sections(encoder)
+    assert actual == expected
+    assert encoder._encoded is None
+
+
+@pytest.mark.parametrize("block_size", [0, -8, 100])
+def test_errors_in_chunked_encoding(block_size):
+    with pytest.raises(RuntimeError) as e:
+        SimplePackingEncoder(0.0, 0, 0, 8).chunked(block_size)
+    assert str(e.value) == "block size must be a positive multiple of 8"
+
+
 @pytest.mark.parametrize(
     "input,r,e,d,expectation,error_message",
     [
@@ -500,3 +579,652 @@ def test_bitmap_creation(input, expected):
     actual = create_bitmap(input)
     expected = np.array(expected, dtype=np.uint8)
     np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize(
+    "encoder",
+    [SimplePackingEncoder(0.0, 0, 0, 4), IeeeFloatEncoder()],
+)
+def test_bitmap_digest(encoder):
+    mask = np.arange(12).reshape(3, 4) % 3 == 0
+    data = np.ma.MaskedArray(np.arange(12.0).reshape(3, 4), mask=mask)
+    digest = encoder.input(data).bitmap_digest()
+    assert digest is not None
+
+    same_mask = np.ma.MaskedArray(np.zeros(12), mask=mask.ravel().copy())
+    assert encoder.input(same_mask).bitmap_digest() == digest
+
+    other_mask = np.ma.MaskedArray(data.data, mask=~mask)
+    assert encoder.input(other_mask).bitmap_digest() != digest
+
+    longer_mask = np.ma.MaskedArray(np.zeros(16), mask=np.arange(16) % 3 == 0)
+    assert encoder.input(longer_mask).bitmap_digest() != digest
+
+    assert encoder.input(data.data).bitmap_digest() is None
+
+
+@pytest.mark.parametrize(
+    "encoder",
+    [
+        SimplePackingEncoder(0.0, 0, 0, 0),
+        SimplePackingEncoder(0.0, 0, 0, 5),
+        SimplePackingEncoder(0.0, 0, 0, 16),
+        SimplePackingEncoder(0.0, 0, 0, 12).chunked(8),
+        IeeeFloatEncoder(1),
+        IeeeFloatEncoder(2),
+    ],
+)
+@pytest.mark.parametrize(
+    "input",
+    [
+        np.arange(13.0),
+        np.ma.MaskedArray(np.arange(13.0), mask=np.arange(13) % 4 == 0),
+        np.ma.MaskedArray(np.arange(13.0)),
+        np.arange(12.0).reshape(3, 4)[:, ::2],
+    ],
+)
+def test_sect_lens(encoder, input):
+    encoder.input(input)
+    actual = encoder.sect_lens()
+
+    lens = []
+    for write_sect in (encoder.write_sect5, encoder.write_sect6, encoder.write_sect7):
+        with BytesIO() as f:
+            length = write_sect(f)
+            assert len(f.getvalue()) == length
+            lens.append(length)
+
+    assert actual == tuple(lens)
+
+
+@pytest.mark.parametrize(
+    "encoder",
+    [
+        SimplePackingEncoder(0.0, 0, 0, 0),
+        SimplePackingEncoder(1.0, 1, 1, 8),
+        SimplePackingEncoder(1.0, 1, 1, 13),
+        SimplePackingEncoder(-5.0, -2, 0, 24),
+        IeeeFloatEncoder(1),
+        IeeeFloatEncoder(2),
+    ],
+)
+@pytest.mark.parametrize(
+    "input",
+    [
+        np.arange(100_000.0) / 7,
+        np.ma.MaskedArray(np.arange(11.0), mask=np.arange(11) % 3 == 0),
+        np.arange(12.0).reshape(3, 4)[:, ::-1],
+    ],
+)
+def test_writing_sect7_in_place(encoder, input):
+    encoder.input(input)
+    with BytesIO() as f:
+        encoder.write_sect7(f)
+        expected = f.getvalue()
+
+    encoder.input(input)
+    buf = bytearray(len(expected) + 2)
+    f = BufferWriter(buf, 1)
+    length = encoder.write_sect7(f)
+
+    assert length == len(expected)
+    assert f.tell() == 1 + length
+    assert bytes(buf[1:-1]) == expected
+    # values are not materialized as a whole
+    assert encoder._encoded is None
+
+
+@pytest.mark.parametrize(
+    "input,expected",
+    [
+        (np.arange(100_000), FieldStatistics(0, 99_999, False, 100_000)),
+        (
+            np.arange(100_000).reshape(100, 1000)[:, ::-2],
+            FieldStatistics(1, 99_999, False, 50_000),
+        ),
+        (np.full(100_000, 3.5), FieldStatistics(3.5, 3.5, False, 100_000)),
+        (
+            np.concatenate([np.full(40_000, np.nan), np.arange(60_000.0)]),
+            FieldStatistics(0.0, 59_999.0, True, 100_000),
+        ),
+        (
+            np.ma.MaskedArray(np.arange(100_000), mask=np.arange(100_000) % 3 == 0),
+            FieldStatistics(1, 99_998, False, 66_666),
+        ),
+        (
+            np.ma.MaskedArray([np.nan, 1.0, 2.0], mask=[1, 0, 0]),
+            FieldStatistics(1.0, 2.0, False, 2),
+        ),
+        (
+            np.ma.MaskedArray(np.arange(4), mask=[1, 1, 1, 1]),
+            FieldStatistics(np.nan, np.nan, False, 0),
+        ),
+        (np.array([np.nan, np.nan]), FieldStatistics(np.nan, np.nan, True, 2)),
+    ],
+)
+def test_statistics_computation(input, expected):
+    actual = compute_statistics(input)
+    np.testing.assert_equal(tuple(actual), tuple(expected))
+
+
+@pytest.mark.parametrize(
+    "input,expected",
+    [
+        (np.arange(4), False),
+        (np.full(4, 2.0), True),
+        (np.array([2.0, np.nan]), False),
+        (np.ma.MaskedArray([2, 1, 2], mask=[0, 1, 0]), True),
+        (np.ma.MaskedArray([2, 1, 2], mask=[1, 1, 1]), False),
+    ],
+)
+def test_uniqueness_in_statistics(input, expected):
+    assert compute_statistics(input).is_unique == expected
+
+
+def test_statistics_reuse_in_encoding():
+    data = np.arange(16)
+    encoder = SimplePackingEncoder.auto_parametrized_from(data, nbit=8)
+    stats = encoder.statistics()
+    assert encoder.input(data).statistics() is stats
+    assert encoder.input(data.copy()).statistics() is not stats
+
+
+def unpack_bits(octets, widths):
+    bits = np.unpackbits(np.frombuffer(octets, dtype=np.uint8))
+    offsets = np.concatenate([[0], np.cumsum(widths)])
+    return np.array(
+        [
+            int("".join(map(str, bits[a:b])) or "0", 2)
+            for a, b in zip(offsets, offsets[1:])
+        ]
+    )
+
+
+def decode_complex_packing(sect5, sect7):
+    template_num = int.from_bytes(sect5[9:11], "big")
+    num_of_values = int.from_bytes(sect5[5:9], "big")
+    ref_nbit = sect5[19]
+    num_of_groups = int.from_bytes(sect5[31:35], "big")
+    width_ref, width_nbit = sect5[35], sect5[36]
+    length_ref = int.from_bytes(sect5[37:41], "big")
+    last_length = int.from_bytes(sect5[42:46], "big")
+    assert sect5[46] == 0  # bits for scaled group lengths
+
+    pos = 5
+    if template_num == 3:
+        order, num_octets = sect5[47], sect5[48]
+        extras = []
+        for _ in range(order + 1):
+            raw = int.from_bytes(sect7[pos : pos + num_octets], "big")
+            sign_bit = 1 << (num_octets * 8 - 1)
+            extras.append(-(raw & ~sign_bit) if raw & sign_bit else raw)
+            pos += num_octets
+    refs = unpack_bits(sect7[pos:], [ref_nbit] * num_of_groups)
+    pos += -(-num_of_groups * ref_nbit // 8)
+    widths = unpack_bits(sect7[pos:], [width_nbit] * num_of_groups) + width_ref
+    pos += -(-num_of_groups * width_nbit // 8)
+    lengths = np.full(num_of_groups, length_ref)
+    lengths[-1:] = last_length
+    values = unpack_bits(sect7[pos:], np.repeat(widths, lengths))
+    values += np.repeat(refs, lengths)
+    assert len(values) == num_of_values
+
+    if template_num == 3:
+        values[order:] += extras[-1]
+        values[:order] = extras[: min(order, num_of_values)]
+        if order == 1:
+            values = np.cumsum(values)
+        else:
+            for i in range(2, num_of_values):
+                values[i] += 2 * values[i - 1] - values[i - 2]
+    return values
+
+
+@pytest.mark.parametrize("order", [0, 1, 2])
+@pytest.mark.parametrize(
+    "input",
+    [
+        np.round(np.sin(np.arange(3000) / 100) * 1000 + 500),
+        np.arange(3000).reshape(30, 100) % 37,
+        np.ma.MaskedArray(np.arange(3000) ** 2, mask=np.arange(3000) % 5 == 0),
+        np.full(100, 7),
+        np.array([3]),
+        np.array([3, 1]),
+        np.ma.MaskedArray([3, 1], mask=[1, 1]),
+    ],
+)
+def test_complex_packing(input, order):
+    encoder = ComplexPackingEncoder.auto_parametrized_from(
+        input, scaling="fixed-digit-linear", decimals=0
+    )
+    encoder.spatial_differencing = order
+    sect5 = helpers.write_sections(encoder, (5,))
+    sect7 = helpers.write_sections(encoder, (7,))
+    assert len(sect5) == (47 if order == 0 else 49)
+    assert sect5[9:11] == (b"\x00\x02" if order == 0 else b"\x00\x03")
+    actual = decode_complex_packing(sect5, sect7) + encoder.r
+    expected = input.compressed() if np.ma.isMaskedArray(input) else input.ravel()
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_complex_packing_size():
+    y, x = np.mgrid[0:100, 0:200]
+    input = np.sin(x / 30) * np.cos(y / 40) * 100
+    simple = SimplePackingEncoder.auto_parametrized_from(
+        input, scaling="fixed-digit-linear", decimals=1
+    )
+    complex = ComplexPackingEncoder.auto_parametrized_from(
+        input, scaling="fixed-digit-linear", decimals=1
+    )
+    sect7_len = len(helpers.write_sections(complex, (7,)))
+    assert sect7_len < len(helpers.write_sections(simple, (7,))) / 2
+
+
+def test_errors_in_complex_packing():
+    with pytest.raises(RuntimeError) as e:
+        ComplexPackingEncoder(0.0, 0, 0, 0, 3)
+    assert str(e.value) == "order of spatial differencing must be 0, 1, or 2"
+
+
+def decode_png(stream):
+    assert stream[:8] == b"\x89PNG\r\n\x1a\n"
+    pos, chunks = 8, {}
+    while pos < len(stream):
+        (length,) = struct.unpack(">I", stream[pos : pos + 4])
+        chunk_type = stream[pos + 4 : pos + 8]
+        data = stream[pos + 8 : pos + 8 + length]
+        (crc,) = struct.unpack(">I", stream[pos + 8 + length : pos + 12 + length])
+        assert crc == zlib.crc32(chunk_type + data)
+        chunks[chunk_type] = data
+        pos += 12 + length
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    bytes_per_value = {0: bit_depth // 8, 2: 3, 6: 4}[color_type]
+
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+    scanlines = raw.reshape(height, -1)
+    rows = scanlines[:, 1:].copy()
+    for i in range(height):
+        if scanlines[i, 0] == 1:
+            lanes = rows[i].reshape(-1, bytes_per_value)
+            rows[i] = np.cumsum(lanes, axis=0, dtype=np.uint8).ravel()
+        elif scanlines[i, 0] == 2 and i > 0:
+            rows[i] += rows[i - 1]
+    octets = rows.reshape(-1, bytes_per_value).astype(np.uint64)
+    weights = 256 ** np.arange(bytes_per_value - 1, -1, -1, dtype=np.uint64)
+    return ((width, height, bit_depth, color_type), (octets * weights).sum(axis=1))
+
+
+@pytest.mark.parametrize("filter_type", ["none", "sub", "up"])
+@pytest.mark.parametrize(
+    "input,nbit,expected_bits,expected_header",
+    [
+        (np.arange(600).reshape(20, 30) % 97, 8, 8, (30, 20, 8, 0)),
+        (np.arange(600).reshape(20, 30) ** 2, 12, 16, (30, 20, 16, 0)),
+        (np.arange(600).reshape(20, 30) ** 2, 20, 24, (30, 20, 8, 2)),
+        (np.arange(600) ** 3, 32, 32, (600, 1, 8, 6)),
+        (
+            np.ma.MaskedArray(np.arange(600).reshape(20, 30), mask=np.eye(20, 30)),
+            8,
+            8,
+            (580, 1, 8, 0),
+        ),
+    ],
+)
+def test_png_packing(input, nbit, expected_bits, expected_header, filter_type):
+    encoder = PngPackingEncoder.auto_parametrized_from(
+        input, scaling="simple-linear", nbit=nbit
+    )
+    encoder.filter_type = filter_type
+    sect5 = helpers.write_sections(encoder, (5,))
+    sect7 = helpers.write_sections(encoder, (7,))
+    assert sect5[9:11] == b"\x00\x29"
+    assert sect5[19] == expected_bits
+    actual_header, actual = decode_png(sect7[5:])
+    assert actual_header == expected_header
+
+    simple = SimplePackingEncoder(encoder.r, encoder.e, encoder.d, encoder.n)
+    expected, _ = simple.input(input).encode()
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_png_packing_of_constant_field():
+    encoder = PngPackingEncoder.auto_parametrized_from(np.full(10, 3), nbit=8)
+    sect5 = helpers.write_sections(encoder, (5,))
+    sect7 = helpers.write_sections(encoder, (7,))
+    assert sect5[19] == 0
+    assert sect7 == b"\x00\x00\x00\x05\x07"
+
+
+def test_errors_in_png_packing():
+    with pytest.raises(RuntimeError) as e:
+        PngPackingEncoder(0.0, 0, 0, 8, filter_type="paeth")
+    assert str(e.value) == "unsupported PNG filter type: paeth"
+
+
+@pytest.mark.parametrize(
+    "input,precision,expected_sect5,expected_sect6,expected_sect7",
+    [
+        (
+            np.array([1.0, -2.5]),
+            1,
+            b"\x00\x00\x00\x0c\x05\x00\x00\x00\x02\x00\x04\x01",
+            b"\x00\x00\x00\x06\x06\xff",
+            b"\x00\x00\x00\x0d\x07\x3f\x80\x00\x00\xc0\x20\x00\x00",
+        ),
+        (
+            np.array([[1.0], [-2.5]], dtype="<f4"),
+            2,
+            b"\x00\x00\x00\x0c\x05\x00\x00\x00\x02\x00\x04\x02",
+            b"\x00\x00\x00\x06\x06\xff",
+            b"\x00\x00\x00\x15\x07\x3f\xf0\x00\x00\x00\x00\x00\x00"
+            + b"\xc0\x04\x00\x00\x00\x00\x00\x00",
+        ),
+        (
+            np.ma.MaskedArray([1.0, np.nan, -2.5], mask=[0, 1, 0]),
+            1,
+            b"\x00\x00\x00\x0c\x05\x00\x00\x00\x02\x00\x04\x01",
+            b"\x00\x00\x00\x07\x06\x00\xa0",
+            b"\x00\x00\x00\x0d\x07\x3f\x80\x00\x00\xc0\x20\x00\x00",
+        ),
+    ],
+)
+def test_ieee_float_encoding(
+    input, precision, expected_sect5, expected_sect6, expected_sect7
+):
+    encoder = IeeeFloatEncoder(precision).input(input)
+    actual = []
+    for write_sect in [encoder.write_sect5, encoder.write_sect6, encoder.write_sect7]:
+        with BytesIO() as f:
+            assert write_sect(f) == len(f.getvalue())
+            actual.append(f.getvalue())
+    assert actual == [expected_sect5, expected_sect6, expected_sect7]
+
+
+def test_ieee_float_encoding_without_copy():
+    input = np.arange(4, dtype=">f4")
+    encoded, _ = IeeeFloatEncoder(1).input(input).encode()
+    assert np.shares_memory(encoded, input)
+
+
+def test_errors_in_ieee_float_encoding():
+    with pytest.raises(RuntimeError) as e:
+        IeeeFloatEncoder(3)
+    assert str(e.value) == "precision must be 1 (32-bit) or 2 (64-bit)"
+
+
+def decode_run_length_packing(codes, max_level, nbit):
+    base = 2**nbit - 1 - max_level
+    levels, factor = [], 1
+    for code in codes:
+        if code <= max_level:
+            levels.append(code)
+            factor = 1
+        else:
+            levels.extend([levels[-1]] * ((code - max_level - 1) * factor))
+            factor *= base
+    return np.array(levels)
+
+
+@pytest.mark.parametrize(
+    "input,n,expected_sect5,expected_codes",
+    [
+        (
+            np.array([1, 1, 1, 2, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3]),
+            4,
+            b"\x00\x00\x00\x17\x05\x00\x00\x00\x10\x00\xc8\x04\x00\x03\x00\x03"
+            + b"\x81\x00\x0a\x00\x14\x00\x1e",
+            # base 12: 3 = 1 + 2, 2 = 1 + 1, 10 = 1 + 9, 1 = 1
+            [1, 6, 2, 5, 0, 13, 3],
+        ),
+        (
+            np.ma.MaskedArray([2, 2, 2, 2, 1], mask=[0, 0, 1, 1, 0]),
+            None,
+            b"\x00\x00\x00\x17\x05\x00\x00\x00\x05\x00\xc8\x03\x00\x02\x00\x03"
+            + b"\x81\x00\x0a\x00\x14\x00\x1e",
+            # n=2 gives base 1, so that n=3 (base 5) is the smallest
+            [2, 4, 0, 4, 1],
+        ),
+    ],
+)
+def test_run_length_packing(input, n, expected_sect5, expected_codes):
+    encoder = RunLengthPackingEncoder([10, 20, 30], -1, n).input(input)
+    sect5 = helpers.write_sections(encoder, (5,))
+    sect7 = helpers.write_sections(encoder, (7,))
+    assert sect5 == expected_sect5
+    codes, bitmap = encoder.encode()
+    np.testing.assert_array_equal(codes, expected_codes)
+    assert bitmap is None
+
+    nbit = sect5[11]
+    assert len(sect7) == 5 + -(-len(codes) * nbit // 8)
+    decoded_codes = unpack_bits(sect7[5:], [nbit] * ((len(sect7) - 5) * 8 // nbit))
+    actual = decode_run_length_packing(decoded_codes, sect5[13], nbit)
+    np.testing.assert_array_equal(actual, np.ma.filled(input, 0))
+
+
+def test_run_length_packing_of_long_runs():
+    input = np.repeat([1, 2, 1, 0], [1, 100_000, 2, 3])
+    encoder = RunLengthPackingEncoder([1, 2], 0, 8).input(input)
+    codes, _ = encoder.encode()
+    actual = decode_run_length_packing(codes, 2, 8)
+    np.testing.assert_array_equal(actual, input)
+
+
+@pytest.mark.parametrize(
+    "input,n,error_message",
+    [
+        (np.array([1.0, 2.0]), None, "levels must be integers"),
+        (np.array([1, 3]), None, "levels out of range of level values"),
+        (np.array([-1, 1]), None, "levels out of range of level values"),
+        (np.array([1, 2]), 2, "n is too small for the levels used"),
+    ],
+)
+def test_errors_in_run_length_packing(input, n, error_message):
+    encoder = RunLengthPackingEncoder([10, 20], 0, n).input(input)
+    with pytest.raises(RuntimeError) as e:
+        encoder.encode()
+    assert str(e.value) == error_message
+
+
+def create_stack(shape, dtype=np.float64):
+    rng = np.random.default_rng(0)
+    data = rng.normal(280.0, 10.0, shape) * np.arange(1, shape[-3] + 1)[:, None, None]
+    return data.astype(dtype)
+
+
+STACK_MASK = np.zeros((4, 6, 5), dtype=bool)
+STACK_MASK[0, ::2, 1:] = True
+STACK_MASK[2] = True
+
+
+@pytest.mark.parametrize(
+    "data,kwargs",
+    [
+        (create_stack((4, 6, 5)), {"nbit": 16}),
+        (create_stack((4, 6, 5)), {"nbit": 12}),
+        (create_stack((3, 4, 6, 5)), {"nbit": 8}),
+        (create_stack((4, 6, 5)), {"scaling": "fixed-digit-linear", "decimals": 1}),
+        (create_stack((4, 6, 5)).astype(np.int32), {"nbit": 16}),
+        (np.ma.MaskedArray(create_stack((4, 6, 5)), mask=STACK_MASK), {"nbit": 12}),
+        (np.ma.MaskedArray(create_stack((4, 6, 5))), {"nbit": 16}),
+        (np.stack([np.full((6, 5), 3.5), create_stack((1, 6, 5))[0]]), {"nbit": 16}),
+    ],
+)
+def test_encoding_slices(data, kwargs):
+    encoders = encode_slices(data, **kwargs)
+    slices = data.reshape(-1, *data.shape[-2:])
+    assert len(encoders) == len(slices)
+    for encoder, data_slice in zip(encoders, slices):
+        expected = SimplePackingEncoder.auto_parametrized_from(data_slice, **kwargs)
+        assert (encoder.r, encoder.e, encoder.d, encoder.n) == (
+            expected.r,
+            expected.e,
+            expected.d,
+            expected.n,
+        )
+        np.testing.assert_equal(
+            tuple(encoder.statistics()), tuple(expected.statistics())
+        )
+        assert helpers.write_sections(encoder) == helpers.write_sections(expected)
+
+
+def test_encoding_slices_with_nan():
+    data = create_stack((3, 6, 5))
+    data[1, 2, 3] = np.nan
+    encoders = encode_slices(data, nbit=16)
+    assert helpers.write_sections(encoders[0]) == helpers.write_sections(
+        SimplePackingEncoder.auto_parametrized_from(data[0], nbit=16)
+    )
+    with pytest.raises(RuntimeError) as e:
+        helpers.write_sections(encoders[1])
+    assert str(e.value) == "data contains NaN values"
+
+
+def test_encoding_slices_of_2d_data():
+    with pytest.raises(RuntimeError) as e:
+        encode_slices(np.zeros((6, 5)), nbit=16)
+    assert str(e.value) == "data must have 3 or more dimensions"
+
+
+MISSING_DATA = np.where(
+    np.arange(30).reshape(5, 6) % 7 < 2, np.nan, np.arange(30.0).reshape(5, 6) / 3
+)
+
+
+@pytest.mark.parametrize(
+    "create_encoder",
+    [
+        lambda data, missing: SimplePackingEncoder.auto_parametrized_from(
+            data, nbit=12, missing=missing
+        ),
+        lambda data, missing: SimplePackingEncoder(0.0, 0, 1, 8)
+        .with_missing_value(missing)
+        .input(data),
+        lambda data, missing: SimplePackingEncoder(0.0, 0, 1, 8)
+        .chunked(8)
+        .with_missing_value(missing)
+        .input(data),
+        lambda data, missing: ComplexPackingEncoder.auto_parametrized_from(
+            data, nbit=12, missing=missing
+        ),
+        lambda data, missing: PngPackingEncoder.auto_parametrized_from(
+            data, nbit=12, missing=missing
+        ),
+    ],
+)
+@pytest.mark.parametrize(
+    "data,missing",
+    [
+        (MISSING_DATA, np.nan),
+        (np.nan_to_num(MISSING_DATA, nan=-9999.0), -9999.0),
+        (np.nan_to_num(MISSING_DATA * 3, nan=-1).astype(np.int32), -1),
+        (np.full((5, 6), np.nan), np.nan),
+    ],
+)
+def test_encoding_with_missing_values(create_encoder, data, missing):
+    mask = np.isnan(data) if np.isnan(missing) else data == missing
+    masked = np.ma.MaskedArray(data, mask=mask)
+    encoder = create_encoder(data, missing)
+    expected = create_encoder(masked, None)
+    assert encoder.sect_lens() == expected.sect_lens()
+    assert helpers.write_sections(encoder) == helpers.write_sections(expected)
+    np.testing.assert_equal(tuple(encoder.statistics()), tuple(expected.statistics()))
+
+
+def test_bitmap_digest_with_missing_values():
+    def digest(data):
+        return SimplePackingEncoder(0.0, 0, 1, 8).with_missing_value().input(data)
+
+    assert (
+        digest(MISSING_DATA).bitmap_digest() == digest(MISSING_DATA * 2).bitmap_digest()
+    )
+    assert (
+        digest(MISSING_DATA).bitmap_digest() != digest(MISSING_DATA.T).bitmap_digest()
+    )
+    assert (
+        digest(MISSING_DATA).bitmap_digest() != digest(MISSING_DATA[:4]).bitmap_digest()
+    )
+
+
+def test_missing_values_in_masked_array():
+    data = np.ma.MaskedArray(MISSING_DATA, mask=np.isnan(MISSING_DATA))
+    with pytest.raises(RuntimeError) as e:
+        SimplePackingEncoder.auto_parametrized_from(data, nbit=12, missing=np.nan)
+    assert str(e.value) == "missing values cannot be used with masked arrays"
+
+
+def test_statistics_computation_with_missing_values():
+    data = np.array([1.0, -9999.0, np.nan, 3.0])
+    actual = compute_statistics(data, -9999.0)
+    np.testing.assert_equal(tuple(actual), (1.0, 3.0, True, 3))
+    actual = compute_statistics(data, np.nan)
+    np.testing.assert_equal(tuple(actual), (-9999.0, 3.0, False, 3))
+
+
+@pytest.mark.parametrize("missing", [np.nan, -9999.0])
+def test_encoding_slices_with_missing_values(missing):
+    data = create_stack((4, 6, 5))
+    data[STACK_MASK] = missing
+    encoders = encode_slices(data, nbit=12, missing=missing)
+    for encoder, data_slice in zip(encoders, data):
+        expected = SimplePackingEncoder.auto_parametrized_from(
+            data_slice, nbit=12, missing=missing
+        )
+        assert (encoder.r, encoder.d, encoder.n) == (expected.r, expected.d, expected.n)
+        assert encoder.sect_lens() == expected.sect_lens()
+        assert helpers.write_sections(encoder) == helpers.write_sections(expected)
+
+
+@pytest.mark.parametrize(
+    "input,kwargs",
+    [
+        (create_stack((1, 100, 100))[0], {"max_error": 0.05}),
+        (create_stack((1, 100, 100))[0], {"max_error": 0.5}),
+        (create_stack((1, 100, 100))[0] * 1e-6 - 3e-4, {"max_error": 1e-9}),
+        (create_stack((1, 100, 100))[0] * 1e3, {"relative_error": 1e-4}),
+        (np.arange(100), {"max_error": 0.5}),
+        (np.arange(100), {"max_error": 3}),
+    ],
+)
+def test_auto_parametrization_max_error(input, kwargs):
+    encoder = SimplePackingEncoder.auto_parametrized_from(input, "max-error", **kwargs)
+    actual_encoded, _ = encoder.encode()
+    assert encoder.r == np.float32(encoder.r)  # exactly stored in Section 5
+    actual_restored = decode_simple_packing(
+        actual_encoded, encoder.r, encoder.e, encoder.d, encoder.n
+    )
+    max_error = kwargs.get("max_error")
+    if max_error is None:
+        max_error = kwargs["relative_error"] * np.abs(input).max()
+    assert np.abs(actual_restored - input.ravel()).max() <= max_error * (1 + 1e-12)
+    # values cannot be distinguished in steps of `2 * max_error` with fewer bits
+    assert np.ptp(input) > (2 ** (encoder.n - 1) - 1) * 2 * max_error
+
+
+def test_auto_parametrization_max_error_with_too_small_error():
+    with pytest.raises(RuntimeError) as e:
+        SimplePackingEncoder.auto_parametrized_from(
+            np.array([0.0, 1.0]), "max-error", max_error=1e-12
+        )
+    assert str(e.value) == "max error is too small for the values"
+    with pytest.raises(RuntimeError) as e:
+        SimplePackingEncoder.auto_parametrized_from(
+            np.array([0.0, 1.0]), "max-error", max_error=0
+        )
+    assert str(e.value) == "max error must be positive"
+
+
+def test_encoding_slices_with_max_error():
+    data = create_stack((4, 6, 5))
+    encoders = encode_slices(data, "max-error", max_error=0.01)
+    for encoder, data_slice in zip(encoders, data):
+        expected = SimplePackingEncoder.auto_parametrized_from(
+            data_slice, "max-error", max_error=0.01
+        )
+        assert (encoder.r, encoder.e, encoder.d, encoder.n) == (
+            expected.r,
+            expected.e,
+            expected.d,
+            expected.n,
+        )
+        assert helpers.write_sections(encoder) == helpers.write_sections(expected)
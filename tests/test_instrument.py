@@ -0,0 +1,133 @@
+import sys
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pytest
+from helpers import create_grid, create_product
+
+from gribcoder import (
+    FixedSurface,
+    Grib2MessageWriter,
+    Identification,
+    IeeeFloatEncoder,
+    Indicator,
+    Instrumentation,
+    MessageTemplate,
+    SimplePackingEncoder,
+)
+from gribcoder.instrument import _phases
+
+DATA = np.ma.MaskedArray(
+    np.arange(12.0).reshape(3, 4), mask=np.arange(12).reshape(3, 4) % 5 == 0
+)
+
+
+def write_message(f, encoder, instrumentation, gather=False):
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with Grib2MessageWriter(
+        f, ind, ident, gather=gather, instrumentation=instrumentation
+    ) as grib2:
+        grib2._write_sect3(create_grid())
+        grib2._write_sect4(create_product(0, FixedSurface(103, 0, 2)))
+        encoder.input(DATA)
+        grib2._write_sect5(encoder)
+        grib2._write_sect6(encoder)
+        grib2._write_sect7(encoder)
+
+
+@pytest.mark.parametrize(
+    "encoder,encoding_sect_no",
+    [
+        (SimplePackingEncoder(0.0, 0, 0, 12), 7),
+        (SimplePackingEncoder(0.0, 0, 0, 12).chunked(8), 7),
+        (IeeeFloatEncoder(1), 7),
+    ],
+)
+@pytest.mark.parametrize("gather", [False, True])
+def test_instrumentation(encoder, encoding_sect_no, gather):
+    sections = []
+    messages = []
+    instrumentation = Instrumentation(sections.append, messages.append)
+    with BytesIO() as f:
+        write_message(f, encoder, instrumentation, gather)
+        actual = f.getvalue()
+
+    assert [report.sect_no for report in sections] == [0, 1, 3, 4, 5, 6, 7, 8]
+    assert sum(report.nbytes for report in sections) == len(actual)
+    for report in sections:
+        assert report.seconds >= sum(report.phases.values())
+        assert report.peak_alloc is None
+        assert "io" in report.phases
+    assert "bitmap" in sections[5].phases
+    assert "encoding" in sections[encoding_sect_no - 1].phases
+
+    (message,) = messages
+    assert message.nbytes == len(actual)
+    assert message.sections == tuple(sections)
+    assert message.seconds >= sum(report.seconds for report in sections)
+    assert (message.io_seconds > 0) == gather
+    assert _phases.get() is None
+
+
+def test_instrumentation_with_template():
+    messages = []
+    instrumentation = Instrumentation(on_message=messages.append)
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    product = create_product(0, FixedSurface(103, 0, 2))
+    template = MessageTemplate(ind, ident, create_grid(), product)
+    encoder = SimplePackingEncoder(0.0, 0, 0, 12).input(DATA)
+    with BytesIO() as f:
+        with template.writer(f, instrumentation=instrumentation) as grib2:
+            grib2._write_sect3(template.grid_section())
+            grib2._write_sect4(template.product_section())
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+        assert messages[0].nbytes == len(f.getvalue())
+
+
+def test_tracing_memory():
+    sections = []
+    messages = []
+    instrumentation = Instrumentation(sections.append, messages.append, True)
+    data = np.ones((300, 400))
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with BytesIO() as f:
+        with Grib2MessageWriter(
+            f, ind, ident, instrumentation=instrumentation
+        ) as grib2:
+            grib2._write_sect3(create_grid())
+            grib2._write_sect4(create_product(0, FixedSurface(103, 0, 2)))
+            encoder = SimplePackingEncoder(0.0, 0, 0, 16).input(data)
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+
+    # quantized values in 16 bits are allocated in Section 7
+    assert messages[0].peak_alloc >= data.size * 2
+    if sys.version_info >= (3, 9):
+        assert sections[6].peak_alloc >= data.size * 2
+        assert sections[0].peak_alloc < data.size * 2
+    else:
+        assert all(report.peak_alloc is None for report in sections)
+
+
+def test_instrumentation_on_error():
+    sections = []
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    encoder = SimplePackingEncoder(0.0, 0, 0, 40).input(DATA)
+    with BytesIO() as f:
+        with pytest.raises(RuntimeError):
+            with Grib2MessageWriter(
+                f, ind, ident, instrumentation=Instrumentation(sections.append)
+            ) as grib2:
+                grib2._write_sect3(create_grid())
+                grib2._write_sect4(create_product(0, FixedSurface(103, 0, 2)))
+                grib2._write_sect5(encoder)
+    assert [report.sect_no for report in sections] == [0, 1, 3, 4]
+    assert _phases.get() is None
@@ -0,0 +1,135 @@
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+from helpers import NonSeekableStream, create_grid, create_product
+
+from gribcoder import (
+    BaseProductDefinition,
+    FixedSurface,
+    Grib2MessageWriter,
+    Identification,
+    IeeeFloatEncoder,
+    Indicator,
+    InventoryWriter,
+    MessageTemplate,
+    SimplePackingEncoder,
+)
+from gribcoder.message import DTYPE_SECTION_0
+from gribcoder.utils import create_sect_header, grib_signed, write
+
+
+class ProductDefinitionWithTemplate4_65535(BaseProductDefinition):
+    def write(self, f) -> int:
+        write(f, create_sect_header(4, 9))
+        write(f, np.array([0, 0xFFFF], dtype=">u2"))
+        return 9
+
+
+def write_messages(f, index, gather):
+    grid = create_grid()
+    data = np.arange(12.0).reshape(3, 4)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1, 12, 30), 0, 1)
+    with Grib2MessageWriter(f, Indicator(0), ident, gather, index) as grib2:
+        for product in [
+            create_product(3, FixedSurface(103, 0, 2)),
+            create_product(grib_signed(-6, 4), FixedSurface(100, -2, 85000)),
+            ProductDefinitionWithTemplate4_65535(),
+        ]:
+            encoder = SimplePackingEncoder.auto_parametrized_from(data, nbit=12)
+            if not isinstance(product, ProductDefinitionWithTemplate4_65535):
+                grib2._write_sect3(grid)
+            grib2._write_sect4(product)
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+
+    template = MessageTemplate(
+        Indicator(2),
+        Identification(34, 0, 29, 0, 0, datetime(2022, 10, 2), 0, 1),
+        grid,
+        create_product(0, FixedSurface(1, 0, 0)),
+    )
+    with template.writer(f, gather, index) as grib2:
+        grib2._write_sect3(template.grid_section())
+        grib2._write_sect4(template.product_section(forecast_time=9))
+        encoder = IeeeFloatEncoder().input(data)
+        grib2._write_sect5(encoder)
+        grib2._write_sect6(encoder)
+        grib2._write_sect7(encoder)
+
+
+EXPECTED_METADATA = [
+    {
+        "field": 0,
+        "discipline": 0,
+        "reftime": "2022-10-01T12:30:00",
+        "parameter": [0, 0],
+        "forecast_time": [1, 3],
+        "surfaces": [[103, 0, 2], None],
+    },
+    {
+        "field": 1,
+        "discipline": 0,
+        "reftime": "2022-10-01T12:30:00",
+        "parameter": [0, 0],
+        "forecast_time": [1, -6],
+        "surfaces": [[100, -2, 85000], None],
+    },
+    {
+        "field": 2,
+        "discipline": 0,
+        "reftime": "2022-10-01T12:30:00",
+        "parameter": None,
+        "forecast_time": None,
+        "surfaces": None,
+    },
+    {
+        "field": 0,
+        "discipline": 2,
+        "reftime": "2022-10-02T00:00:00",
+        "parameter": [0, 0],
+        "forecast_time": [1, 9],
+        "surfaces": [[1, 0, 0], None],
+    },
+]
+
+
+@pytest.mark.parametrize(
+    "seekable,gather", [(True, False), (True, True), (False, False)]
+)
+def test_inventory(seekable, gather):
+    header = b"header"
+    index_file = io.StringIO()
+    index = InventoryWriter(index_file, offset=len(header))
+    if seekable:
+        with io.BytesIO() as f:
+            f.write(header)
+            write_messages(f, index, gather)
+            output = f.getvalue()
+    else:
+        f = NonSeekableStream()
+        f.write(header)
+        write_messages(f, index, gather)
+        output = b"".join(f.chunks)
+
+    entries = [json.loads(line) for line in index_file.getvalue().splitlines()]
+    assert len(entries) == len(EXPECTED_METADATA)
+
+    end = len(header)
+    for entry, metadata in zip(entries, EXPECTED_METADATA):
+        assert {key: entry[key] for key in metadata} == metadata
+        if entry["field"] == 0:
+            assert entry["offset"] == end
+            end += entry["length"]
+        sect0 = np.frombuffer(output, DTYPE_SECTION_0, count=1, offset=entry["offset"])
+        assert sect0[0]["total_length"] == entry["length"]
+
+        start = entry["field_offset"]
+        stop = start + entry["field_length"]
+        # the field starts with Section 3 or 4 and is followed by Section 3, 4, or 8
+        assert output[start + 4] == (3 if entry["parameter"] is not None else 4)
+        assert output[stop : stop + 4] == b"7777" or output[stop + 4] in (3, 4)
+    assert end == len(output)
@@ -0,0 +1,204 @@
+import functools
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pytest
+from helpers import (
+    create_grid,
+    create_ieee_float_encoder,
+    create_product,
+    write_sequentially,
+)
+
+from gribcoder import (
+    ComplexPackingEncoder,
+    Field,
+    FixedSurface,
+    Identification,
+    IeeeFloatEncoder,
+    Indicator,
+    Message,
+    SimplePackingEncoder,
+    estimate_message_size,
+    plan_layout,
+    write_messages,
+)
+from gribcoder.message import DTYPE_SECTION_0
+
+
+def create_chunked_encoder(data):
+    return SimplePackingEncoder.auto_parametrized_from(data, nbit=7).chunked(8)
+
+
+ENCODER_FACTORIES = [
+    functools.partial(SimplePackingEncoder.auto_parametrized_from, nbit=10),
+    functools.partial(SimplePackingEncoder.auto_parametrized_from, nbit=16),
+    create_ieee_float_encoder,
+    create_chunked_encoder,
+    functools.partial(ComplexPackingEncoder.auto_parametrized_from, nbit=12),
+]
+
+
+def create_messages(num):
+    grid = create_grid()
+    mask = np.arange(12).reshape(3, 4) % 5 == 0
+    messages = []
+    for i in range(num):
+        fields = []
+        for j in range(i % 3 + 1):
+            data = np.arange(12.0).reshape(3, 4) * (i + j)
+            if (i + j) % 4 != 3:
+                data = np.ma.MaskedArray(data, mask=mask)
+            encoder = ENCODER_FACTORIES[(i + j) % len(ENCODER_FACTORIES)]
+            product = create_product(j, FixedSurface(103, 0, 2))
+            fields.append(Field(product, data, encoder, grid if j == 0 else None))
+        ind = Indicator(0)
+        ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+        messages.append(Message(ind, ident, fields))
+    return messages
+
+
+@pytest.mark.parametrize("max_workers", [None, 1, 3])
+def test_writing_messages_at_planned_offsets(tmp_path, max_workers):
+    messages = create_messages(10)
+    path = tmp_path / "output.grib2"
+    with open(path, "wb") as f:
+        f.write(b"header")
+        layouts = write_messages(f, messages, max_workers)
+        f.write(b"footer")
+    actual = path.read_bytes()
+
+    with BytesIO() as f:
+        f.write(b"header")
+        write_sequentially(f, create_messages(10))
+        f.write(b"footer")
+        expected = f.getvalue()
+
+    assert actual == expected
+    assert layouts == plan_layout(messages, offset=6)
+
+    offset = 6
+    for layout in layouts:
+        assert layout.offset == offset
+        sect0 = np.frombuffer(actual, DTYPE_SECTION_0, count=1, offset=offset)
+        assert sect0[0]["total_length"] == layout.length
+        pos = offset
+        for sect in layout.sections:
+            assert sect.offset == pos
+            if sect.num not in (0, 8):
+                assert actual[pos + 4] == sect.num
+            pos += sect.length
+        assert actual[pos - 4 : pos] == b"7777"
+        offset += layout.length
+    assert offset + 6 == len(actual)
+
+
+@pytest.mark.parametrize("existing", [b"", b"x" * 10_000])
+def test_writing_messages_to_memory_mapped_file(tmp_path, existing):
+    messages = create_messages(10)
+    path = tmp_path / "output.grib2"
+    path.write_bytes(existing)
+    with open(path, "r+b") as f:
+        f.write(b"header")
+        layouts = write_messages(f, messages, 3, use_mmap=True)
+        f.write(b"footer")
+    actual = path.read_bytes()
+
+    with BytesIO() as f:
+        f.write(b"header")
+        write_sequentially(f, create_messages(10))
+        f.write(b"footer")
+        expected = f.getvalue()
+
+    end = len(expected)
+    assert actual[:end] == expected
+    assert actual[end:] == existing[end:]
+    assert layouts == plan_layout(messages, offset=6)
+
+
+@pytest.mark.parametrize("factory", ENCODER_FACTORIES[:3])
+def test_encoding_into_memory_mapped_file(tmp_path, factory):
+    encoders = []
+
+    def create_encoder(data):
+        encoders.append(factory(data))
+        return encoders[-1]
+
+    messages = create_messages(4)
+    for message in messages:
+        for i, field in enumerate(message.fields):
+            message.fields[i] = field._replace(encoder=create_encoder)
+    path = tmp_path / "output.grib2"
+    with open(path, "w+b") as f:
+        write_messages(f, messages, use_mmap=True)
+    # values are converted directly into the file, never kept in encoders
+    assert all(encoder._encoded is None for encoder in encoders)
+
+    with BytesIO() as f:
+        write_sequentially(f, messages)
+        assert path.read_bytes() == f.getvalue()
+
+
+def test_writing_no_messages_to_memory_mapped_file(tmp_path):
+    path = tmp_path / "output.grib2"
+    with open(path, "w+b") as f:
+        assert write_messages(f, [], use_mmap=True) == []
+    assert path.read_bytes() == b""
+
+
+def test_planned_section_lengths():
+    messages = create_messages(4)
+    layouts = plan_layout(messages)
+
+    assert [sect.num for sect in layouts[1].sections] == [
+        *[0, 1],
+        *[3, 4, 5, 6, 7],
+        *[4, 5, 6, 7],
+        8,
+    ]
+    # Section 6 with a bitmap of 12 points, which is reused by the second field
+    assert layouts[1].sections[5].length == 5 + 1 + 2
+    assert layouts[1].sections[9].length == 5 + 1
+
+
+@pytest.mark.parametrize(
+    "encoder",
+    [
+        SimplePackingEncoder(0.0, 0, 0, 0),
+        SimplePackingEncoder(0.0, 0, 0, 13),
+        SimplePackingEncoder(0.0, 0, 0, 32),
+        IeeeFloatEncoder(2),
+    ],
+)
+@pytest.mark.parametrize("masked", [False, True])
+def test_message_size_estimation(encoder, masked):
+    data = np.arange(12.0).reshape(3, 4)
+    mask = None
+    if masked:
+        mask = np.arange(12).reshape(3, 4) % 5 == 0
+        data = np.ma.MaskedArray(data, mask=mask)
+    grid = create_grid()
+    product = create_product(0, FixedSurface(103, 0, 2))
+
+    actual = estimate_message_size(grid, product, encoder, data.shape, mask)
+
+    with BytesIO() as f:
+        message = Message(
+            Indicator(0),
+            Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1),
+            [Field(product, data, encoder.input, grid)],
+        )
+        write_sequentially(f, [message])
+        expected = len(f.getvalue())
+
+    assert actual == expected
+
+
+def test_errors_in_message_size_estimation():
+    grid = create_grid()
+    product = create_product(0, FixedSurface(103, 0, 2))
+    encoder = ComplexPackingEncoder(0.0, 0, 0, 8)
+    with pytest.raises(RuntimeError) as e:
+        estimate_message_size(grid, product, encoder, (3, 4))
+    assert str(e.value) == "message size cannot be known without encoding the data"
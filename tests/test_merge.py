@@ -0,0 +1,105 @@
+import errno
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+from helpers import create_grid, create_product
+
+from gribcoder import (
+    FixedSurface,
+    Grib2MessageWriter,
+    Identification,
+    Indicator,
+    SimplePackingEncoder,
+    copy_messages,
+)
+
+
+def write_message(f, forecast_times):
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    data = np.arange(12.0).reshape(3, 4)
+    with Grib2MessageWriter(f, ind, ident) as grib2:
+        grib2._write_sect3(create_grid())
+        for forecast_time in forecast_times:
+            grib2._write_sect4(create_product(forecast_time, FixedSurface(103, 0, 2)))
+            encoder = SimplePackingEncoder.auto_parametrized_from(data, nbit=12)
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+
+
+@pytest.fixture
+def srcs(tmp_path):
+    paths = [tmp_path / "src0.grib2", tmp_path / "src1.grib2"]
+    messages = []
+    for i, path in enumerate(paths):
+        with open(path, "wb") as f:
+            for forecast_times in [[i], [1, 2], [i + 3]]:
+                start = f.tell()
+                write_message(f, forecast_times)
+                f.flush()
+                messages.append(path.read_bytes()[start:])
+    return paths, messages
+
+
+def forecast_time_of(field):
+    return field.metadata()["forecast_time"][1]
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "copy_file_range"), reason="copy_file_range is not available"
+)
+@pytest.mark.parametrize(
+    "predicate,expected_indices",
+    [
+        (None, [0, 1, 2, 3, 4, 5]),
+        (lambda field: forecast_time_of(field) == 2, [1, 4]),
+        (lambda field: forecast_time_of(field) in (0, 1), [0, 1, 3, 4]),
+        (lambda field: forecast_time_of(field) >= 3, [2, 5]),
+        (lambda field: False, []),
+    ],
+)
+def test_copying_messages(tmp_path, monkeypatch, srcs, predicate, expected_indices):
+    paths, messages = srcs
+    calls = []
+    copy_file_range = os.copy_file_range
+
+    def counting_copy_file_range(*args):
+        calls.append(args)
+        return copy_file_range(*args)
+
+    monkeypatch.setattr(os, "copy_file_range", counting_copy_file_range)
+    dst = tmp_path / "dst.grib2"
+    with open(dst, "wb") as f:
+        f.write(b"header")
+        num = copy_messages(f, paths, predicate)
+        f.write(b"footer")
+
+    expected = b"".join(messages[i] for i in expected_indices)
+    assert dst.read_bytes() == b"header" + expected + b"footer"
+    assert num == len(expected_indices)
+    # consecutive messages are copied at once
+    runs = sum(
+        1
+        for j, i in enumerate(expected_indices)
+        if j == 0 or i != expected_indices[j - 1] + 1 or i == 3
+    )
+    assert len(calls) == runs
+
+
+@pytest.mark.parametrize("unsupported", [1, 2])
+def test_copying_messages_without_kernel_copy(tmp_path, monkeypatch, srcs, unsupported):
+    paths, messages = srcs
+
+    def raise_unsupported(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(os, "copy_file_range", raise_unsupported, raising=False)
+    if unsupported == 2:
+        monkeypatch.setattr(os, "sendfile", raise_unsupported, raising=False)
+    dst = tmp_path / "dst.grib2"
+    with open(dst, "wb") as f:
+        assert copy_messages(f, paths) == len(messages)
+    assert dst.read_bytes() == b"".join(messages)
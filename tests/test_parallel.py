@@ -0,0 +1,149 @@
+import functools
+import threading
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pytest
+from helpers import (
+    NonSeekableStream,
+    create_grid,
+    create_ieee_float_encoder,
+    create_product,
+    write_sequentially,
+)
+
+from gribcoder import (
+    Field,
+    FixedSurface,
+    Grib2MessageWriter,
+    Identification,
+    Indicator,
+    Message,
+    SimplePackingEncoder,
+    write_fields,
+)
+
+
+def create_fields(num):
+    grid = create_grid()
+    mask = np.arange(12).reshape(3, 4) % 5 == 0
+    fields = []
+    for i in range(num):
+        data = np.ma.MaskedArray(np.arange(12.0).reshape(3, 4) * i, mask=mask)
+        if i % 4 == 3:
+            data = data.data[:, ::-1]  # non-contiguous data without a mask
+        if i % 2 == 0:
+            encoder = functools.partial(
+                SimplePackingEncoder.auto_parametrized_from, nbit=10
+            )
+        else:
+            encoder = create_ieee_float_encoder
+        product = create_product(i, FixedSurface(103, 0, 2))
+        fields.append(Field(product, data, encoder, grid if i % 3 == 0 else None))
+    return fields
+
+
+@pytest.mark.parametrize(
+    "max_workers,max_in_flight_bytes,use_processes",
+    [
+        (None, 1 << 28, False),
+        (1, 1 << 28, False),
+        (4, 1, False),
+        (4, 300, False),
+        (2, 1 << 28, True),
+        (2, 300, True),
+    ],
+)
+def test_writing_fields_in_parallel(max_workers, max_in_flight_bytes, use_processes):
+    fields = create_fields(10)
+
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with BytesIO() as f:
+        with Grib2MessageWriter(f, ind, ident) as grib2:
+            write_fields(grib2, fields, max_workers, max_in_flight_bytes, use_processes)
+        actual = f.getvalue()
+
+    with BytesIO() as f:
+        write_sequentially(f, [Message(ind, ident, fields)])
+        expected = f.getvalue()
+
+    assert actual == expected
+    # bitmaps are not written again except for the first one and those after fields
+    # without masks
+    assert expected.count(b"\x00\x00\x00\x06\x06\xfe") == 5
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+@pytest.mark.parametrize("seekable,gather", [(True, True), (False, False)])
+def test_writing_fields_in_parallel_to_gathering_writer(
+    use_processes, seekable, gather
+):
+    fields = create_fields(10)
+
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    f = BytesIO() if seekable else NonSeekableStream()
+    with Grib2MessageWriter(f, ind, ident, gather=gather) as grib2:
+        write_fields(grib2, fields, 2, use_processes=use_processes)
+    actual = f.getvalue() if seekable else b"".join(f.chunks)
+
+    with BytesIO() as f:
+        write_sequentially(f, [Message(ind, ident, fields)])
+        expected = f.getvalue()
+
+    assert actual == expected
+
+
+def test_in_flight_bytes_limit():
+    lock = threading.Lock()
+    counts = {"active": 0, "max": 0}
+
+    def encoder(data):
+        with lock:
+            counts["active"] += 1
+            counts["max"] = max(counts["max"], counts["active"])
+        return SimplePackingEncoder.auto_parametrized_from(data, nbit=8)
+
+    grid = create_grid()
+    fields = [
+        Field(create_product(i, FixedSurface(103, 0, 2)), np.zeros((3, 4)), encoder)
+        for i in range(8)
+    ]
+    fields[0] = fields[0]._replace(grid=grid)
+
+    written = []
+
+    class RecordingWriter(Grib2MessageWriter):
+        def _write_sect7(self, encoder):
+            super()._write_sect7(encoder)
+            with lock:
+                counts["active"] -= 1
+            written.append(counts["max"])
+
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with BytesIO() as f:
+        with RecordingWriter(f, ind, ident) as grib2:
+            write_fields(grib2, fields, 4, np.zeros((3, 4)).nbytes * 2)
+
+    assert len(written) == 8
+    assert counts["max"] <= 2
+
+
+def failing_encoder(data):
+    raise ValueError("failed")
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_error_in_encoding_fields(use_processes):
+    fields = create_fields(4)
+    fields[2] = fields[2]._replace(encoder=failing_encoder)
+
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with BytesIO() as f:
+        with pytest.raises(ValueError):
+            with Grib2MessageWriter(f, ind, ident) as grib2:
+                write_fields(grib2, fields, 2, use_processes=use_processes)
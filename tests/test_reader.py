@@ -0,0 +1,262 @@
+import struct
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pytest
+from helpers import create_grid, create_product
+
+from gribcoder import (
+    ComplexPackingEncoder,
+    FixedSurface,
+    Grib2MessageWriter,
+    Grib2Reader,
+    Identification,
+    IeeeFloatEncoder,
+    Indicator,
+    LatitudeLongitudeGrid,
+    PngPackingEncoder,
+    RunLengthPackingEncoder,
+    SimplePackingEncoder,
+)
+from gribcoder.encoders import _png_chunk
+from gribcoder.reader import _decode_png
+
+DATA = np.arange(12.0).reshape(3, 4) * 1.5 - 4
+MASK = np.arange(12).reshape(3, 4) % 5 == 0
+
+
+def write_message(f, encoders, data, grid=None):
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1, 6), 0, 1)
+    with Grib2MessageWriter(f, ind, ident) as grib2:
+        grib2._write_sect3(create_grid() if grid is None else grid)
+        for i, encoder in enumerate(encoders):
+            grib2._write_sect4(create_product(i, FixedSurface(103, 0, 2)))
+            encoder.input(data)
+            grib2._write_sect5(encoder)
+            grib2._write_sect6(encoder)
+            grib2._write_sect7(encoder)
+
+
+@pytest.mark.parametrize(
+    "encoder,atol",
+    [
+        (SimplePackingEncoder(-4.0, 0, 0, 0), 16.5),
+        (SimplePackingEncoder(-8.0, -1, 0, 7), 0.0),
+        (SimplePackingEncoder(-40.0, 0, 1, 8), 0.0),
+        (SimplePackingEncoder(-400.0, 1, 2, 12), 0.0),
+        (SimplePackingEncoder(-4000.0, 0, 3, 16), 0.0),
+        (SimplePackingEncoder(-4e6, 0, 6, 24), 0.0),
+        (SimplePackingEncoder(-4e8, 0, 8, 32), 0.0),
+        (SimplePackingEncoder(-4000.0, 0, 3, 16).chunked(8), 0.0),
+        (IeeeFloatEncoder(1), 0.0),
+        (IeeeFloatEncoder(2), 0.0),
+        (ComplexPackingEncoder(-4.0, 0, 0, 0), 16.5),
+        (ComplexPackingEncoder(-40.0, 0, 1, 8, spatial_differencing=0), 0.0),
+        (ComplexPackingEncoder(-40.0, 0, 1, 8, spatial_differencing=1), 0.0),
+        (ComplexPackingEncoder(-40.0, 0, 1, 8, spatial_differencing=2), 0.0),
+        (PngPackingEncoder(-4.0, 0, 0, 0), 16.5),
+        (PngPackingEncoder(-40.0, 0, 1, 8), 0.0),
+        (PngPackingEncoder(-4000.0, 0, 3, 16, filter_type="sub"), 0.0),
+        (PngPackingEncoder(-4e6, 0, 6, 24, filter_type="up"), 0.0),
+        (PngPackingEncoder(-4e8, 0, 8, 32, filter_type="sub"), 0.0),
+    ],
+)
+@pytest.mark.parametrize("masked", [False, True])
+def test_reading_fields(tmp_path, encoder, atol, masked):
+    data = np.ma.MaskedArray(DATA, mask=MASK) if masked else DATA
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        write_message(f, [encoder, encoder], data)
+        write_message(f, [encoder], data)
+
+    with Grib2Reader(path) as reader:
+        assert len(reader) == 3
+        for i, field in enumerate(reader):
+            actual = field.values()
+            assert field.shape == (3, 4)
+            assert isinstance(actual, np.ma.MaskedArray) == masked
+            assert np.array_equal(np.ma.getmaskarray(actual), np.ma.getmaskarray(data))
+            assert np.ma.allclose(actual, data, atol=atol)
+            assert field.reftime == datetime(2022, 10, 1, 6)
+            assert field.metadata()["forecast_time"] == [1, 0 if i == 2 else i]
+        if masked:
+            # the second field refers to the bitmap of the first one
+            assert reader[0].sect6 == reader[1].sect6
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        np.full((3, 4), 2.5),
+        np.ma.MaskedArray(np.full((3, 4), 2.5), mask=MASK),
+        np.ma.MaskedArray(DATA, mask=True),
+    ],
+)
+@pytest.mark.parametrize("encoder_cls", [PngPackingEncoder, ComplexPackingEncoder])
+def test_reading_fields_without_bits(tmp_path, data, encoder_cls):
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        write_message(f, [encoder_cls.auto_parametrized_from(data, nbit=12)], data)
+
+    with Grib2Reader(path) as reader:
+        actual = reader[0].values()
+    assert np.array_equal(np.ma.getmaskarray(actual), np.ma.getmaskarray(data))
+    assert np.ma.allequal(actual, data)
+
+
+@pytest.mark.parametrize(
+    "encoder_cls,kwargs",
+    [
+        (ComplexPackingEncoder, {"spatial_differencing": 0}),
+        (ComplexPackingEncoder, {"spatial_differencing": 1}),
+        (ComplexPackingEncoder, {"spatial_differencing": 2}),
+        (PngPackingEncoder, {"filter_type": "sub"}),
+        (PngPackingEncoder, {"filter_type": "up"}),
+    ],
+)
+def test_reading_large_fields(tmp_path, encoder_cls, kwargs):
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.normal(size=(300, 400)), axis=1)
+    data = np.ma.MaskedArray(values, mask=rng.random((300, 400)) < 0.1)
+    lat, lon = np.meshgrid(
+        np.linspace(60, 30, 300), np.linspace(100, 140, 400), indexing="ij"
+    )
+    grid = LatitudeLongitudeGrid.from_ndarrays(lat, lon).shape_of_the_earth(
+        create_grid()._shape_of_the_earth
+    )
+    simple = SimplePackingEncoder.auto_parametrized_from(data, nbit=12)
+    encoder = encoder_cls(simple.r, simple.e, simple.d, simple.n, **kwargs)
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        write_message(f, [simple, encoder], data, grid)
+
+    with Grib2Reader(path) as reader:
+        expected = reader[0].values()
+        actual = reader[1].values()
+    assert np.array_equal(np.ma.getmaskarray(actual), np.ma.getmaskarray(data))
+    assert np.ma.allequal(actual, expected)
+
+
+def test_decoding_png_of_sub_octet_depth():
+    # 4-bit grayscale pixels of 2 rows of 3 pixels, each padded to 2 octets
+    scanlines = bytes([0, 0x12, 0x30, 1, 0x12, 0x1E])
+    header = struct.pack(">IIBBBBB", 3, 2, 4, 0, 0, 0, 0)
+    stream = b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(scanlines)),
+            _png_chunk(b"IEND", b""),
+        ]
+    )
+    actual = _decode_png(np.frombuffer(stream, dtype=np.uint8))
+    np.testing.assert_array_equal(actual, [1, 2, 3, 1, 2, 3])
+
+
+def filter_png(rows, filter_types, bytes_per_pixel):
+    def paeth(left, up, upper_left):
+        estimate = left + up - upper_left
+        dists = [abs(estimate - v) for v in (left, up, upper_left)]
+        return (left, up, upper_left)[dists.index(min(dists))]
+
+    scanlines = []
+    prev = [0] * len(rows[0])
+    for row, filter_type in zip(rows, filter_types):
+        line = [filter_type]
+        for j, value in enumerate(row):
+            left = row[j - bytes_per_pixel] if j >= bytes_per_pixel else 0
+            upper_left = prev[j - bytes_per_pixel] if j >= bytes_per_pixel else 0
+            up = prev[j]
+            predictor = [0, left, up, (left + up) // 2, paeth(left, up, upper_left)]
+            line.append((value - predictor[filter_type]) % 256)
+        scanlines.append(line)
+        prev = row
+    return bytes(sum(scanlines, []))
+
+
+@pytest.mark.parametrize("bit_depth,color_type", [(8, 0), (16, 0), (8, 2), (8, 6)])
+def test_decoding_png_with_filters(bit_depth, color_type):
+    bytes_per_value = bit_depth // 8 * {0: 1, 2: 3, 6: 4}[color_type]
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 256, (10, 7 * bytes_per_value)).tolist()
+    scanlines = filter_png(rows, [0, 1, 2, 3, 4, 4, 3, 2, 1, 0], bytes_per_value)
+    header = struct.pack(">IIBBBBB", 7, 10, bit_depth, color_type, 0, 0, 0)
+    stream = b"".join(
+        [
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(scanlines)),
+            _png_chunk(b"IEND", b""),
+        ]
+    )
+    actual = _decode_png(np.frombuffer(stream, dtype=np.uint8))
+    octets = np.array(rows, dtype=np.uint8).reshape(70, bytes_per_value)
+    expected = [int.from_bytes(value.tobytes(), "big") for value in octets]
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_reading_without_copy(tmp_path):
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        write_message(f, [IeeeFloatEncoder(1)], DATA)
+        write_message(f, [SimplePackingEncoder(0.0, 0, 0, 16)], DATA)
+    expected = path.read_bytes()
+
+    with Grib2Reader(path) as reader:
+        field = reader[0]
+        assert reader[1].offset == field.length
+        actual = field.values()
+        message = field.message()
+    # arrays remain valid after the reader is closed
+    assert np.shares_memory(actual, message)
+    assert not actual.flags.writeable
+    assert np.array_equal(actual, DATA)
+    assert message.tobytes() == expected[: field.length]
+
+
+def test_reading_grid_consecutive_in_j(tmp_path):
+    lat = np.tile(np.linspace(40, 30, 3), (4, 1))
+    lon = np.tile(np.linspace(130, 140, 4), (3, 1)).T
+    grid = LatitudeLongitudeGrid.from_ndarrays(lat, lon).shape_of_the_earth(
+        create_grid()._shape_of_the_earth
+    )
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        write_message(f, [IeeeFloatEncoder(2)], DATA.T.copy(), grid)
+
+    with Grib2Reader(path) as reader:
+        assert reader[0].shape == (4, 3)
+        assert np.array_equal(reader[0].values(), DATA.T)
+
+
+def test_reading_empty_file(tmp_path):
+    path = tmp_path / "input.grib2"
+    path.write_bytes(b"")
+    with Grib2Reader(path) as reader:
+        assert len(reader) == 0
+
+
+def test_errors_in_reading(tmp_path):
+    path = tmp_path / "input.grib2"
+    with open(path, "wb") as f:
+        levels = np.arange(12).reshape(3, 4) % 3 + 1
+        write_message(f, [RunLengthPackingEncoder([10, 20, 30], -1, 8)], levels)
+    message = path.read_bytes()
+
+    with Grib2Reader(path) as reader:
+        with pytest.raises(RuntimeError) as e:
+            reader[0].values()
+        assert str(e.value) == "unsupported data representation template: 5.200"
+
+    for content, error_message in [
+        (message + b"GRIB", f"truncated message at {len(message)}"),
+        (message[:-1], "truncated message at 0"),
+        (b"x" * 16, "GRIB2 message not found at 0"),
+        (message[:-4] + b"7770", f"end of message not found at {len(message) - 4}"),
+    ]:
+        path.write_bytes(content)
+        with pytest.raises(RuntimeError) as e:
+            Grib2Reader(path)
+        assert str(e.value) == error_message
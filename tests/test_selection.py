@@ -0,0 +1,99 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from helpers import write_sections
+
+from gribcoder import (
+    ComplexPackingEncoder,
+    PngPackingEncoder,
+    SimplePackingEncoder,
+    select_encoder,
+)
+from gribcoder.selection import _sample_bands
+
+
+def sect7_len(encoder):
+    with BytesIO() as f:
+        return encoder.write_sect7(f)
+
+
+def create_smooth_field(shape=(300, 400)):
+    lat, lon = np.meshgrid(
+        np.linspace(-np.pi / 2, np.pi / 2, shape[0]),
+        np.linspace(0, 2 * np.pi, shape[1]),
+        indexing="ij",
+    )
+    return 288.0 - 40.0 * np.sin(lat) ** 2 + 5.0 * np.sin(3 * lon) * np.cos(2 * lat)
+
+
+def create_sparse_field(shape=(300, 400)):
+    rng = np.random.default_rng(0)
+    return np.where(rng.random(shape) < 0.9, 0.0, rng.gamma(0.5, 3.0, shape))
+
+
+@pytest.mark.parametrize(
+    "data,expected_cls",
+    [
+        (np.full((300, 400), 5.0), SimplePackingEncoder),
+        (
+            np.random.default_rng(0).integers(0, 4096, (300, 400)).astype(float),
+            SimplePackingEncoder,
+        ),
+        (create_smooth_field(), (ComplexPackingEncoder, PngPackingEncoder)),
+        (create_sparse_field(), PngPackingEncoder),
+    ],
+)
+def test_selecting_encoder(data, expected_cls):
+    actual = select_encoder(data, nbit=12)
+    simple = SimplePackingEncoder.auto_parametrized_from(data, nbit=12)
+    assert type(actual) in np.atleast_1d(expected_cls)
+    # values are scaled in the same way whichever method is chosen
+    assert (actual.r, actual.e, actual.d) == (simple.r, simple.e, simple.d)
+    assert sect7_len(actual) <= sect7_len(simple)
+    for cls in (ComplexPackingEncoder, PngPackingEncoder):
+        other = cls.auto_parametrized_from(data, nbit=12)
+        assert sect7_len(actual) <= sect7_len(other)
+
+
+def test_selecting_encoder_within_time_budget():
+    data = create_smooth_field()
+    actual = select_encoder(data, nbit=12, time_budget=0.0)
+    assert type(actual) is SimplePackingEncoder
+
+
+@pytest.mark.parametrize("shape", [(30, 40), (300, 400)])
+def test_selecting_encoder_with_missing_values(shape):
+    data = create_smooth_field(shape)
+    mask = data < 260.0  # polar regions
+    data[mask] = np.nan
+    actual = select_encoder(data, missing=np.nan, nbit=12)
+    masked = np.ma.MaskedArray(data, mask=mask)
+    expected = type(actual)(actual.r, actual.e, actual.d, actual.n)
+    if isinstance(actual, ComplexPackingEncoder):
+        expected.spatial_differencing = actual.spatial_differencing
+    if isinstance(actual, PngPackingEncoder):
+        expected.filter_type = actual.filter_type
+    assert write_sections(actual) == write_sections(expected.input(masked))
+
+
+@pytest.mark.parametrize(
+    "shape,sample_size,expected_shape",
+    [
+        ((300, 400), 1 << 16, (160, 400)),
+        ((300, 400), 4000, (8, 400)),
+        ((300, 400), 100, (1, 400)),
+        ((30, 40), 1 << 16, (30, 40)),
+        ((100_000,), 1000, (1000,)),
+    ],
+)
+def test_sampling_bands(shape, sample_size, expected_shape):
+    data = np.arange(np.prod(shape)).reshape(shape)
+    actual = _sample_bands(data, sample_size)
+    assert actual.shape == expected_shape
+    if actual is not data:
+        # bands of consecutive rows including the first and the last ones
+        rows = actual.reshape(len(actual), -1)[:, 0] // (data.size // len(data))
+        assert rows[0] == 0
+        assert len(rows) == 1 or rows[-1] == len(data) - 1
+        assert np.count_nonzero(np.diff(rows) != 1) == min(len(actual), 8) - 1
@@ -0,0 +1,112 @@
+from datetime import datetime
+from io import BytesIO
+from typing import BinaryIO
+
+import numpy as np
+import pytest
+from helpers import create_grid, create_product
+
+from gribcoder import (
+    BaseProductDefinition,
+    FixedSurface,
+    Grib2MessageWriter,
+    Identification,
+    Indicator,
+    MessageTemplate,
+    SimplePackingEncoder,
+)
+
+
+def create_template(product):
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    return MessageTemplate(ind, ident, create_grid(), product)
+
+
+def create_encoder(offset):
+    data = np.arange(12.0).reshape(3, 4) + offset
+    return SimplePackingEncoder.auto_parametrized_from(data, nbit=8)
+
+
+def write_message_directly(f, product, encoder):
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with Grib2MessageWriter(f, ind, ident) as grib2:
+        grib2._write_sect3(create_grid())
+        grib2._write_sect4(product)
+        grib2._write_sect5(encoder)
+        grib2._write_sect6(encoder)
+        grib2._write_sect7(encoder)
+
+
+@pytest.mark.parametrize(
+    "forecast_time,surface",
+    [
+        (None, None),
+        (6, None),
+        (None, FixedSurface(103, -1, 25)),
+        (12, FixedSurface(100, 0, 850)),
+    ],
+)
+def test_message_template(forecast_time, surface):
+    template = create_template(create_product(0, FixedSurface(103, 0, 2)))
+    surfaces = None if surface is None else (surface, None)
+
+    with BytesIO() as f:
+        for offset in range(3):
+            length = template.write(f, create_encoder(offset), forecast_time, surfaces)
+        actual = f.getvalue()
+
+    expected_product = create_product(
+        0 if forecast_time is None else forecast_time,
+        FixedSurface(103, 0, 2) if surface is None else surface,
+    )
+    with BytesIO() as f:
+        for offset in range(3):
+            write_message_directly(f, expected_product, create_encoder(offset))
+        expected = f.getvalue()
+
+    assert actual == expected
+    assert length * 3 == len(expected)
+
+
+def test_message_template_with_multiple_fields():
+    template = create_template(create_product(0, FixedSurface(103, 0, 2)))
+
+    with BytesIO() as f:
+        with template.writer(f) as grib2:
+            grib2._write_sect3(template.grid_section())
+            for hour in range(3):
+                encoder = create_encoder(hour)
+                grib2._write_sect4(template.product_section(forecast_time=hour))
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+        actual = f.getvalue()
+
+    ind = Indicator(0)
+    ident = Identification(34, 0, 29, 0, 0, datetime(2022, 10, 1), 0, 1)
+    with BytesIO() as f:
+        with Grib2MessageWriter(f, ind, ident) as grib2:
+            grib2._write_sect3(create_grid())
+            for hour in range(3):
+                encoder = create_encoder(hour)
+                grib2._write_sect4(create_product(hour, FixedSurface(103, 0, 2)))
+                grib2._write_sect5(encoder)
+                grib2._write_sect6(encoder)
+                grib2._write_sect7(encoder)
+        expected = f.getvalue()
+
+    assert actual == expected
+
+
+class EmptyProductDefinition(BaseProductDefinition):
+    def write(self, f: BinaryIO) -> int:
+        return 0
+
+
+def test_errors_in_patching_product_section():
+    template = create_template(EmptyProductDefinition())
+    with pytest.raises(RuntimeError) as e:
+        template.product_section(forecast_time=6)
+    assert str(e.value) == "only Section 4 with template 4.0 can be patched"
@@ -1,6 +1,19 @@
+import os
+from io import BytesIO
+
+import numpy as np
 import pytest
 
-from gribcoder.utils import create_sect_header, grib_signed
+from gribcoder.utils import (
+    BitPacker,
+    BufferWriter,
+    GatherWriter,
+    create_sect_header,
+    from_grib_signed,
+    grib_signed,
+    pack_bits,
+    unpack_bits,
+)
 
 
 def test_sect_header_creation():
@@ -19,3 +32,124 @@ def test_sect_header_creation():
 def test_grib_signed(input_, byte_length, expected):
     actual = grib_signed(input_, byte_length)
     assert actual == expected
+    assert from_grib_signed(actual, byte_length) == input_
+
+
+@pytest.mark.parametrize(
+    "values,nbit,expected",
+    [
+        ([1, 0, 1], 1, [0b10100000]),
+        ([1, 2, 3], 2, [0b01101100]),
+        ([0xABC, 0xDEF], 12, [0xAB, 0xCD, 0xEF]),
+        ([0xABC, 0xDEF, 0x123], 12, [0xAB, 0xCD, 0xEF, 0x12, 0x30]),
+        ([0x1234, 0xABCD], 16, [0x12, 0x34, 0xAB, 0xCD]),
+        ([0x123456], 24, [0x12, 0x34, 0x56]),
+        ([0x1FFFFFFFF], 33, [0xFF, 0xFF, 0xFF, 0xFF, 0x80]),
+        ([1, 2, 3], 0, []),
+        ([], 12, []),
+        ([0b1, 0b10, 0b111], np.array([1, 2, 3]), [0b11011100]),
+    ],
+)
+def test_bit_packing(values, nbit, expected):
+    actual = pack_bits(np.array(values), nbit)
+    np.testing.assert_array_equal(actual, np.array(expected, dtype=np.uint8))
+
+
+@pytest.mark.parametrize("nbit", [1, 7, 12, 24, 31])
+def test_bit_packing_of_long_sequences(nbit):
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2**nbit, 70_001)
+    actual = pack_bits(values, nbit)
+    bits = "".join(format(v, f"0{nbit}b") for v in values)
+    bits += "0" * (-len(bits) % 8)
+    expected = np.array(
+        [int(bits[i : i + 8], 2) for i in range(0, len(bits), 8)], dtype=np.uint8
+    )
+    assert len(actual) == -(-len(values) * nbit // 8)
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("nbit", [0, 1, 7, 8, 12, 24, 31, 33, 64])
+@pytest.mark.parametrize("count", [0, 3, 70_001])
+def test_bit_unpacking(nbit, count):
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2 ** min(nbit, 63), count, dtype=np.uint64)
+    actual = unpack_bits(pack_bits(values, nbit), nbit, count)
+    np.testing.assert_array_equal(actual, values)
+
+
+@pytest.mark.parametrize("max_nbit", [0, 9, 33])
+@pytest.mark.parametrize("count", [0, 3, 70_001])
+def test_bit_unpacking_of_widths(max_nbit, count):
+    rng = np.random.default_rng(0)
+    nbit = rng.integers(0, max_nbit + 1, count)
+    values = rng.integers(0, 2**nbit, count, dtype=np.uint64)
+    actual = unpack_bits(pack_bits(values, nbit), nbit, count)
+    np.testing.assert_array_equal(actual, values)
+
+
+def test_bit_packing_across_calls():
+    packer = BitPacker()
+    octets = [*packer.pack(np.array([0b101]), 3), *packer.pack(np.array([0x1F]), 5)]
+    octets.append(packer.flush())
+    np.testing.assert_array_equal(np.concatenate(octets), [0b10111111])
+
+
+def test_buffer_writer():
+    buf = bytearray(8)
+    f = BufferWriter(buf, 1)
+    assert f.write(b"ab") == 2
+    f.reserve(3)[:] = [1, 2, 3]
+    assert f.tell() == 6
+    f.seek(0)
+    f.write(np.array([0xFF], dtype=np.uint8))
+    assert bytes(buf) == b"\xffab\x01\x02\x03\x00\x00"
+
+    with pytest.raises(RuntimeError) as e:
+        f.seek(0, 2)
+    assert str(e.value) == "only absolute positions are supported"
+    f.seek(6)
+    with pytest.raises(RuntimeError) as e:
+        f.write(b"abc")
+    assert str(e.value) == "buffer is too small"
+
+
+def test_gather_writer():
+    f = GatherWriter()
+    header = np.array([1, 2, 3, 4], dtype=">u2")
+    assert f.write(header) == 8
+    f.write(b"abc")
+    f.write(np.zeros(1 << 16, dtype=np.uint8))
+    f.write(b"xyz")
+    f.seek(8)
+    f.write(b"ABC")
+    f.seek(len(header) * 2 + 3 + (1 << 16) + 3)
+    expected = header.tobytes() + b"ABC" + bytes(1 << 16) + b"xyz"
+
+    with BytesIO() as out:
+        assert f.write_to(out) == len(expected)
+        assert out.getvalue() == expected
+
+    with pytest.raises(RuntimeError) as e:
+        f.seek(0)
+        f.write(b"ab")
+    assert str(e.value) == "only whole buffers can be overwritten"
+
+
+def test_gather_writer_with_partial_writes(tmp_path, monkeypatch):
+    writev = os.writev
+
+    def short_writev(fd, buffers):
+        # writes at most 3 octets of the first buffer at a time
+        return writev(fd, [buffers[0][:3]])
+
+    monkeypatch.setattr(os, "writev", short_writev)
+    f = GatherWriter()
+    for chunk in [b"abcde", b"", b"f", b"ghijklm"]:
+        f.write(chunk)
+    path = tmp_path / "output"
+    with open(path, "wb") as out:
+        out.write(b"0")
+        f.write_to(out)
+        out.write(b"1")
+    assert path.read_bytes() == b"0abcdefghijklm1"